@@ -2,10 +2,11 @@
 
 import streamlit as st
 import os
+import shutil
 import tempfile
-from src.infochat_agent.scrape import WebScraper, save_docstore
+from src.infochat_agent.scrape import WebScraper, enable_request_cache, save_docstore
 from src.infochat_agent.index import build_index_from_docstore
-from src.infochat_agent.rag import RAGPipeline
+from src.infochat_agent.registry import get_pipeline, forget, start_warmup, is_ready
 from src.infochat_agent.config import config
 
 # Page config
@@ -23,6 +24,11 @@ if 'index_dir' not in st.session_state:
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 
+# Load the embedding model once per server process, in the background
+if 'warmup_started' not in st.session_state:
+    start_warmup()
+    st.session_state.warmup_started = True
+
 # Title and description
 st.title("🤖 InfoChatAgent")
 st.markdown("**Web Scraping + RAG Agent** - Scrape web pages and ask questions with AI-powered answers")
@@ -30,6 +36,7 @@ st.markdown("**Web Scraping + RAG Agent** - Scrape web pages and ask questions w
 # Sidebar for configuration
 with st.sidebar:
     st.header("Configuration")
+    st.caption("🟢 Model ready" if is_ready() else "🟡 Loading model...")
     
     # Scraping options
     st.subheader("📄 Scraping")
@@ -63,6 +70,7 @@ with st.sidebar:
                 index_dir = os.path.join(temp_dir, "index")
                 
                 # Scrape
+                enable_request_cache()
                 scraper = WebScraper()
                 documents = scraper.scrape_multiple([url_input], follow_links, link_limit)
                 
@@ -73,7 +81,10 @@ with st.sidebar:
                     # Build index
                     build_index_from_docstore(docstore_path, index_dir)
                     
-                    # Update session state
+                    # Update session state, releasing the index this build replaces
+                    if st.session_state.index_dir:
+                        forget(st.session_state.index_dir)
+                        shutil.rmtree(os.path.dirname(st.session_state.index_dir), ignore_errors=True)
                     st.session_state.index_built = True
                     st.session_state.index_dir = index_dir
                     st.session_state.documents_count = len(documents)
@@ -100,6 +111,12 @@ with st.sidebar:
         value=config.top_k,
         help="Number of relevant passages to retrieve"
     )
+    
+    hybrid = st.checkbox(
+        "Hybrid keyword + semantic search",
+        value=config.hybrid_search,
+        help="Also rank passages by BM25 keyword match, so exact part numbers and error codes are found"
+    )
 
 # Main content area
 if not st.session_state.index_built:
@@ -172,22 +189,42 @@ else:
             st.rerun()
     
     if ask_button and question:
-        with st.spinner("Searching and generating answer..."):
-            try:
-                # Initialize RAG pipeline
-                rag = RAGPipeline(st.session_state.index_dir)
-                
-                # Get answer
-                response = rag.ask(question, use_llm=use_llm, top_k=top_k)
-                
-                # Add to chat history
-                st.session_state.chat_history.append((question, response))
-                
-                # Clear input and rerun
-                st.rerun()
-                
-            except Exception as e:
-                st.error(f"❌ Error: {str(e)}")
+        try:
+            # Shared pipeline; only reloaded when the index changes
+            rag = get_pipeline(st.session_state.index_dir, hybrid=hybrid)
+            
+            # Render passages as soon as retrieval finishes, then the answer as it streams
+            st.markdown(f"**Q{len(st.session_state.chat_history) + 1}:** {question}")
+            st.markdown("**Answer:**")
+            answer_placeholder = st.empty()
+            answer = ""
+            response = None
+            
+            with st.spinner("Searching..."):
+                events = rag.ask_stream(question, use_llm=use_llm, top_k=top_k)
+                retrieval = next(events)
+            
+            if retrieval['passages']:
+                with st.expander("📄 Relevant Passages"):
+                    for j, passage in enumerate(retrieval['passages'][:3], 1):
+                        st.markdown(f"**{j}. {passage['source']}** (score: {passage['score']:.3f})")
+                        st.markdown(f"> {passage['text']}")
+            
+            for event in events:
+                if event['type'] == 'token':
+                    answer += event['text']
+                    answer_placeholder.info(answer + "▌")
+                elif event['type'] == 'done':
+                    response = event['response']
+            
+            # Add to chat history
+            st.session_state.chat_history.append((question, response))
+            
+            # Clear input and rerun
+            st.rerun()
+            
+        except Exception as e:
+            st.error(f"❌ Error: {str(e)}")
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Compare embedding backends (torch vs int8 ONNX Runtime): load time, single-query latency,
+batch throughput and peak RSS. Each backend runs in its own process so RSS is not shared."""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+WORDS = ("python error index vector battery charging nexon range service engine "
+         "warning code reset sensor motor brake light manual update install").split()
+
+def run_backend(backend: str, args) -> dict:
+    from infochat_agent.embeddings import EmbeddingModel
+    
+    rng = random.Random(0)
+    queries = [' '.join(rng.choices(WORDS, k=12)) for _ in range(args.queries)]
+    passages = [' '.join(rng.choices(WORDS, k=args.passage_words)) for _ in range(args.passages)]
+    
+    start = time.perf_counter()
+    model = EmbeddingModel(backend=backend)
+    load_seconds = time.perf_counter() - start
+    model.encode_single("warmup")
+    
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model.encode_single(query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    
+    start = time.perf_counter()
+    model.model.encode(passages, batch_size=args.batch_size)
+    batch_seconds = time.perf_counter() - start
+    
+    return {
+        'backend': backend,
+        'load_seconds': load_seconds,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'passages_per_second': len(passages) / batch_seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'])
+    parser.add_argument('--queries', type=int, default=200, help='Single-query encodes for latency')
+    parser.add_argument('--passages', type=int, default=2000, help='Passages for batch throughput')
+    parser.add_argument('--passage-words', type=int, default=150)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # Measure one backend in this process
+    args = parser.parse_args()
+    
+    if args.run:
+        print(json.dumps(run_backend(args.run, args)))
+        return
+    
+    passthrough = ['--queries', str(args.queries), '--passages', str(args.passages),
+                   '--passage-words', str(args.passage_words), '--batch-size', str(args.batch_size)]
+    print(f"{'backend':>8} {'load s':>7} {'p50 ms':>7} {'p99 ms':>7} {'passages/s':>11} {'peak RSS MB':>12}")
+    for backend in args.backends:
+        result = subprocess.run([sys.executable, __file__, '--run', backend] + passthrough,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"{backend:>8} failed: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        row = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{backend:>8} {row['load_seconds']:7.2f} {row['p50_ms']:7.2f} {row['p99_ms']:7.2f} "
+              f"{row['passages_per_second']:11.1f} {row['peak_rss_mb']:12.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Measure BM25 build time and per-query sparse search latency on a synthetic corpus"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from infochat_agent.sparse import BM25Index, reciprocal_rank_fusion
+
+WORDS = ("python error index vector battery charging nexon range service engine "
+         "warning code reset sensor motor brake light manual update install").split()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunks', type=int, default=100_000)
+    parser.add_argument('--words', type=int, default=80, help='Words per chunk')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--top-k', type=int, default=15)
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    codes = [f"p{rng.randrange(16**4):04x}" for _ in range(5000)]  # Rare exact tokens
+    texts = [' '.join(rng.choices(WORDS, k=args.words) + [rng.choice(codes)]) for _ in range(args.chunks)]
+    
+    start = time.perf_counter()
+    bm25 = BM25Index.build(texts)
+    print(f"build: {time.perf_counter() - start:.2f}s for {args.chunks} chunks, "
+          f"{len(bm25.vocab)} terms, {bm25.weights.nnz} postings")
+    
+    for name, make_query in (
+        ('exact code', lambda: f"what does {rng.choice(codes)} mean"),
+        ('common words', lambda: ' '.join(rng.choices(WORDS, k=5))),
+    ):
+        queries = [make_query() for _ in range(args.queries)]
+        start = time.perf_counter()
+        for query in queries:
+            hits = bm25.search(query, args.top_k)
+            reciprocal_rank_fusion([[row for row, _ in hits], range(args.top_k)])
+        elapsed = time.perf_counter() - start
+        print(f"{name:>13}: {elapsed / len(queries) * 1000:7.3f} ms/query (search + fusion)")
+
+if __name__ == '__main__':
+    main()
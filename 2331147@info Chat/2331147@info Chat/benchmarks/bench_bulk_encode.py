@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Compare fixed-size batching with length-bucketed, memory-capped bulk encoding on a corpus of
+mixed-length chunks: tokens/sec, padding and peak RSS. Each mode runs in its own process."""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+WORDS = ("python error index vector battery charging nexon range service engine "
+         "warning code reset sensor motor brake light manual update install").split()
+
+def run_mode(mode: str, args) -> dict:
+    from infochat_agent.embeddings import EmbeddingModel
+    from infochat_agent.processing import token_counts
+    
+    rng = random.Random(0)
+    # Mostly short list items and headings, with some full-size text blocks
+    texts = [' '.join(rng.choices(WORDS, k=rng.choice([4, 8, 16, 32]) if rng.random() > args.long_share
+                                  else args.long_words)) for _ in range(args.chunks)]
+    model = EmbeddingModel(args.model)
+    model.encode(texts[:8])  # Warm up
+    
+    start = time.perf_counter()
+    if mode == 'fixed':
+        model.model.encode(texts, batch_size=args.batch_size, show_progress_bar=False)
+    else:
+        model.encode_bulk(texts, memory_budget_mb=args.memory_budget_mb)
+    seconds = time.perf_counter() - start
+    
+    lengths = [min(n, model.max_seq_length) for n in token_counts(model.tokenizer, texts, add_special_tokens=True)]
+    return {
+        'mode': mode,
+        'seconds': seconds,
+        'tokens_per_second': sum(lengths) / seconds,
+        'padding': model.throughput()['padding'] if mode == 'bulk' else None,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', help='Model name or path (default: the configured embedding model)')
+    parser.add_argument('--chunks', type=int, default=4000)
+    parser.add_argument('--long-share', type=float, default=0.2, help='Fraction of chunks that are long')
+    parser.add_argument('--long-words', type=int, default=400)
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch size of the fixed mode')
+    parser.add_argument('--memory-budget-mb', type=int, default=256)
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # Measure one mode in this process
+    args = parser.parse_args()
+    
+    if args.run:
+        print(json.dumps(run_mode(args.run, args)))
+        return
+    
+    passthrough = ['--chunks', str(args.chunks), '--long-share', str(args.long_share),
+                   '--long-words', str(args.long_words), '--batch-size', str(args.batch_size),
+                   '--memory-budget-mb', str(args.memory_budget_mb)]
+    if args.model:
+        passthrough += ['--model', args.model]
+    print(f"{'mode':>6} {'seconds':>8} {'tokens/s':>10} {'padding':>8} {'peak RSS MB':>12}")
+    for mode in ('fixed', 'bulk'):
+        result = subprocess.run([sys.executable, __file__, '--run', mode] + passthrough,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"{mode:>6} failed: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        row = json.loads(result.stdout.strip().splitlines()[-1])
+        padding = f"{row['padding']:.1%}" if row['padding'] is not None else '-'
+        print(f"{mode:>6} {row['seconds']:8.2f} {row['tokens_per_second']:10,.0f} {padding:>8} "
+              f"{row['peak_rss_mb']:12.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Compare time and retained memory of chunk dicts (process_documents) against the compact ChunkStore"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from infochat_agent.processing import TextProcessor
+
+WORDS = ("python error index vector battery charging nexon range service engine "
+         "warning code reset sensor motor brake light manual update install").split()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=5000, help='Words per document')
+    parser.add_argument('--chunk-size', type=int, default=128)
+    parser.add_argument('--chunk-overlap', type=int, default=32)
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    documents = [{'url': f'bench://{i}', 'title': f'Document {i}', 'length': args.words * 7,
+                  'content': ' '.join(rng.choices(WORDS, k=args.words))}
+                 for i in range(args.documents)]
+    processor = TextProcessor(args.chunk_size, args.chunk_overlap)
+    
+    for name, build in (('dicts', processor.process_documents), ('chunk store', processor.chunk_store)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        chunks = build(documents)
+        elapsed = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        start = time.perf_counter()
+        total_chars = sum(len(chunk['text']) for chunk in chunks)
+        read_seconds = time.perf_counter() - start
+        
+        print(f"{name:>12}: {len(chunks):8d} chunks in {elapsed:6.2f}s, "
+              f"retained {retained / 1e6:8.1f} MB (peak {peak / 1e6:8.1f} MB), "
+              f"reading all texts {read_seconds:5.2f}s ({total_chars / 1e6:.0f}M chars)")
+        del chunks
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Measure near-duplicate filtering on a synthetic corpus with mirrored pages: dedup ratio,
+filter overhead and the embedding time the dropped chunks would have cost"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from infochat_agent.processing import TextProcessor
+from infochat_agent.dedup import NearDuplicateFilter
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=1500, help='Words per document')
+    parser.add_argument('--mirror-rate', type=float, default=0.3, help='Fraction of pages that are lightly edited copies')
+    parser.add_argument('--edits', type=int, default=5, help='Words changed in each mirrored page')
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--chunk-overlap', type=int, default=32)
+    parser.add_argument('--embed-ms', type=float,
+                        help='Embedding cost per chunk in ms (default: measured with the configured model)')
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    documents, originals = [], []
+    for i in range(args.documents):
+        if originals and rng.random() < args.mirror_rate:
+            words = list(rng.choice(originals))
+            for _ in range(args.edits):
+                words[rng.randrange(len(words))] = f"edit{rng.randrange(1000)}"
+        else:
+            words = [f"w{rng.randrange(50_000)}" for _ in range(args.words)]
+            originals.append(words)
+        documents.append({'url': f'bench://{i}', 'title': f'Document {i}', 'length': 0, 'content': ' '.join(words)})
+    
+    processor = TextProcessor(args.chunk_size, args.chunk_overlap)
+    start = time.perf_counter()
+    total = len(processor.chunk_store(documents))
+    chunk_seconds = time.perf_counter() - start
+    
+    dedup = NearDuplicateFilter()
+    start = time.perf_counter()
+    kept = processor.chunk_store(documents, dedup=dedup)
+    dedup_seconds = time.perf_counter() - start - chunk_seconds
+    stats = dedup.stats()
+    
+    if args.embed_ms is None:
+        from infochat_agent.registry import get_embedding_model
+        model = get_embedding_model()
+        sample = [kept[row]['text'] for row in range(min(256, len(kept)))]
+        model.encode(sample[:8])  # Warm up
+        start = time.perf_counter()
+        model.encode(sample)
+        args.embed_ms = (time.perf_counter() - start) * 1000 / len(sample)
+    
+    saved = stats['dropped'] * args.embed_ms / 1000
+    print(f"{len(documents)} documents, {total} chunks; kept {len(kept)}, dropped {stats['dropped']} "
+          f"({stats['ratio']:.1%})")
+    print(f"Dedup overhead: {dedup_seconds:.2f}s ({dedup_seconds * 1e3 / total:.3f} ms/chunk)")
+    print(f"Embedding at {args.embed_ms:.2f} ms/chunk: {total * args.embed_ms / 1000:.1f}s without dedup, "
+          f"{len(kept) * args.embed_ms / 1000:.1f}s with dedup (saves {saved:.1f}s, net {saved - dedup_seconds:.1f}s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Benchmark vectorized MMR against the previous re-encoding implementation"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from infochat_agent.embeddings import EmbeddingModel
+from infochat_agent.index import VectorIndex
+
+WORDS = ("python error index vector battery charging nexon range service engine "
+         "warning code reset sensor motor brake light manual update install").split()
+
+class CountingModel:
+    """Wraps an EmbeddingModel and counts forward passes"""
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+    
+    def encode(self, texts):
+        self.calls += 1
+        return self.model.encode(texts)
+    
+    def encode_single(self, text):
+        self.calls += 1
+        return self.model.encode_single(text)
+
+def legacy_mmr_search(index, model, query, top_k, diversity):
+    """The original implementation: re-encodes query, candidates and selections"""
+    candidates = index.search(query, top_k * 3)
+    if not candidates:
+        return []
+    selected = [candidates[0]]
+    candidates = candidates[1:]
+    query_embedding = model.encode_single(query)
+    while len(selected) < top_k and candidates:
+        best_score = -float('inf')
+        best_idx = 0
+        for i, (candidate, _) in enumerate(candidates):
+            candidate_embedding = model.encode_single(candidate['text'])
+            relevance = np.dot(query_embedding, candidate_embedding)
+            diversity_score = float('inf')
+            for selected_item, _ in selected:
+                selected_embedding = model.encode_single(selected_item['text'])
+                diversity_score = min(diversity_score, np.dot(candidate_embedding, selected_embedding))
+            mmr_score = diversity * relevance - (1 - diversity) * diversity_score
+            if mmr_score > best_score:
+                best_score = mmr_score
+                best_idx = i
+        selected.append(candidates.pop(best_idx))
+    return selected
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--diversity', type=float, default=0.7)
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    chunks = [{'text': ' '.join(rng.choices(WORDS, k=40)), 'url': f'bench://{i}', 'title': str(i)}
+              for i in range(args.chunks)]
+    queries = [' '.join(rng.choices(WORDS, k=5)) for _ in range(args.queries)]
+    
+    model = CountingModel(EmbeddingModel())
+    index = VectorIndex(model)
+    index.build_index(chunks)
+    
+    for name, run in (
+        ('legacy', lambda q: legacy_mmr_search(index, model, q, args.top_k, args.diversity)),
+        ('vectorized', lambda q: index.mmr_search(q, args.top_k, args.diversity)),
+    ):
+        model.calls = 0
+        start = time.perf_counter()
+        for query in queries:
+            run(query)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {elapsed / len(queries) * 1000:9.2f} ms/query, "
+              f"{model.calls / len(queries):7.1f} model calls/query")
+
+if __name__ == '__main__':
+    main()
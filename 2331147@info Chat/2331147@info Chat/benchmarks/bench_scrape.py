@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Measure crawl throughput of WebScraper.scrape_multiple against a local HTTP server"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import requests_cache
+from infochat_agent.scrape import WebScraper
+
+PAGE = """<html><head><title>Page {n}</title></head><body><article>
+<h1>Page {n}</h1>{paragraphs}</article></body></html>"""
+
+def make_handler(latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)  # Stand-in for network round-trip time
+            paragraphs = "".join(f"<p>Paragraph {i} of {self.path} about batteries and charging.</p>"
+                                 for i in range(20))
+            body = PAGE.format(n=self.path, paragraphs=paragraphs).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--urls', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(args.latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/page/{i}" for i in range(args.urls)]
+    
+    with requests_cache.disabled():
+        for concurrency in args.concurrency:
+            # One host, so lift the per-host limits to the level under test
+            scraper = WebScraper(concurrency=concurrency, per_host_concurrency=concurrency,
+                                 requests_per_second=0)
+            start = time.perf_counter()
+            documents = scraper.scrape_multiple(urls, concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+            assert [doc['url'] for doc in documents] == urls
+            print(f"concurrency {concurrency:3d}: {len(documents) / elapsed:8.1f} pages/s "
+                  f"({elapsed:.2f}s for {len(documents)} pages)")
+    
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
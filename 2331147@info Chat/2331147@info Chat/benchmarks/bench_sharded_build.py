@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Measure sharded index build scaling: wall time, speedup and scaling efficiency for 1..N
+worker processes on a synthetic docstore, and check the index files are identical across runs"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from infochat_agent.config import config
+from infochat_agent.index import build_index_sharded
+from infochat_agent.store import MANIFEST_FILE
+
+WORDS = ("python error index vector battery charging nexon range service engine "
+         "warning code reset sensor motor brake light manual update install").split()
+
+def index_digest(index_dir: str) -> str:
+    """Hash of every index file, ignoring the manifest's random version token"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(index_dir)):
+        with open(os.path.join(index_dir, name), 'rb') as f:
+            data = f.read()
+        if name == MANIFEST_FILE:
+            manifest = json.loads(data)
+            manifest.pop('version')
+            data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+        digest.update(name.encode('utf-8') + data)
+    return digest.hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--documents', type=int, default=400)
+    parser.add_argument('--words', type=int, default=1500, help='Words per document')
+    parser.add_argument('--model', help='Model name or path (default: the configured embedding model)')
+    parser.add_argument('--repeat', action='store_true', help='Build each worker count twice and compare the files')
+    args = parser.parse_args()
+    
+    if args.model:
+        config.embedding_model = args.model
+    
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docstore_path = os.path.join(temp_dir, "docstore.jsonl")
+        with open(docstore_path, 'w', encoding='utf-8') as f:
+            for i in range(args.documents):
+                content = ' '.join(rng.choices(WORDS, k=args.words)) + f' document{i}'
+                f.write(json.dumps({'url': f'bench://{i}', 'title': f'Document {i}', 'content': content,
+                                    'length': len(content)}) + '\n')
+        
+        results = []
+        for workers in sorted(set([1] + args.workers)):  # One worker is the baseline
+            index_dir = os.path.join(temp_dir, f"index-{workers}")
+            start = time.perf_counter()
+            build_index_sharded(docstore_path, index_dir, workers, use_cache=False, dedup=False)
+            seconds = time.perf_counter() - start
+            
+            stable = None
+            if args.repeat:
+                build_index_sharded(docstore_path, index_dir + "-again", workers, use_cache=False, dedup=False)
+                stable = index_digest(index_dir) == index_digest(index_dir + "-again")
+            results.append((workers, seconds, stable))
+        
+        print(f"\n{os.cpu_count()} CPUs")
+        print(f"{'workers':>7} {'seconds':>8} {'speedup':>8} {'efficiency':>10} {'stable':>7}")
+        baseline = results[0][1]
+        for workers, seconds, stable in results:
+            speedup = baseline / seconds
+            print(f"{workers:7d} {seconds:8.2f} {speedup:8.2f} {speedup / workers:10.0%} "
+                  f"{'-' if stable is None else stable!s:>7}")
+
+if __name__ == '__main__':
+    main()
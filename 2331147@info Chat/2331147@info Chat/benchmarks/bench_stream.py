@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Measure time-to-first-token of ask_stream against blocking ask, using a local fake OpenAI-compatible server"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from infochat_agent.config import config
+
+WORDS = ("python error index vector battery charging nexon range service engine "
+         "warning code reset sensor motor brake light manual update install").split()
+
+def make_handler(tokens: int, token_latency: float, first_token_latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            words = [f"word{i} " for i in range(tokens)]
+            time.sleep(first_token_latency)  # Stand-in for prompt processing
+            
+            if not request.get('stream'):
+                time.sleep(token_latency * tokens)
+                body = json.dumps({
+                    'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': request['model'],
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': ''.join(words)}}],
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for word in words:
+                chunk = {'id': 'bench', 'object': 'chat.completion.chunk', 'created': 0,
+                         'model': request['model'],
+                         'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(token_latency)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+        
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--token-latency-ms', type=float, default=10.0)
+    parser.add_argument('--first-token-latency-ms', type=float, default=200.0)
+    args = parser.parse_args()
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(
+        args.tokens, args.token_latency_ms / 1000, args.first_token_latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    # Point the pipeline at the fake server before it creates its client
+    config.openai_api_key = "bench"
+    config.openai_base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    
+    from infochat_agent.index import VectorIndex
+    from infochat_agent.rag import RAGPipeline, OPENAI_AVAILABLE
+    if not OPENAI_AVAILABLE:
+        sys.exit("The openai package is required for this benchmark")
+    
+    rng = random.Random(0)
+    chunks = [{'text': ' '.join(rng.choices(WORDS, k=40)), 'url': f'bench://{i}', 'title': str(i)}
+              for i in range(args.chunks)]
+    queries = [' '.join(rng.choices(WORDS, k=5)) for _ in range(args.queries)]
+    
+    index = VectorIndex()
+    index.build_index(chunks)
+    rag = RAGPipeline(index=index)
+    
+    blocking, first_token, first_passages, total = [], [], [], []
+    for query in queries:
+        rag.query_cache.clear()
+        rag.results_cache.clear()
+        start = time.perf_counter()
+        rag.ask(query, use_llm=True)
+        blocking.append(time.perf_counter() - start)
+        
+        rag.query_cache.clear()
+        rag.results_cache.clear()
+        start = time.perf_counter()
+        seen_token = False
+        for event in rag.ask_stream(query, use_llm=True):
+            now = time.perf_counter() - start
+            if event['type'] == 'retrieval':
+                first_passages.append(now)
+            elif event['type'] == 'token' and not seen_token:
+                first_token.append(now)
+                seen_token = True
+        total.append(time.perf_counter() - start)
+    
+    def ms(values):
+        return sum(values) / len(values) * 1000
+    
+    print(f"blocking ask:       {ms(blocking):8.1f} ms until anything is shown")
+    print(f"ask_stream:         {ms(first_passages):8.1f} ms to passages, "
+          f"{ms(first_token):8.1f} ms to first token, {ms(total):8.1f} ms total")
+    
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
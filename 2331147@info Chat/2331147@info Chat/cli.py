@@ -3,20 +3,30 @@
 
 import click
 import os
+import json
+import time
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
-from src.infochat_agent.scrape import WebScraper, save_docstore
-from src.infochat_agent.index import build_index_from_docstore
-from src.infochat_agent.rag import RAGPipeline
+# Command modules import torch, FAISS, scipy and the scraping stack only when a command needs them
+from src.infochat_agent.index import (VectorIndex, INDEX_TYPES, COMPRESSION_MODES, benchmark_index_types,
+                                      build_index_from_docstore, build_index_streaming, build_index_sharded,
+                                      update_index_from_docstore)
+from src.infochat_agent.store import read_manifest, open_embeddings, migrate_metadata
+from src.infochat_agent.processing import TextProcessor, CHUNKING_MODES, truncation_report
+from src.infochat_agent.registry import get_pipeline, get_embedding_model
+from src.infochat_agent.embeddings import EMBEDDING_BACKENDS, QUANTIZATION_TARGETS, export_onnx
 from src.infochat_agent.config import config
 
 console = Console()
 
 @click.group()
-def cli():
+@click.option('--backend', type=click.Choice(EMBEDDING_BACKENDS), default=None,
+              help='Embedding backend: torch, or onnx (int8-quantized ONNX Runtime) (default: EMBEDDING_BACKEND)')
+def cli(backend):
     """InfoChatAgent: Web Scraping + RAG Agent"""
-    pass
+    if backend:
+        config.embedding_backend = backend
 
 @cli.command()
 @click.option('--url', multiple=True, help='URLs to scrape')
@@ -24,17 +34,31 @@ def cli():
 @click.option('--output', default=config.default_docstore, help='Output docstore path')
 @click.option('--follow-links', is_flag=True, help='Follow StackOverflow question links')
 @click.option('--link-limit', default=10, help='Maximum links to follow')
-def scrape(url, html_dir, output, follow_links, link_limit):
+@click.option('--concurrency', default=config.scrape_concurrency, help='Concurrent fetches (per-host limits still apply)')
+@click.option('--recursive', is_flag=True, help='Include HTML files in subdirectories of --html-dir')
+@click.option('--workers', type=int, help='Processes for HTML extraction (default: CPU count)')
+@click.option('--incremental', is_flag=True,
+              help='Only re-extract HTML files changed since the last run and merge them into --output')
+def scrape(url, html_dir, output, follow_links, link_limit, concurrency, recursive, workers, incremental):
     """Scrape web pages or HTML files"""
-    scraper = WebScraper()
+    from src.infochat_agent.scrape import WebScraper, enable_request_cache, save_docstore
+    
+    enable_request_cache()
+    scraper = WebScraper(concurrency=concurrency)
     documents = []
     
     if url:
         console.print(f"[blue]Scraping {len(url)} URLs...[/blue]")
         documents = scraper.scrape_multiple(list(url), follow_links, link_limit)
+    elif html_dir and incremental:
+        console.print(f"[blue]Updating {output} from HTML files in {html_dir}...[/blue]")
+        stats = scraper.update_html_docstore(html_dir, output, recursive, workers)
+        console.print(f"[green]{stats['changed']} files changed and {stats['removed']} removed since the last run; "
+                      f"saved {stats['documents']} documents to {output}[/green]")
+        return
     elif html_dir:
         console.print(f"[blue]Scraping HTML files from {html_dir}...[/blue]")
-        documents = scraper.scrape_html_files(html_dir)
+        documents = scraper.scrape_html_files(html_dir, recursive, workers)
     else:
         console.print("[red]Error: Provide either --url or --html-dir[/red]")
         return
@@ -65,36 +89,213 @@ def scrape(url, html_dir, output, follow_links, link_limit):
 @cli.command()
 @click.option('--docstore', default=config.default_docstore, help='Input docstore path')
 @click.option('--index-dir', default=config.default_index_dir, help='Output index directory')
-def index(docstore, index_dir):
+@click.option('--update', is_flag=True, help='Add new and replace changed pages in an existing index')
+@click.option('--no-cache', is_flag=True, help='Do not reuse or store cached chunk embeddings')
+@click.option('--index-type', type=click.Choice(('auto',) + INDEX_TYPES), default=config.index_type,
+              help='FAISS index type (auto picks by corpus size)')
+@click.option('--streaming', is_flag=True, help='Embed in fixed-size batches with bounded memory')
+@click.option('--batch-size', default=config.embed_batch_size, help='Chunks per batch with --streaming or --workers')
+@click.option('--chunking', type=click.Choice(CHUNKING_MODES), default=None,
+              help='words: fixed word windows; tokens: sentences packed to the model\'s max sequence length '
+                   '(default: chunking setting, or the existing index\'s mode with --update)')
+@click.option('--dedup/--no-dedup', default=None,
+              help='Drop near-duplicate chunks before embedding (default: dedup_chunks setting)')
+@click.option('--compression', type=click.Choice(COMPRESSION_MODES), default=config.vector_compression,
+              help='Store index vectors as float32 (none), float16 (fp16) or 8-bit scalar-quantized (sq8)')
+@click.option('--workers', default=1, help='Processes that chunk and embed docstore shards in parallel')
+def index(docstore, index_dir, update, no_cache, index_type, streaming, batch_size, chunking, dedup, compression,
+          workers):
     """Build vector index from docstore"""
     if not os.path.exists(docstore):
         console.print(f"[red]Error: Docstore {docstore} not found[/red]")
         return
     
-    console.print(f"[blue]Building index from {docstore}...[/blue]")
-    
     try:
-        vector_index = build_index_from_docstore(docstore, index_dir)
+        if update and os.path.exists(os.path.join(index_dir, "index.faiss")):
+            console.print(f"[blue]Updating index {index_dir} from {docstore}...[/blue]")
+            num_chunks = update_index_from_docstore(docstore, index_dir, use_cache=not no_cache,
+                                                    chunking=chunking, dedup=dedup).live_count
+        elif workers > 1:
+            console.print(f"[blue]Building index from {docstore} with {workers} workers...[/blue]")
+            num_chunks = build_index_sharded(docstore, index_dir, workers, batch_size, use_cache=not no_cache,
+                                             index_type=index_type, chunking=chunking, dedup=dedup,
+                                             compression=compression)
+        elif streaming:
+            console.print(f"[blue]Streaming index build from {docstore}...[/blue]")
+            num_chunks = build_index_streaming(docstore, index_dir, batch_size, use_cache=not no_cache,
+                                               index_type=index_type, chunking=chunking, dedup=dedup,
+                                               compression=compression)
+        else:
+            console.print(f"[blue]Building index from {docstore}...[/blue]")
+            num_chunks = build_index_from_docstore(docstore, index_dir, use_cache=not no_cache,
+                                                   index_type=index_type, chunking=chunking,
+                                                   dedup=dedup, compression=compression).live_count
         console.print(f"[green]Index built successfully and saved to {index_dir}[/green]")
-        console.print(f"[dim]Index contains {len(vector_index.metadata)} chunks[/dim]")
+        console.print(f"[dim]Index contains {num_chunks} chunks[/dim]")
     except Exception as e:
         console.print(f"[red]Error building index: {e}[/red]")
 
 @cli.command()
 @click.option('--index-dir', default=config.default_index_dir, help='Index directory')
-@click.option('--question', prompt='Question', help='Question to ask')
+def compact(index_dir):
+    """Drop deleted chunks from an index"""
+    if not os.path.exists(index_dir):
+        console.print(f"[red]Error: Index directory {index_dir} not found[/red]")
+        return
+    
+    try:
+        vector_index = VectorIndex()
+        vector_index.load(index_dir)
+        removed = vector_index.compact()
+        vector_index.save(index_dir)
+        console.print(f"[green]Removed {removed} deleted chunks, {vector_index.live_count} remain[/green]")
+    except Exception as e:
+        console.print(f"[red]Error compacting index: {e}[/red]")
+
+@cli.command('migrate-index')
+@click.option('--index-dir', default=config.default_index_dir, help='Index directory to migrate')
+def migrate_index(index_dir):
+    """Convert an index's metadata.jsonl to the compact metadata format"""
+    if not os.path.exists(index_dir):
+        console.print(f"[red]Error: Index directory {index_dir} not found[/red]")
+        return
+    
+    try:
+        header = migrate_metadata(index_dir)
+        console.print(f"[green]Migrated {header['count']} chunks from {header['documents']} documents[/green]")
+    except Exception as e:
+        console.print(f"[red]Error migrating index: {e}[/red]")
+
+@cli.command('bench-index')
+@click.option('--index-dir', default=config.default_index_dir, help='Index directory with stored embeddings')
+@click.option('--index-type', 'index_types', multiple=True, type=click.Choice(INDEX_TYPES),
+              help='Index types to compare (default: all)')
+@click.option('--compression', 'compressions', multiple=True, type=click.Choice(COMPRESSION_MODES),
+              help='Vector compressions to compare (default: none)')
+@click.option('--top-k', default=10, help='k for recall@k')
+@click.option('--queries', default=200, help='Number of sampled queries')
+def bench_index(index_dir, index_types, compressions, top_k, queries):
+    """Compare recall, QPS and memory of ANN index types and vector compressions on an index's vectors"""
+    manifest = read_manifest(index_dir)
+    if not manifest or 'embeddings' not in manifest:
+        console.print(f"[red]Error: {index_dir} has no stored embeddings; rebuild it with 'index' first[/red]")
+        return
+    
+    embeddings = open_embeddings(index_dir, manifest['embeddings'])
+    console.print(f"[blue]Benchmarking {len(embeddings)} vectors, recall@{top_k} against exact search...[/blue]")
+    
+    try:
+        report = benchmark_index_types(embeddings, index_types or INDEX_TYPES, top_k, queries,
+                                       compressions or ('none',))
+    except Exception as e:
+        console.print(f"[red]Error benchmarking index: {e}[/red]")
+        return
+    
+    table = Table(title="Index Types")
+    table.add_column("Type", style="cyan")
+    table.add_column("Compression", style="cyan")
+    table.add_column(f"Recall@{top_k}", justify="right", style="green")
+    table.add_column("Rescored", justify="right", style="green")
+    table.add_column("QPS", justify="right", style="magenta")
+    table.add_column("Memory (MB)", justify="right")
+    table.add_column("Build (s)", justify="right", style="dim")
+    
+    for row in report:
+        table.add_row(
+            row['index_type'],
+            row['compression'],
+            f"{row['recall']:.3f}",
+            "-" if row['rescored_recall'] is None else f"{row['rescored_recall']:.3f}",
+            f"{row['qps']:,.0f}",
+            f"{row['memory_bytes'] / 1e6:.1f}",
+            f"{row['build_seconds']:.2f}"
+        )
+    
+    console.print(table)
+
+@cli.command('chunk-report')
+@click.option('--docstore', default=config.default_docstore, help='Input docstore path')
+def chunk_report(docstore):
+    """Compare how many tokens each chunking mode loses to embedder truncation"""
+    from src.infochat_agent.scrape import load_docstore
+    
+    if not os.path.exists(docstore):
+        console.print(f"[red]Error: Docstore {docstore} not found[/red]")
+        return
+    
+    try:
+        embedding_model = get_embedding_model()
+        documents = load_docstore(docstore)
+        max_tokens = embedding_model.max_seq_length
+    except Exception as e:
+        console.print(f"[red]Error loading model or docstore: {e}[/red]")
+        return
+    
+    table = Table(title=f"Truncation at {max_tokens} tokens ({embedding_model.model_name})")
+    table.add_column("Chunking", style="cyan")
+    table.add_column("Chunks", justify="right")
+    table.add_column("Tokens", justify="right")
+    table.add_column("Truncated chunks", justify="right", style="magenta")
+    table.add_column("Wasted tokens", justify="right", style="red")
+    
+    for mode in CHUNKING_MODES:
+        chunks = TextProcessor.for_model(embedding_model, mode).iter_chunks(documents)
+        report = truncation_report((chunk['text'] for chunk in chunks), embedding_model.tokenizer, max_tokens)
+        table.add_row(
+            mode,
+            f"{report['chunks']:,}",
+            f"{report['tokens']:,}",
+            f"{report['truncated_chunks']:,}",
+            f"{report['wasted_tokens']:,} ({report['wasted_fraction']:.1%})"
+        )
+    
+    console.print(table)
+
+@cli.command('export-onnx')
+@click.option('--model', default=config.embedding_model, help='Sentence-transformers model name or path')
+@click.option('--output', required=True, help='Directory for the exported model')
+@click.option('--quantization', type=click.Choice(QUANTIZATION_TARGETS), default='avx2',
+              help='CPU instruction set the int8 weights are quantized for')
+def export_onnx_model(model, output, quantization):
+    """Export an embedding model to ONNX with dynamically int8-quantized weights"""
+    console.print(f"[blue]Exporting {model} to {output}...[/blue]")
+    try:
+        file_name = export_onnx(model, output, quantization)
+    except Exception as e:
+        console.print(f"[red]Error exporting model: {e}[/red]")
+        return
+    console.print(f"[green]Exported {os.path.join(output, file_name)}[/green]")
+    console.print(f"[dim]Use it with EMBEDDING_BACKEND=onnx, embedding_model={output!r} "
+                  f"and onnx_file_name={file_name!r}[/dim]")
+
+@cli.command()
+@click.option('--index-dir', default=config.default_index_dir, help='Index directory')
+@click.option('--question', help='Question to ask')
+@click.option('--questions-file', type=click.Path(exists=True, dir_okay=False),
+              help='Answer every line of this file in batches instead of a single question')
+@click.option('--output', help='JSONL output for --questions-file (default: <questions-file>.answers.jsonl)')
 @click.option('--model', help='OpenAI model to use (if available)')
 @click.option('--top-k', default=config.top_k, help='Number of results to retrieve')
 @click.option('--no-llm', is_flag=True, help='Use extractive answers only')
-def ask(index_dir, question, model, top_k, no_llm):
+@click.option('--hybrid/--dense', default=None,
+              help='Fuse BM25 keyword and dense rankings, finding exact part numbers and error codes '
+                   '(default: hybrid_search setting)')
+def ask(index_dir, question, questions_file, output, model, top_k, no_llm, hybrid):
     """Ask questions against the index"""
     if not os.path.exists(index_dir):
         console.print(f"[red]Error: Index directory {index_dir} not found[/red]")
         return
     
+    if questions_file:
+        ask_questions_file(index_dir, questions_file, output, model, top_k, no_llm, hybrid)
+        return
+    
+    if not question:
+        question = click.prompt('Question')
+    
     try:
         # Initialize RAG pipeline
-        rag = RAGPipeline(index_dir, model)
+        rag = get_pipeline(index_dir, model, hybrid)
         
         console.print(f"[blue]Searching for: {question}[/blue]")
         
@@ -128,5 +329,29 @@ def ask(index_dir, question, model, top_k, no_llm):
     except Exception as e:
         console.print(f"[red]Error: {e}[/red]")
 
+def ask_questions_file(index_dir, questions_file, output, model, top_k, no_llm, hybrid=None):
+    """Answer a file of questions (one per line), streaming JSONL results to disk"""
+    output = output or os.path.splitext(questions_file)[0] + ".answers.jsonl"
+    
+    with open(questions_file, 'r', encoding='utf-8') as f:
+        questions = [line.strip() for line in f if line.strip()]
+    
+    try:
+        rag = get_pipeline(index_dir, model, hybrid)
+        console.print(f"[blue]Answering {len(questions)} questions...[/blue]")
+        
+        start = time.perf_counter()
+        answered = 0
+        with open(output, 'w', encoding='utf-8') as out:
+            for response in rag.ask_batch(questions, use_llm=not no_llm, top_k=top_k):
+                out.write(json.dumps(response, ensure_ascii=False) + '\n')
+                answered += 1
+        elapsed = time.perf_counter() - start
+        
+        console.print(f"[green]Wrote {answered} answers to {output}[/green]")
+        console.print(f"[dim]{elapsed:.2f}s total, {answered / elapsed if elapsed else 0:.1f} questions/s[/dim]")
+    except Exception as e:
+        console.print(f"[red]Error: {e}[/red]")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""In-process caches for query-time work"""
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a question so trivially different phrasings share cache entries"""
+    query = re.sub(r'\s+', ' ', query).strip().casefold()
+    return query.rstrip('?!. ')
+
+def approximate_size(value: Any) -> int:
+    """Rough byte size of cached values: arrays, strings and nested containers"""
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(approximate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+class LRUCache:
+    """Thread-safe LRU cache with optional time-to-live and size accounting"""
+    
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None,
+                 sizeof: Callable[[Any], int] = approximate_size):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self.entries = OrderedDict()  # key -> (value, stored_at, size)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            size = self.sizeof(key) + self.sizeof(value)
+            self.entries[key] = (value, time.monotonic(), size)
+            self.memory_bytes += size
+            
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+    
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self.entries.pop(key)
+        self.memory_bytes -= size
+    
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.memory_bytes = 0
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'memory_bytes': self.memory_bytes,
+        }
+
+def chunk_keys(results: List[Tuple[Dict, float]]) -> FrozenSet[Tuple[str, Optional[int]]]:
+    """Identity of the chunks an answer was generated from"""
+    return frozenset((chunk['url'], chunk.get('chunk_id')) for chunk, _ in results)
+
+class SemanticAnswerCache:
+    """LRU cache of generated answers keyed by query embedding.
+    
+    A lookup hits when a cached question's embedding has cosine similarity of
+    at least ``threshold`` with the new one and the answer was generated from
+    the same set of chunks, so paraphrases reuse an answer but a question that
+    retrieves different context does not. Entries belong to one version (for
+    RAGPipeline, the index version and LLM model) and are dropped when it
+    changes. With a ``path`` entries are also kept in
+    SQLite and survive restarts.
+    """
+    
+    def __init__(self, max_entries: int, threshold: float, path: Optional[str] = None,
+                 ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # entry id -> (vector, chunk keys, response, stored_at)
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 0
+        self._matrix = None  # Stacked entry vectors, rebuilt after changes
+        self._matrix_ids = []
+        
+        self.conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, version TEXT, "
+                "vector BLOB NOT NULL, chunks TEXT NOT NULL, response TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self.conn.commit()
+            self._load()
+    
+    def _load(self) -> None:
+        rows = self.conn.execute(
+            "SELECT id, version, vector, chunks, response, stored_at FROM answers ORDER BY stored_at, id"
+        ).fetchall()
+        for entry_id, version, vector, chunks, response, stored_at in rows:
+            self.version = version
+            self.entries[entry_id] = (np.frombuffer(vector, dtype=np.float32),
+                                      frozenset(tuple(key) for key in json.loads(chunks)),
+                                      json.loads(response), stored_at)
+            self._next_id = max(self._next_id, entry_id + 1)
+        # Only the most recent version can still be current
+        stale = [entry_id for entry_id, row in zip(self.entries, rows) if row[1] != self.version]
+        self._remove(stale)
+        # Keep the newest rows if the cache was written with a larger max_entries
+        excess = len(self.entries) - max(self.max_entries, 0)
+        if excess > 0:
+            self._remove(list(self.entries)[:excess])
+    
+    def set_version(self, version: Optional[str]) -> None:
+        """Drop every entry if the index version differs from the cached one"""
+        with self.lock:
+            if version != self.version:
+                self._remove(list(self.entries))
+                self.version = version
+    
+    def get(self, query_embedding: np.ndarray, chunks: FrozenSet) -> Optional[Dict]:
+        with self.lock:
+            if self.entries:
+                if self._matrix is None:
+                    self._matrix_ids = list(self.entries)
+                    self._matrix = np.stack([self.entries[entry_id][0] for entry_id in self._matrix_ids])
+                similarities = self._matrix @ _unit(query_embedding)
+                
+                for position in np.argsort(-similarities):
+                    if similarities[position] < self.threshold:
+                        break
+                    entry_id = self._matrix_ids[position]
+                    _, entry_chunks, response, stored_at = self.entries[entry_id]
+                    if entry_chunks != chunks:
+                        continue
+                    if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                        self._remove([entry_id])
+                        break
+                    self.entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return response
+            
+            self.misses += 1
+            return None
+    
+    def put(self, query_embedding: np.ndarray, chunks: FrozenSet, response: Dict) -> None:
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            vector = _unit(query_embedding)
+            stored_at = time.time()
+            self.entries[entry_id] = (vector, chunks, response, stored_at)
+            self._matrix = None
+            if self.conn:
+                self.conn.execute(
+                    "INSERT INTO answers (id, version, vector, chunks, response, stored_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry_id, self.version, vector.tobytes(), json.dumps(sorted(chunks, key=str)),
+                     json.dumps(response), stored_at)
+                )
+                self.conn.commit()
+            
+            excess = len(self.entries) - self.max_entries
+            if excess > 0:
+                self._remove(list(self.entries)[:excess])
+    
+    def _remove(self, entry_ids: List[int]) -> None:
+        if not entry_ids:
+            return
+        for entry_id in entry_ids:
+            del self.entries[entry_id]
+        self._matrix = None
+        if self.conn:
+            self.conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+            self.conn.commit()
+    
+    def clear(self) -> None:
+        with self.lock:
+            self._remove(list(self.entries))
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+        }
+    
+    def close(self) -> None:
+        if self.conn:
+            self.conn.close()
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
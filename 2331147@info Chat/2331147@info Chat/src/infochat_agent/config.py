@@ -10,22 +10,68 @@ load_dotenv()
 class Config(BaseModel):
     # OpenAI settings
     openai_api_key: Optional[str] = os.getenv("OPENAI_API_KEY")
+    openai_base_url: Optional[str] = os.getenv("OPENAI_BASE_URL")  # Any OpenAI-compatible server
     default_model: str = "gpt-4o-mini"
     
     # Embedding settings
     embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "torch")  # torch, or onnx (needs sentence-transformers[onnx])
+    onnx_file_name: str = os.getenv("ONNX_FILE_NAME", "onnx/model_quint8_avx2.onnx")  # Int8-quantized export in the model
+    embedding_cache_path: str = "data/embedding_cache.sqlite"
+    embedding_cache_max_mb: int = 1024
+    embed_batch_size: int = 1024  # Chunks per encode call in the streaming index build
+    embed_memory_budget_mb: int = 256  # Activation memory per forward pass; sets bulk batch sizes by length
+    embed_max_batch_size: int = 256
     
     # Chunking settings
+    chunking: str = "words"  # words: chunk_size words; tokens: sentences packed to the model's max sequence length
     chunk_size: int = 512
     chunk_overlap: int = 50
+    dedup_chunks: bool = True  # Drop near-duplicate chunks (MinHash + LSH) before embedding
+    dedup_threshold: float = 0.9  # Estimated Jaccard similarity of word 3-gram shingles
+    dedup_num_perm: int = 64
+    dedup_bands: int = 16
+    
+    # Vector index settings ("auto" picks a type from the corpus size)
+    index_type: str = "auto"  # auto, flat, ivf, hnsw, ivfpq
+    index_auto_hnsw_min: int = 50_000
+    index_auto_ivfpq_min: int = 1_000_000
+    index_train_sample: int = 100_000
+    ivf_nlist: Optional[int] = None  # Defaults to ~4*sqrt(n)
+    ivf_nprobe: int = 16
+    hnsw_m: int = 32
+    hnsw_ef_search: int = 64
+    pq_m: int = 48
+    vector_compression: str = "none"  # none, fp16 or sq8: how flat/ivf/hnsw indexes store vectors
+    compression_rescore: bool = True  # Re-rank a compressed shortlist with exact float32 scores
+    rescore_factor: int = 4  # Shortlist size as a multiple of the requested k
     
     # Retrieval settings
     top_k: int = 5
     mmr_diversity: float = 0.7
+    hybrid_search: bool = False  # Fuse BM25 and dense rankings (reciprocal rank fusion)
+    bm25_k1: float = 1.5
+    bm25_b: float = 0.75
+    bm25_max_postings: int = 2048  # Highest-impact postings read per query term
+    rrf_k: int = 60
+    query_cache_size: int = 4096  # Normalized query -> embedding
+    results_cache_size: int = 1024  # (query, top_k, use_mmr) -> results
+    retrieval_cache_ttl: Optional[float] = 3600.0
+    ask_batch_size: int = 256  # Questions per encode/search call in ask_batch
+    answer_cache_size: int = 512  # LLM answers reused for near-identical questions
+    answer_cache_threshold: float = 0.95  # Minimum cosine similarity between questions
+    answer_cache_path: Optional[str] = None  # SQLite file to keep answers across restarts
+    answer_cache_ttl: Optional[float] = 86400.0
     
     # Scraping settings
     max_links_to_follow: int = 10
     request_timeout: int = 30
+    scrape_concurrency: int = 8
+    per_host_concurrency: int = 4
+    per_host_requests_per_second: float = 4.0  # Token-bucket rate; 0 disables limiting
+    extract_workers: Optional[int] = None  # Processes for local HTML extraction; defaults to CPU count
+    request_cache_path: str = "scrape_cache"  # SQLite HTTP cache (.sqlite added) used once enable_request_cache() runs
+    request_cache_ttl: int = 3600
     
     # Storage paths
     default_docstore: str = "data/docstore.jsonl"
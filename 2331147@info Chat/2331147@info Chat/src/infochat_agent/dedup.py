@@ -0,0 +1,131 @@
+"""Near-duplicate chunk detection with MinHash and locality-sensitive hashing"""
+
+import os
+import zlib
+import numpy as np
+from typing import Dict, Iterable, Iterator, Sequence
+from .config import config
+
+MINHASH_FILE = "minhash.npy"
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+class NearDuplicateFilter:
+    """Drops chunks whose word shingles overlap an already accepted chunk.
+    
+    Each text is reduced to a MinHash signature over its word ``shingle_size``-
+    grams. Signatures are split into ``bands`` bands and bucketed, so only
+    chunks sharing a whole band are compared; a candidate is a duplicate when
+    the estimated Jaccard similarity (fraction of equal signature slots) is at
+    least ``threshold``. State is kept across calls, so one filter deduplicates
+    a whole build.
+    """
+    
+    def __init__(self, threshold: float = None, num_perm: int = None, bands: int = None,
+                 shingle_size: int = 3, seed: int = 1):
+        self.threshold = threshold or config.dedup_threshold
+        self.num_perm = num_perm or config.dedup_num_perm
+        self.bands = bands or config.dedup_bands
+        if self.num_perm % self.bands:
+            raise ValueError(f"num_perm ({self.num_perm}) must be a multiple of bands ({self.bands})")
+        self.rows = self.num_perm // self.bands
+        self.shingle_size = shingle_size
+        
+        # Permutations h -> (a * h + b) mod p; the uint64 product wraps, as in the usual MinHash recipe
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, self.num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, MERSENNE_PRIME, self.num_perm, dtype=np.uint64)[:, None]
+        
+        self.buckets = [{} for _ in range(self.bands)]  # Band key -> positions in signatures
+        self.signatures = []  # Accepted signatures, in order
+        self.seen = 0
+        self.dropped = 0
+    
+    def signature(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        size = min(self.shingle_size, len(words)) or 1
+        word_hashes = np.array([zlib.crc32(word.encode('utf-8')) for word in words] or [0], dtype=np.uint64)
+        
+        # Combine consecutive word hashes into one 32-bit hash per shingle
+        shingles = np.zeros(max(1, len(word_hashes) - size + 1), dtype=np.uint64)
+        for offset in range(size):
+            shingles = shingles * np.uint64(0x01000193) + word_hashes[offset:offset + len(shingles)]
+            shingles &= np.uint64(0xFFFFFFFF)
+        
+        return ((self.a * np.unique(shingles) + self.b) % MERSENNE_PRIME).min(axis=1)
+    
+    def signature_matrix(self, texts: Iterable[str] = None) -> np.ndarray:
+        """Signatures of texts as rows, or of the accepted texts when none are given"""
+        signatures = self.signatures if texts is None else [self.signature(text) for text in texts]
+        if not signatures:
+            return np.zeros((0, self.num_perm), dtype=np.uint64)
+        return np.vstack(signatures)
+    
+    def _band_keys(self, signature: np.ndarray):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+    
+    def find(self, signature: np.ndarray) -> bool:
+        """Whether an accepted signature is at least threshold-similar"""
+        checked = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            for position in self.buckets[band].get(key, ()):
+                if position in checked:
+                    continue
+                checked.add(position)
+                if np.mean(self.signatures[position] == signature) >= self.threshold:
+                    return True
+        return False
+    
+    def add(self, signature: np.ndarray) -> None:
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for band, key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(key, []).append(position)
+    
+    def extend(self, signatures: Sequence[np.ndarray]) -> None:
+        """Accept signatures of already-stored chunks without counting them as seen"""
+        for signature in signatures:
+            self.add(signature)
+    
+    def is_duplicate(self, text: str) -> bool:
+        """Check a text, remembering it if it is new"""
+        return self.is_duplicate_signature(self.signature(text))
+    
+    def is_duplicate_signature(self, signature: np.ndarray) -> bool:
+        """Check a precomputed signature, remembering it if it is new"""
+        self.seen += 1
+        if self.find(signature):
+            self.dropped += 1
+            return True
+        self.add(signature)
+        return False
+    
+    def filter(self, chunks: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield the chunks that are not near-duplicates of earlier ones"""
+        for chunk in chunks:
+            if not self.is_duplicate(chunk['text']):
+                yield chunk
+    
+    def stats(self) -> Dict:
+        return {
+            'seen': self.seen,
+            'dropped': self.dropped,
+            'ratio': self.dropped / self.seen if self.seen else 0.0,
+        }
+
+def save_signatures(index_dir: str, signatures: np.ndarray, dedup_filter: NearDuplicateFilter) -> Dict:
+    """Write row-aligned MinHash signatures, returning the manifest header"""
+    np.save(os.path.join(index_dir, MINHASH_FILE), np.ascontiguousarray(signatures, dtype=np.uint64))
+    return {
+        'file': MINHASH_FILE,
+        'count': int(len(signatures)),
+        'num_perm': dedup_filter.num_perm,
+        'shingle_size': dedup_filter.shingle_size,
+    }
+
+def load_signatures(index_dir: str, header: Dict) -> np.ndarray:
+    return np.load(os.path.join(index_dir, header['file']))
+
+def remove_signatures(index_dir: str) -> None:
+    path = os.path.join(index_dir, MINHASH_FILE)
+    if os.path.exists(path):
+        os.remove(path)
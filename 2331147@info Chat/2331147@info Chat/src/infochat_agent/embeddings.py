@@ -1,18 +1,272 @@
 """Embedding functionality using sentence-transformers"""
 
+import os
+import re
+import glob
+import time
+import sqlite3
+import hashlib
+import threading
 import numpy as np
-from typing import List
-from sentence_transformers import SentenceTransformer
+from typing import TYPE_CHECKING, List, Dict, Optional, Sequence
 from .config import config
+from .processing import token_counts
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer  # Imported on first use; it pulls in torch
+
+EMBEDDING_BACKENDS = ('torch', 'onnx')
+QUANTIZATION_TARGETS = ('avx2', 'avx512', 'avx512_vnni', 'arm64')
+
+# Per-token float32 activations live during one transformer layer, in units of
+# the hidden size (Q/K/V, attention output, 4x FFN, residuals), plus the
+# attention scores of a typical 12-head encoder
+ACTIVATION_WIDTH = 12
+ATTENTION_HEADS = 12
+
+def load_sentence_transformer(model_name: str, backend: str = None) -> 'SentenceTransformer':
+    """Load a model on an embedding backend.
+    
+    'torch' runs the PyTorch weights. 'onnx' runs ``config.onnx_file_name``
+    (a dynamically int8-quantized ONNX export, see export_onnx) on ONNX
+    Runtime, which is faster and smaller on CPU. Both return the same
+    SentenceTransformer interface.
+    """
+    from sentence_transformers import SentenceTransformer
+    
+    backend = backend or config.embedding_backend
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+    if backend == 'onnx':
+        try:
+            return SentenceTransformer(model_name, backend='onnx',
+                                       model_kwargs={'file_name': config.onnx_file_name})
+        except TypeError as e:
+            raise ImportError("The onnx backend needs sentence-transformers>=3.2: "
+                              "pip install 'sentence-transformers[onnx]'") from e
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+
+def export_onnx(model_name: str, output_dir: str, quantization: str = 'avx2') -> str:
+    """Export a model to ONNX with dynamically int8-quantized weights for a CPU target.
+    
+    Writes a loadable model directory and returns the quantized file's path
+    relative to it (the value for onnx_file_name).
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    
+    model = SentenceTransformer(model_name, backend='onnx')  # Converts to float32 ONNX if none is shipped
+    model.save_pretrained(output_dir)
+    export_dynamic_quantized_onnx_model(model, quantization, output_dir)
+    
+    exported = max(glob.glob(os.path.join(output_dir, 'onnx', f'model_*{quantization}.onnx')), key=os.path.getmtime)
+    return os.path.relpath(exported, output_dir)
+
+def activation_bytes(seq_len: int, dimension: int) -> int:
+    """Approximate peak activation memory of one padded sequence in a forward pass"""
+    return 4 * seq_len * (ACTIVATION_WIDTH * dimension + ATTENTION_HEADS * seq_len)
+
+def bucket_batches(lengths: Sequence[int], dimension: int, memory_budget_mb: int,
+                   max_batch_size: int) -> List[np.ndarray]:
+    """Group positions into batches of similar token length that fit a memory budget.
+    
+    Positions are visited shortest first, so each batch pads only to its own
+    longest text: short texts share large batches and long ones get small
+    batches. A batch closes when one more text would push its padded
+    activations over ``memory_budget_mb`` or it reaches ``max_batch_size``.
+    """
+    budget = memory_budget_mb * 1024 * 1024
+    order = np.argsort(np.asarray(lengths), kind='stable')
+    batches, start = [], 0
+    for end in range(1, len(order) + 1):
+        size = end - start
+        if size > max_batch_size or (size > 1 and size * activation_bytes(lengths[order[end - 1]], dimension) > budget):
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+class EmbeddingCache:
+    """Persistent content-addressed cache of embeddings.
+    
+    Entries are keyed by a hash of (model name, normalized text) and stored as
+    raw float32 blobs in SQLite. When the store grows past ``max_mb`` the least
+    recently used entries are evicted. One cache may be shared between threads.
+    """
+    
+    ENTRY_OVERHEAD = 64  # Approximate per-row bytes for the key, timestamp and SQLite bookkeeping
+    
+    def __init__(self, path: str, model_name: str, max_mb: int = None):
+        self.path = path
+        self.model_name = model_name
+        self.max_bytes = (max_mb or config.embedding_cache_max_mb) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Sharded builds share the cache between worker processes: WAL lets readers run alongside a
+        # writer, and the timeout makes concurrent writers wait for the lock instead of failing
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.RLock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self.conn.commit()
+    
+    def key(self, text: str) -> bytes:
+        """Content address for a text under this cache's model"""
+        normalized = re.sub(r'\s+', ' ', text).strip()
+        return hashlib.sha256(f"{self.model_name}\0{normalized}".encode('utf-8')).digest()
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up keys, returning the vectors that were found"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for start in range(0, len(unique_keys), 500):  # Stay under SQLite's variable limit
+                batch = unique_keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+            
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                      [(now, key) for key in found])
+                self.conn.commit()
+        return found
+    
+    def put_many(self, items: Dict[bytes, np.ndarray]) -> None:
+        """Store vectors and evict old entries if over the size budget"""
+        if not items:
+            return
+        now = time.time()
+        entry_bytes = np.asarray(next(iter(items.values())), dtype=np.float32).nbytes + self.ENTRY_OVERHEAD
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+            )
+            self.conn.commit()
+            self.evict(max(1, self.max_bytes // entry_bytes))
+    
+    def evict(self, max_entries: int) -> int:
+        """Drop least recently used entries beyond max_entries, returning how many were removed"""
+        with self.lock:
+            excess = len(self) - max_entries
+            if excess <= 0:
+                return 0
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (excess,)
+            )
+            self.conn.commit()
+            return excess
+    
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters since this cache was opened"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self),
+        }
+    
+    def close(self) -> None:
+        self.conn.close()
 
 class EmbeddingModel:
-    def __init__(self, model_name: str = None):
+    def __init__(self, model_name: str = None, cache_path: Optional[str] = None,
+                 model: 'SentenceTransformer' = None, backend: str = None):
         self.model_name = model_name or config.embedding_model
-        self.model = SentenceTransformer(self.model_name)
+        self.backend = backend or config.embedding_backend
+        self.model = model or load_sentence_transformer(self.model_name, self.backend)
+        
+        # Quantized backends give slightly different vectors, so they get their own cache entries
+        cache_name = self.model_name
+        if self.backend != 'torch':
+            cache_name = f"{self.model_name}|{self.backend}:{config.onnx_file_name}"
+        self.cache = EmbeddingCache(cache_path, cache_name) if cache_path else None
+        self.bulk_stats = {'texts': 0, 'tokens': 0, 'padded_tokens': 0, 'batches': 0, 'seconds': 0.0}
     
     def encode(self, texts: List[str]) -> np.ndarray:
         """Encode texts into embeddings"""
-        return self.model.encode(texts, show_progress_bar=True)
+        return self._encode(texts, lambda missing: self.model.encode(missing, show_progress_bar=True))
+    
+    def encode_bulk(self, texts: List[str], memory_budget_mb: int = None) -> np.ndarray:
+        """Encode many texts (an index build's chunks) in length-bucketed batches.
+        
+        Batch sizes adapt to token length under ``config.embed_memory_budget_mb``
+        (see bucket_batches), and vectors come back in input order. Throughput
+        accumulates in ``bulk_stats``.
+        """
+        return self._encode(texts, lambda missing: self._encode_bucketed(missing, memory_budget_mb))
+    
+    def _encode_bucketed(self, texts: List[str], memory_budget_mb: int = None) -> np.ndarray:
+        start = time.perf_counter()
+        lengths = np.minimum(token_counts(self.tokenizer, texts, add_special_tokens=True), self.max_seq_length)
+        batches = bucket_batches(lengths, self.dimension, memory_budget_mb or config.embed_memory_budget_mb,
+                                 config.embed_max_batch_size)
+        
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        padded = 0
+        for rows in batches:
+            embeddings[rows] = self.model.encode([texts[row] for row in rows], batch_size=len(rows),
+                                                 show_progress_bar=False)
+            padded += len(rows) * int(lengths[rows].max())
+        
+        self.bulk_stats['texts'] += len(texts)
+        self.bulk_stats['tokens'] += int(lengths.sum())
+        self.bulk_stats['padded_tokens'] += padded
+        self.bulk_stats['batches'] += len(batches)
+        self.bulk_stats['seconds'] += time.perf_counter() - start
+        return embeddings
+    
+    def throughput(self) -> Dict:
+        """Bulk-encode totals with tokens/sec and the share of compute spent on padding"""
+        stats = dict(self.bulk_stats)
+        stats['tokens_per_second'] = stats['tokens'] / stats['seconds'] if stats['seconds'] else 0.0
+        stats['padding'] = 1 - stats['tokens'] / stats['padded_tokens'] if stats['padded_tokens'] else 0.0
+        return stats
+    
+    def _encode(self, texts: List[str], encode) -> np.ndarray:
+        """Run encode on the texts the cache doesn't already hold"""
+        if self.cache is None:
+            return encode(texts)
+        
+        # Embed only cache misses, then reassemble in input order
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        missed = sum(key in missing for key in keys)
+        self.cache.hits += len(texts) - missed
+        self.cache.misses += missed
+        
+        if missing:
+            new_vectors = encode(list(missing.values()))
+            computed = dict(zip(missing.keys(), np.asarray(new_vectors, dtype=np.float32)))
+            self.cache.put_many(computed)
+            vectors.update(computed)
+        
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
     
     def encode_single(self, text: str) -> np.ndarray:
         """Encode a single text"""
@@ -21,4 +275,14 @@ class EmbeddingModel:
     @property
     def dimension(self) -> int:
         """Get embedding dimension"""
-        return self.model.get_sentence_embedding_dimension()
\ No newline at end of file
+        return self.model.get_sentence_embedding_dimension()
+    
+    @property
+    def tokenizer(self):
+        """The model's (fast) tokenizer"""
+        return self.model.tokenizer
+    
+    @property
+    def max_seq_length(self) -> int:
+        """Tokens per input, including special tokens; longer inputs are truncated"""
+        return self.model.max_seq_length
@@ -2,156 +2,1010 @@
 
 import os
 import json
-import faiss
+import time
+import uuid
+import shutil
+import hashlib
 import numpy as np
-from typing import List, Dict, Tuple
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, List, Dict, Tuple, Sequence, Iterable, Iterator
 from .embeddings import EmbeddingModel
+from .registry import get_embedding_model
 from .processing import TextProcessor
+from .dedup import NearDuplicateFilter, save_signatures, load_signatures, remove_signatures
+from .sparse import BM25Index, reciprocal_rank_fusion
+from .store import (read_manifest, write_manifest, write_embeddings, open_embeddings,
+                    write_ids, read_ids, EmbeddingWriter, ChunkMetadata, ChunkMetadataWriter,
+                    staged_index_dir, replace_staged, EMBEDDINGS_FILE, METADATA_FILES, LEGACY_METADATA_FILE)
 from .config import config
 
+if TYPE_CHECKING:
+    import faiss  # Imported on first use; loading it takes a noticeable part of startup
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+COMPRESSION_MODES = ('none', 'fp16', 'sq8')
+VECTOR_CODECS = {'none': 'Flat', 'fp16': 'SQfp16', 'sq8': 'SQ8'}
+
+def resolve_index_type(index_type: str, num_vectors: int) -> str:
+    """Pick a concrete index type, choosing by corpus size for 'auto'"""
+    if index_type != 'auto':
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES} or 'auto'")
+        return index_type
+    
+    if num_vectors >= config.index_auto_ivfpq_min:
+        return 'ivfpq'
+    if num_vectors >= config.index_auto_hnsw_min:
+        return 'hnsw'
+    return 'flat'
+
+def resolve_compression(index_type: str, compression: str) -> str:
+    """Validate a compression mode; IVF-PQ already stores compressed codes, so it always gets 'none'"""
+    if compression not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {COMPRESSION_MODES}")
+    return 'none' if index_type == 'ivfpq' else compression
+
+def index_factory_string(index_type: str, dimension: int, num_vectors: int, compression: str = 'none') -> str:
+    """FAISS factory description for an index type sized for num_vectors.
+    
+    compression stores the vectors of flat, IVF and HNSW indexes as float16
+    ('fp16', half the memory) or 8-bit scalar-quantized ('sq8', a quarter).
+    """
+    nlist = config.ivf_nlist or int(4 * np.sqrt(num_vectors))
+    nlist = max(1, min(nlist, num_vectors // 39))  # FAISS wants ~39 training points per centroid
+    codec = VECTOR_CODECS[resolve_compression(index_type, compression)]
+    
+    if index_type == 'flat':
+        return f"IDMap2,{codec}"
+    if index_type == 'ivf':
+        return f"IDMap2,IVF{nlist},{codec}"
+    if index_type == 'hnsw':
+        return f"IDMap2,HNSW{config.hnsw_m}" + ("" if codec == 'Flat' else f",{codec}")
+    if index_type == 'ivfpq':
+        if num_vectors < 256:
+            raise ValueError("IVF-PQ needs at least 256 vectors to train its codebooks")
+        pq_m = max(m for m in range(1, min(config.pq_m, dimension) + 1) if dimension % m == 0)
+        return f"IDMap2,IVF{nlist},PQ{pq_m}"
+    raise ValueError(f"Unknown index type {index_type!r}")
+
+def make_faiss_index(index_type: str, embeddings: np.ndarray, compression: str = 'none') -> 'faiss.Index':
+    """Create an empty ID-mapped inner-product index, trained on a sample of embeddings"""
+    import faiss
+    
+    num_vectors, dimension = embeddings.shape
+    index = faiss.index_factory(dimension, index_factory_string(index_type, dimension, num_vectors, compression),
+                                faiss.METRIC_INNER_PRODUCT)
+    
+    if not index.is_trained:
+        sample_size = min(num_vectors, config.index_train_sample)
+        sample_rows = np.sort(np.random.default_rng(0).choice(num_vectors, sample_size, replace=False))
+        index.train(np.ascontiguousarray(embeddings[sample_rows], dtype=np.float32))
+    
+    apply_search_params(index)
+    return index
+
+def apply_search_params(index: 'faiss.Index') -> None:
+    """Set query-time knobs (nprobe, efSearch) from config"""
+    import faiss
+    
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    params = faiss.ParameterSpace()
+    if isinstance(inner, faiss.IndexIVF):
+        params.set_index_parameter(index, 'nprobe', config.ivf_nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        params.set_index_parameter(index, 'efSearch', config.hnsw_ef_search)
+
+def rescore(embeddings: np.ndarray, query_embedding: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact float32 inner products of a query with candidate rows, best first"""
+    scores = np.asarray(embeddings[rows], dtype=np.float32) @ query_embedding
+    order = np.argsort(-scores, kind='stable')
+    return scores[order], rows[order]
+
+def benchmark_index_types(embeddings: np.ndarray, index_types: Sequence[str] = INDEX_TYPES,
+                          top_k: int = 10, num_queries: int = 200,
+                          compressions: Sequence[str] = ('none',)) -> List[Dict]:
+    """Measure recall@k against exact search, plus QPS and memory, for each index type
+    and vector compression. Compressed indexes also report recall after exact
+    rescoring of a rescore_factor * k shortlist.
+    
+    Queries are stored vectors with small Gaussian noise, so they resemble real
+    in-domain questions without needing a labelled query set.
+    """
+    import faiss
+    
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(len(embeddings), min(num_queries, len(embeddings)), replace=False)]
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, top_k)
+    
+    def recall_of(found):
+        return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+    
+    report = []
+    for index_type in index_types:
+        for compression in dict.fromkeys(resolve_compression(index_type, c) for c in compressions):
+            start = time.perf_counter()
+            index = make_faiss_index(index_type, embeddings, compression)
+            index.add_with_ids(embeddings, np.arange(len(embeddings), dtype=np.int64))
+            build_seconds = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            _, found = index.search(queries, top_k)
+            search_seconds = time.perf_counter() - start
+            
+            rescored_recall = None
+            if compression != 'none':
+                _, shortlists = index.search(queries, top_k * config.rescore_factor)
+                rescored_recall = recall_of([rescore(embeddings, query, rows[rows >= 0])[1][:top_k]
+                                             for query, rows in zip(queries, shortlists)])
+            
+            report.append({
+                'index_type': index_type,
+                'compression': compression,
+                'recall': recall_of(found),
+                'rescored_recall': rescored_recall,
+                'qps': len(queries) / search_seconds if search_seconds else float('inf'),
+                'memory_bytes': int(faiss.serialize_index(index).nbytes),
+                'build_seconds': build_seconds,
+            })
+    
+    return report
+
 class VectorIndex:
-    def __init__(self, embedding_model: EmbeddingModel = None):
-        self.embedding_model = embedding_model or EmbeddingModel()
+    def __init__(self, embedding_model: EmbeddingModel = None, index_type: str = None, compression: str = None):
+        self.embedding_model = embedding_model or get_embedding_model()
+        self.index_type = index_type or config.index_type
+        self.compression = compression or config.vector_compression  # How FAISS stores the vectors
         self.index = None
-        self.metadata = []
+        self.embeddings = None  # Normalized chunk vectors, row-aligned with metadata
+        self.metadata = ChunkMetadata()
+        self.ids = np.zeros(0, dtype=np.int64)  # Stable chunk IDs, strictly increasing by row
+        self.tombstones = set()  # IDs of deleted chunks awaiting compact()
+        self.next_id = 0
+        self.version = None  # Changes whenever the searchable contents change
+        self.sparse = None  # BM25 over rows; None until built, and after rows change
+        self.signatures = None  # MinHash signatures, row-aligned; None until first needed
+        self.chunking = config.chunking  # How upsert_documents chunks pages
+        self.empty_pages = {}  # URL -> page_hash of pages with no indexed chunks (empty or all near-duplicates)
+        self._url_rows = {}
     
     def build_index(self, chunks: List[Dict]) -> None:
         """Build FAISS index from text chunks"""
         if not chunks:
             raise ValueError("No chunks provided")
         
-        # Extract texts for embedding
-        texts = [chunk['text'] for chunk in chunks]
+        self.index = None
+        self.embeddings = None
+        self.metadata = ChunkMetadata()
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.tombstones = set()
+        self.next_id = 0
+        self.signatures = None
+        self.empty_pages = {}
+        self._url_rows = {}
         
-        # Generate embeddings
-        embeddings = self.embedding_model.encode(texts)
+        self.add_chunks(chunks)
+        self.sparse = BM25Index.build(chunk['text'] for chunk in chunks)
         
-        # Create FAISS index
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
+        print(f"Built {self.index_type} index with {len(chunks)} chunks, dimension {self.index.d}")
+    
+    def add_chunks(self, chunks: List[Dict]) -> List[int]:
+        """Embed and append chunks, returning their stable chunk IDs"""
+        import faiss
+        
+        if not chunks:
+            return []
+        
+        # Generate embeddings
+        embeddings = encode_chunks(self.embedding_model, chunks)
         
         # Normalize embeddings for cosine similarity
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
         faiss.normalize_L2(embeddings)
-        self.index.add(embeddings.astype(np.float32))
         
-        # Store metadata
-        self.metadata = chunks
+        if self.index is None:
+            # Inner product for cosine similarity, mapped to stable IDs
+            self.index_type = resolve_index_type(self.index_type, len(embeddings))
+            self.compression = resolve_compression(self.index_type, self.compression)
+            self.index = make_faiss_index(self.index_type, embeddings, self.compression)
+        else:
+            self._ensure_id_map()
+        
+        new_ids = np.arange(self.next_id, self.next_id + len(chunks), dtype=np.int64)
+        self.index.add_with_ids(embeddings, new_ids)
+        self.next_id += len(chunks)
+        
+        first_row = len(self.metadata)
+        self.embeddings = embeddings if self.embeddings is None else np.vstack([self.embeddings, embeddings])
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.metadata.extend(chunks)
+        for row, chunk in enumerate(chunks, first_row):
+            self._url_rows.setdefault(chunk.get('url'), []).append(row)
+        self.sparse = None  # Rebuilt on the next hybrid search
+        if self.signatures is not None:
+            new_signatures = NearDuplicateFilter().signature_matrix(chunk['text'] for chunk in chunks)
+            self.signatures = np.vstack([self.signatures, new_signatures])
+        self._bump_version()
+        
+        return new_ids.tolist()
+    
+    def delete_url(self, url: str) -> int:
+        """Tombstone every live chunk of a URL, returning how many were deleted"""
+        deleted = 0
+        self.empty_pages.pop(url, None)
+        for row in self._url_rows.pop(url, []):
+            chunk_id = int(self.ids[row])
+            if chunk_id not in self.tombstones:
+                self.tombstones.add(chunk_id)
+                deleted += 1
+        if deleted:
+            self._bump_version()
+        return deleted
+    
+    def replace_url(self, url: str, chunks: List[Dict]) -> List[int]:
+        """Replace a URL's chunks, embedding only the new ones"""
+        self.delete_url(url)
+        return self.add_chunks(chunks)
+    
+    def upsert_documents(self, documents: List[Dict], processor: TextProcessor = None,
+                         dedup: bool = None) -> Dict[str, int]:
+        """Add new documents and replace changed ones, keyed by URL.
+        
+        Documents whose chunk texts are identical to the indexed ones are
+        skipped, so re-scraping an unchanged page costs no embeddings. With
+        dedup, new chunks that near-duplicate a live chunk (or each other) are
+        dropped before embedding; chunks dropped that way are ignored when
+        checking a page for changes. Pages left without any chunks are
+        remembered by content hash, so they too count as unchanged next time.
+        """
+        processor = processor or TextProcessor.for_model(self.embedding_model, self.chunking)
+        documents = list({doc['url']: doc for doc in documents}.values())  # Last copy of a URL wins
+        next_doc_id = self.metadata.max_doc_id() + 1
+        stats = {'added': 0, 'replaced': 0, 'unchanged': 0}
+        dedup = config.dedup_chunks if dedup is None else dedup
+        live_filter = None
+        
+        pending = []
+        changed = {}  # URL -> page hash of pages to (re)index
+        for doc in documents:
+            chunks = processor.process_documents([doc], start_doc_id=next_doc_id)
+            existing = self.url_chunks(doc['url'])
+            texts = {chunk['chunk_id']: chunk['text'] for chunk in chunks}
+            digest = page_hash(doc)
+            
+            if ((existing and all(texts.get(chunk['chunk_id']) == chunk['text'] for chunk in existing))
+                    or (not existing and self.empty_pages.get(doc['url']) == digest)):
+                # Chunks not indexed for the page are new text unless dedup dropped them
+                indexed = {chunk['chunk_id'] for chunk in existing}
+                extra = [chunk for chunk in chunks if chunk['chunk_id'] not in indexed]
+                if extra and dedup and live_filter is None:
+                    live_filter = self.dedup_filter()
+                if all(dedup and live_filter.find(live_filter.signature(chunk['text'])) for chunk in extra):
+                    stats['unchanged'] += 1
+                    continue
+            
+            stats['replaced' if existing else 'added'] += 1
+            self.delete_url(doc['url'])
+            pending.extend(chunks)
+            changed[doc['url']] = digest
+            next_doc_id += 1
+        
+        if pending and dedup:
+            pending = list(self.dedup_filter().filter(pending))
+        
+        # One encode call for everything that changed
+        self.add_chunks(pending)
+        self.empty_pages.update(_empty_pages(changed, {chunk['url'] for chunk in pending}))
+        return stats
+    
+    def dedup_filter(self) -> NearDuplicateFilter:
+        """A near-duplicate filter that already holds every live chunk"""
+        if self.signatures is None:
+            self.signatures = NearDuplicateFilter().signature_matrix(chunk['text'] for chunk in self.metadata)
+        dedup_filter = NearDuplicateFilter()
+        live = ~np.isin(self.ids, np.fromiter(self.tombstones, dtype=np.int64))
+        dedup_filter.extend(self.signatures[live])
+        return dedup_filter
+    
+    def url_chunks(self, url: str) -> List[Dict]:
+        """Live chunks currently indexed for a URL"""
+        return [self.metadata[row] for row in self._url_rows.get(url, [])
+                if int(self.ids[row]) not in self.tombstones]
+    
+    def compact(self) -> int:
+        """Physically drop tombstoned chunks and rebuild the FAISS index from stored vectors.
+        
+        Chunk IDs of surviving chunks are preserved. Returns the number of chunks removed.
+        """
+        if not self.tombstones:
+            return 0
         
-        print(f"Built index with {len(chunks)} chunks, dimension {dimension}")
+        keep = ~np.isin(self.ids, np.fromiter(self.tombstones, dtype=np.int64))
+        removed = int(len(keep) - keep.sum())
+        
+        self.embeddings = np.ascontiguousarray(self.embeddings[keep])
+        self.ids = self.ids[keep]
+        self.metadata = self.metadata.take(np.flatnonzero(keep))
+        self.tombstones = set()
+        
+        self.index = make_faiss_index(self.index_type, self.embeddings, self.compression)
+        self.index.add_with_ids(self.embeddings, self.ids)
+        self._rebuild_url_rows()
+        self.sparse = None
+        if self.signatures is not None:
+            self.signatures = self.signatures[keep]
+        self._bump_version()
+        
+        print(f"Compacted index: removed {removed} chunks, {len(self.metadata)} remain")
+        return removed
+    
+    @property
+    def live_count(self) -> int:
+        """Number of chunks that are searchable"""
+        return len(self.metadata) - len(self.tombstones)
+    
+    def _bump_version(self) -> None:
+        self.version = uuid.uuid4().hex
+    
+    def _ensure_id_map(self) -> None:
+        """Wrap indexes written before chunk IDs existed, using their row positions as IDs"""
+        import faiss
+        
+        if isinstance(self.index, faiss.IndexIDMap):
+            return
+        
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.index.d))
+        index.add_with_ids(np.ascontiguousarray(self.embeddings, dtype=np.float32), self.ids)
+        self.index = index
+    
+    def _rebuild_url_rows(self) -> None:
+        self._url_rows = self.metadata.url_rows()
     
     def save(self, index_dir: str) -> None:
         """Save index and metadata to disk"""
+        import faiss
+        
         os.makedirs(index_dir, exist_ok=True)
         
         # Save FAISS index
         index_path = os.path.join(index_dir, "index.faiss")
         faiss.write_index(self.index, index_path)
         
-        # Save metadata
-        metadata_path = os.path.join(index_dir, "metadata.jsonl")
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            for item in self.metadata:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        # Save metadata in the compact format and normalized vectors for reuse without re-embedding.
+        # Both may be mapped from the files they replace, which Windows refuses to replace while
+        # mapped, so they are written to temporary files and swapped in after unmapping
+        metadata_header = self.metadata.save(index_dir, replace=False)
+        embeddings_header = write_embeddings(index_dir, self.embeddings, self._model_name(), replace=False)
+        self.metadata.close()
+        self.embeddings = None
+        replace_staged(index_dir, METADATA_FILES + (EMBEDDINGS_FILE,))
+        self.metadata = ChunkMetadata.load(index_dir, metadata_header)
+        self.embeddings = open_embeddings(index_dir, embeddings_header)
+        legacy_path = os.path.join(index_dir, LEGACY_METADATA_FILE)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        
+        ids_header = write_ids(index_dir, self.ids)
+        manifest = {
+            'embeddings': embeddings_header,
+            'metadata': metadata_header,
+            'ids': ids_header,
+            'index': {'type': self.index_type, 'compression': self.compression},
+            'chunking': self.chunking,
+            'next_id': self.next_id,
+            'tombstones': sorted(self.tombstones),
+            'empty_pages': self.empty_pages,
+            'version': self.version,
+        }
+        
+        # Rebuild a stale BM25 index so the saved one always covers the saved rows
+        manifest['sparse'] = self.sparse_index().save(index_dir)
+        if self.signatures is not None:
+            manifest['minhash'] = save_signatures(index_dir, self.signatures, NearDuplicateFilter())
+        else:
+            remove_signatures(index_dir)
+        write_manifest(index_dir, manifest)
         
         print(f"Saved index to {index_dir}")
     
     def load(self, index_dir: str) -> None:
         """Load index and metadata from disk"""
+        import faiss
+        
         # Load FAISS index
         index_path = os.path.join(index_dir, "index.faiss")
         self.index = faiss.read_index(index_path)
         
-        # Load metadata
-        metadata_path = os.path.join(index_dir, "metadata.jsonl")
-        self.metadata = []
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                self.metadata.append(json.loads(line.strip()))
+        # Map stored vectors; older directories fall back to the flat index contents
+        manifest = read_manifest(index_dir) or {}
+        self.index_type = manifest.get('index', {}).get('type', 'flat')
+        self.compression = manifest.get('index', {}).get('compression', 'none')
+        self.chunking = manifest.get('chunking', 'words')
+        apply_search_params(self.index)
+        if 'embeddings' in manifest:
+            header = manifest['embeddings']
+            self._check_embeddings_header(header)
+            self.embeddings = open_embeddings(index_dir, header)
+        else:
+            self.embeddings = self.index.reconstruct_n(0, self.index.ntotal)
         
-        print(f"Loaded index from {index_dir} with {len(self.metadata)} chunks")
-    
-    def search(self, query: str, top_k: int = None) -> List[Tuple[Dict, float]]:
-        """Search the index for similar chunks"""
-        if not self.index:
-            raise ValueError("Index not built or loaded")
+        # Chunk IDs default to row positions for directories written before they existed
+        if 'ids' in manifest:
+            self.ids = read_ids(index_dir, manifest['ids'])
+        else:
+            self.ids = np.arange(self.index.ntotal, dtype=np.int64)
+        self.next_id = manifest.get('next_id', len(self.ids))
+        self.tombstones = set(manifest.get('tombstones', []))
+        self.empty_pages = manifest.get('empty_pages', {})
+        if 'version' in manifest:
+            self.version = manifest['version']
+        else:
+            stat = os.stat(index_path)
+            self.version = f"{stat.st_size}-{stat.st_mtime_ns}"
         
-        top_k = top_k or config.top_k
+        # Map metadata; chunk texts are decoded only for rows that are read
+        if 'metadata' in manifest:
+            self.metadata = ChunkMetadata.load(index_dir, manifest['metadata'])
+        else:
+            self.metadata = ChunkMetadata.load_jsonl(os.path.join(index_dir, LEGACY_METADATA_FILE))
+        self._rebuild_url_rows()
+        
+        self.sparse = None
+        if manifest.get('sparse', {}).get('count') == len(self.metadata):
+            self.sparse = BM25Index.load(index_dir, manifest['sparse'])
+        
+        # Signatures computed with other MinHash settings are recomputed when needed
+        self.signatures = None
+        minhash = manifest.get('minhash', {})
+        reference = NearDuplicateFilter()
+        if (minhash.get('count') == len(self.metadata) and minhash.get('num_perm') == reference.num_perm
+                and minhash.get('shingle_size') == reference.shingle_size):
+            self.signatures = load_signatures(index_dir, minhash)
+        
+        print(f"Loaded index from {index_dir} with {self.live_count} chunks")
+    
+    def _model_name(self) -> str:
+        return getattr(self.embedding_model, 'model_name', 'unknown')
+    
+    def _check_embeddings_header(self, header: Dict) -> None:
+        """Reject stored vectors that cannot be compared with this index's queries"""
+        if header['dimension'] != self.index.d:
+            raise ValueError(f"Stored embeddings have dimension {header['dimension']}, "
+                             f"index has {self.index.d}")
+        if header['count'] != self.index.ntotal:
+            raise ValueError(f"Stored embeddings have {header['count']} rows, "
+                             f"index has {self.index.ntotal}")
+        if header['model_name'] != self._model_name():
+            raise ValueError(f"Index was built with {header['model_name']}, "
+                             f"but the loaded embedding model is {self._model_name()}")
+    
+    def encode_query(self, query: str) -> np.ndarray:
+        """Encode a query into a normalized (1, dimension) float32 vector"""
+        import faiss
         
-        # Encode query
         query_embedding = self.embedding_model.encode_single(query)
-        query_embedding = query_embedding.reshape(1, -1).astype(np.float32)
+        query_embedding = np.ascontiguousarray(query_embedding.reshape(1, -1), dtype=np.float32)
         
         # Normalize for cosine similarity
         faiss.normalize_L2(query_embedding)
+        return query_embedding
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode many queries in one model call into normalized (n, dimension) float32 vectors"""
+        import faiss
         
-        # Search
-        scores, indices = self.index.search(query_embedding, top_k)
+        query_embeddings = np.ascontiguousarray(self.embedding_model.encode(queries), dtype=np.float32)
+        faiss.normalize_L2(query_embeddings)
+        return query_embeddings
+    
+    def search_vectors(self, query_embeddings: np.ndarray, top_k: int) -> List[List[Tuple[int, float]]]:
+        """Search many pre-computed query vectors at once, returning (row, score) pairs per query"""
+        if not self.index:
+            raise ValueError("Index not built or loaded")
         
-        # Return results with metadata
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.metadata):
-                results.append((self.metadata[idx], float(score)))
+        # Over-fetch so tombstoned chunks can be filtered out, and for exact rescoring
+        exact = self.compression == 'none' or not config.compression_rescore
+        fetch_k = top_k + len(self.tombstones)
+        fetch_k = min(fetch_k if exact else fetch_k * config.rescore_factor, self.index.ntotal)
+        scores, found_ids = self.index.search(query_embeddings, fetch_k)
         
-        return results
+        all_results = []
+        for query_embedding, query_scores, query_ids in zip(query_embeddings, scores, found_ids):
+            if not exact:
+                # Compressed scores only pick the shortlist; rank it with the stored float32 vectors
+                query_ids = query_ids[query_ids >= 0]
+                query_scores, rows = rescore(self.embeddings, query_embedding, np.searchsorted(self.ids, query_ids))
+                query_ids = self.ids[rows]
+            results = []
+            for score, chunk_id in zip(query_scores, query_ids):
+                if chunk_id < 0 or int(chunk_id) in self.tombstones:
+                    continue
+                results.append((self._row_of(chunk_id), float(score)))
+                if len(results) == top_k:
+                    break
+            all_results.append(results)
+        return all_results
+    
+    def search_vector(self, query_embedding: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Search with a pre-computed query vector, returning (row, score) pairs"""
+        return self.search_vectors(query_embedding, top_k)[0]
+    
+    def _row_of(self, chunk_id: int) -> int:
+        """Row of a chunk ID; IDs increase with rows, so this is a binary search"""
+        return int(np.searchsorted(self.ids, chunk_id))
     
-    def mmr_search(self, query: str, top_k: int = None, diversity: float = None) -> List[Tuple[Dict, float]]:
+    def search(self, query: str, top_k: int = None,
+               query_embedding: np.ndarray = None) -> List[Tuple[Dict, float]]:
+        """Search the index for similar chunks, optionally with an already encoded query"""
+        if not self.index:
+            raise ValueError("Index not built or loaded")
+        
+        top_k = top_k or config.top_k
+        if query_embedding is None:
+            query_embedding = self.encode_query(query)
+        
+        hits = self.search_vector(query_embedding, top_k)
+        return [(self.metadata[row], score) for row, score in hits]
+    
+    def mmr_search(self, query: str, top_k: int = None, diversity: float = None,
+                   query_embedding: np.ndarray = None) -> List[Tuple[Dict, float]]:
         """Search with Maximal Marginal Relevance for diversity"""
+        if not self.index:
+            raise ValueError("Index not built or loaded")
+        
         top_k = top_k or config.top_k
         diversity = diversity or config.mmr_diversity
+        if query_embedding is None:
+            query_embedding = self.encode_query(query)
+        
+        # Get more candidates than needed; the query is encoded at most once
+        return self._mmr_from_hits(self.search_vector(query_embedding, top_k * 3), top_k, diversity)
+    
+    def sparse_index(self) -> BM25Index:
+        """The BM25 index, rebuilt from chunk texts if rows changed since it was built"""
+        if self.sparse is None:
+            self.sparse = BM25Index.build(chunk['text'] for chunk in self.metadata)
+        return self.sparse
+    
+    def sparse_search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """BM25 (row, score) pairs, skipping deleted chunks"""
+        tombstones = self.tombstones
+        hits = self.sparse_index().search(query, top_k + len(tombstones))
+        if tombstones:
+            hits = [(row, score) for row, score in hits if int(self.ids[row]) not in tombstones]
+        return hits[:top_k]
+    
+    def hybrid_search(self, query: str, top_k: int = None, query_embedding: np.ndarray = None,
+                      use_mmr: bool = False, diversity: float = None) -> List[Tuple[Dict, float]]:
+        """Fuse dense and BM25 rankings with reciprocal rank fusion.
+        
+        Exact tokens such as part numbers and error codes are found by BM25
+        even when the dense model ranks them low. Scores are fused RRF scores.
+        """
+        if not self.index:
+            raise ValueError("Index not built or loaded")
         
-        # Get more candidates than needed
-        candidates = self.search(query, top_k * 3)
-        if not candidates:
+        top_k = top_k or config.top_k
+        if query_embedding is None:
+            query_embedding = self.encode_query(query)
+        dense_hits = self.search_vector(query_embedding, top_k * 3)
+        return self._fuse(query, dense_hits, top_k, use_mmr, diversity)
+    
+    def _fuse(self, query: str, dense_hits: List[Tuple[int, float]], top_k: int,
+              use_mmr: bool, diversity: float) -> List[Tuple[Dict, float]]:
+        sparse_hits = self.sparse_search(query, len(dense_hits) or top_k * 3)
+        fused = reciprocal_rank_fusion([[row for row, _ in dense_hits], [row for row, _ in sparse_hits]])
+        if use_mmr:
+            # Relevance scaled to [0, 1] so it is comparable with the redundancy term
+            best = fused[0][1] if fused else 1.0
+            return self._mmr_from_hits([(row, score / best) for row, score in fused], top_k,
+                                       diversity or config.mmr_diversity)
+        return [(self.metadata[row], score) for row, score in fused[:top_k]]
+    
+    def search_batch(self, queries: List[str], top_k: int = None, use_mmr: bool = True,
+                     diversity: float = None, hybrid: bool = False,
+                     query_embeddings: np.ndarray = None) -> List[List[Tuple[Dict, float]]]:
+        """Retrieve for many queries with one encode call (skipped if query_embeddings are given)
+        and one multi-query FAISS search"""
+        if not queries:
             return []
         
-        # MMR selection
-        selected = [candidates[0]]  # Start with most relevant
-        candidates = candidates[1:]
+        top_k = top_k or config.top_k
+        diversity = diversity or config.mmr_diversity
+        if query_embeddings is None:
+            query_embeddings = self.encode_queries(queries)
         
-        query_embedding = self.embedding_model.encode_single(query)
+        all_hits = self.search_vectors(query_embeddings, top_k * 3 if use_mmr or hybrid else top_k)
+        if hybrid:
+            return [self._fuse(query, hits, top_k, use_mmr, diversity) for query, hits in zip(queries, all_hits)]
+        if use_mmr:
+            return [self._mmr_from_hits(hits, top_k, diversity) for hits in all_hits]
+        return [[(self.metadata[row], score) for row, score in hits] for hits in all_hits]
+    
+    def _mmr_from_hits(self, hits: List[Tuple[int, float]], top_k: int,
+                       diversity: float) -> List[Tuple[Dict, float]]:
+        if not hits:
+            return []
         
-        while len(selected) < top_k and candidates:
-            best_score = -float('inf')
-            best_idx = 0
-            
-            for i, (candidate, _) in enumerate(candidates):
-                # Relevance score
-                candidate_embedding = self.embedding_model.encode_single(candidate['text'])
-                relevance = np.dot(query_embedding, candidate_embedding)
-                
-                # Diversity score (minimum similarity to selected items)
-                diversity_score = float('inf')
-                for selected_item, _ in selected:
-                    selected_embedding = self.embedding_model.encode_single(selected_item['text'])
-                    similarity = np.dot(candidate_embedding, selected_embedding)
-                    diversity_score = min(diversity_score, similarity)
-                
-                # MMR score
-                mmr_score = diversity * relevance - (1 - diversity) * diversity_score
-                
-                if mmr_score > best_score:
-                    best_score = mmr_score
-                    best_idx = i
-            
-            selected.append(candidates.pop(best_idx))
+        rows = [row for row, _ in hits]
+        selected = mmr_select(self.embeddings[rows], np.array([score for _, score in hits]),
+                              top_k, diversity)
+        return [(self.metadata[rows[i]], hits[i][1]) for i in selected]
+
+def mmr_select(candidate_embeddings: np.ndarray, relevance: np.ndarray,
+               top_k: int, diversity: float) -> List[int]:
+    """Greedy MMR over normalized candidate vectors, returning selected positions.
+    
+    Candidates are expected in descending relevance order. Pairwise similarities
+    are computed once as a matrix product and the redundancy term (maximum
+    similarity to anything already selected) is updated incrementally.
+    """
+    num_candidates = len(relevance)
+    if num_candidates == 0:
+        return []
+    
+    candidate_embeddings = np.asarray(candidate_embeddings, dtype=np.float32)
+    similarity = candidate_embeddings @ candidate_embeddings.T
+    
+    selected = [0]  # Start with most relevant
+    available = np.ones(num_candidates, dtype=bool)
+    available[0] = False
+    redundancy = similarity[0].copy()
+    
+    while len(selected) < min(top_k, num_candidates):
+        mmr_scores = diversity * relevance - (1 - diversity) * redundancy
+        mmr_scores[~available] = -np.inf
+        best = int(np.argmax(mmr_scores))
         
-        return selected
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    
+    return selected
 
-def build_index_from_docstore(docstore_path: str, index_dir: str) -> VectorIndex:
-    """Build index from a docstore file"""
+def build_index_from_docstore(docstore_path: str, index_dir: str, use_cache: bool = True,
+                              index_type: str = None, chunking: str = None, dedup: bool = None,
+                              compression: str = None) -> VectorIndex:
+    """Build index from a docstore file, dropping near-duplicate chunks before embedding"""
     from .scrape import load_docstore
     
     # Load documents
     documents = load_docstore(docstore_path)
     
     # Process into chunks
-    processor = TextProcessor()
-    chunks = processor.process_documents(documents)
+    cache_path = config.embedding_cache_path if use_cache else None
+    embedding_model = get_embedding_model(cache_path=cache_path)
+    processor = TextProcessor.for_model(embedding_model, chunking)
+    dedup_filter = NearDuplicateFilter() if (config.dedup_chunks if dedup is None else dedup) else None
+    chunks = processor.chunk_store(documents, dedup=dedup_filter)
     
-    # Build index
-    index = VectorIndex()
+    # Build index, reusing cached embeddings of unchanged chunks
+    index = VectorIndex(embedding_model, index_type=index_type, compression=compression)
+    index.chunking = chunking or config.chunking
+    start = time.perf_counter()
     index.build_index(chunks)
+    _report_dedup(dedup_filter, len(chunks), time.perf_counter() - start)
+    if dedup_filter is not None:
+        index.signatures = dedup_filter.signature_matrix()  # Kept chunks, in row order
+    index.empty_pages = _empty_pages({doc['url']: page_hash(doc) for doc in documents}, index.metadata.url_rows())
     index.save(index_dir)
+    _report_throughput(index.embedding_model)
+    _report_cache(index.embedding_model)
     
+    return index
+
+def encode_chunks(embedding_model: EmbeddingModel, chunks: List[Dict]) -> np.ndarray:
+    """Embed chunk texts through the model's bulk path (length-bucketed batches) when it has one"""
+    encode = getattr(embedding_model, 'encode_bulk', embedding_model.encode)
+    return encode([chunk['text'] for chunk in chunks])
+
+def _report_throughput(embedding_model: EmbeddingModel) -> None:
+    if not hasattr(embedding_model, 'throughput'):
+        return
+    stats = embedding_model.throughput()
+    if stats['texts']:
+        print(f"Embedded {stats['texts']} chunks ({stats['tokens']} tokens) in {stats['seconds']:.1f}s: "
+              f"{stats['tokens_per_second']:,.0f} tokens/s, {stats['batches']} batches, "
+              f"{stats['padding']:.1%} padding")
+
+def _report_cache(embedding_model: EmbeddingModel) -> None:
+    cache = getattr(embedding_model, 'cache', None)
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.1%} hit rate, {stats['entries']} entries)")
+
+def _report_dedup(dedup_filter: NearDuplicateFilter, embedded: int, embed_seconds: float = None) -> None:
+    """Print the dedup ratio and, given embed_seconds, the embedding time the dropped chunks would have cost"""
+    if dedup_filter is None:
+        return
+    stats = dedup_filter.stats()
+    message = (f"Dedup: dropped {stats['dropped']} of {stats['seen']} chunks as near-duplicates "
+               f"({stats['ratio']:.1%})")
+    if embed_seconds is not None:
+        saved = stats['dropped'] * embed_seconds / embedded if embedded else 0.0
+        message += f", saving ~{saved:.1f}s of embedding"
+    print(message)
+
+def batched(items: Iterable, batch_size: int) -> Iterator[List]:
+    """Yield lists of up to batch_size items"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def page_hash(doc: Dict) -> str:
+    """Content hash of a docstore page"""
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _empty_pages(pages: Dict[str, str], indexed_urls: Iterable[str]) -> Dict[str, str]:
+    """The (URL -> page hash) pages that ended up without any indexed chunk"""
+    indexed_urls = set(indexed_urls)
+    return {url: digest for url, digest in pages.items() if url not in indexed_urls}
+
+def build_index_streaming(docstore_path: str, index_dir: str, batch_size: int = None,
+                          use_cache: bool = True, index_type: str = None,
+                          embedding_model: EmbeddingModel = None, chunking: str = None,
+                          dedup: bool = None, compression: str = None) -> int:
+    """Build an index with memory bounded by the batch size rather than the corpus.
+    
+    Docstore lines are read, cleaned, chunked and embedded one batch at a time;
+    vectors and metadata are appended straight to disk. The FAISS index is then
+    trained and filled from the memory-mapped vectors, so beyond the current
+    batch only the FAISS index itself (and the dedup signatures) is resident.
+    Returns the number of chunks.
+    """
+    from .scrape import iter_docstore
+    
+    batch_size = batch_size or config.embed_batch_size
+    if embedding_model is None:
+        embedding_model = get_embedding_model(cache_path=config.embedding_cache_path if use_cache else None)
+    chunking = chunking or config.chunking
+    processor = TextProcessor.for_model(embedding_model, chunking)
+    
+    dedup_filter = NearDuplicateFilter() if (config.dedup_chunks if dedup is None else dedup) else None
+    chunks = processor.iter_chunks(iter_docstore(docstore_path), dedup=dedup_filter)
+    with staged_index_dir(index_dir) as staging_dir:
+        embeddings_header, metadata_header, embed_seconds = _write_chunks(chunks, staging_dir, embedding_model,
+                                                                          batch_size)
+        num_chunks, index_type = _finish_index(staging_dir, embeddings_header, metadata_header, index_type,
+                                               compression, chunking, dedup_filter, batch_size, docstore_path)
+    print(f"Built {index_type} index with {num_chunks} chunks in batches of {batch_size}")
+    _report_dedup(dedup_filter, num_chunks, embed_seconds)
+    _report_throughput(embedding_model)
+    _report_cache(embedding_model)
+    
+    return num_chunks
+
+def _write_chunks(chunks: Iterable[Dict], index_dir: str, embedding_model: EmbeddingModel,
+                  batch_size: int) -> Tuple[Dict, Dict, float]:
+    """Embed chunks batch by batch, appending vectors and metadata to index_dir.
+    
+    Returns the embeddings and metadata headers and the seconds spent embedding.
+    """
+    import faiss
+    
+    writer = EmbeddingWriter(index_dir, getattr(embedding_model, 'model_name', 'unknown'))
+    metadata_writer = ChunkMetadataWriter(index_dir)
+    embed_seconds = 0.0
+    for batch in batched(chunks, batch_size):
+        start = time.perf_counter()
+        embeddings = np.ascontiguousarray(encode_chunks(embedding_model, batch), dtype=np.float32)
+        embed_seconds += time.perf_counter() - start
+        faiss.normalize_L2(embeddings)
+        writer.append(embeddings)
+        metadata_writer.extend(batch)
+    return writer.close(), metadata_writer.close(), embed_seconds
+
+def _finish_index(index_dir: str, embeddings_header: Dict, metadata_header: Dict, index_type: str,
+                  compression: str, chunking: str, dedup_filter: NearDuplicateFilter,
+                  batch_size: int, docstore_path: str) -> Tuple[int, str]:
+    """Build the FAISS and BM25 indexes over chunks written to a fresh index_dir and write the manifest.
+    
+    Chunk IDs are row numbers; pages of the docstore that left no chunks are
+    recorded for upsert_documents. Returns the number of chunks and the index type.
+    """
+    import faiss
+    from .scrape import iter_docstore
+    
+    if embeddings_header['count'] == 0:
+        raise ValueError("No chunks provided")
+    
+    # Train and fill the FAISS index from the mapped vectors, one batch at a time
+    embeddings = open_embeddings(index_dir, embeddings_header)
+    num_chunks = len(embeddings)
+    index_type = resolve_index_type(index_type or config.index_type, num_chunks)
+    compression = resolve_compression(index_type, compression or config.vector_compression)
+    index = make_faiss_index(index_type, embeddings, compression)
+    for start in range(0, num_chunks, batch_size):
+        end = min(start + batch_size, num_chunks)
+        index.add_with_ids(np.ascontiguousarray(embeddings[start:end]),
+                           np.arange(start, end, dtype=np.int64))
+    del embeddings
+    
+    faiss.write_index(index, os.path.join(index_dir, "index.faiss"))
+    manifest = {
+        'embeddings': embeddings_header,
+        'metadata': metadata_header,
+        'ids': write_ids(index_dir, np.arange(num_chunks, dtype=np.int64)),
+        'index': {'type': index_type, 'compression': compression},
+        'chunking': chunking,
+        'next_id': num_chunks,
+        'tombstones': [],
+        'version': uuid.uuid4().hex,
+    }
+    metadata = ChunkMetadata.load(index_dir, metadata_header)
+    manifest['empty_pages'] = _empty_pages({doc['url']: page_hash(doc) for doc in iter_docstore(docstore_path)},
+                                           metadata.url_rows())
+    manifest['sparse'] = BM25Index.build(chunk['text'] for chunk in metadata).save(index_dir)
+    metadata.close()
+    if dedup_filter is not None:
+        manifest['minhash'] = save_signatures(index_dir, dedup_filter.signature_matrix(), dedup_filter)
+    write_manifest(index_dir, manifest)
+    return num_chunks, index_type
+
+def build_index_sharded(docstore_path: str, index_dir: str, workers: int, batch_size: int = None,
+                        use_cache: bool = True, index_type: str = None, embedding_model: EmbeddingModel = None,
+                        chunking: str = None, dedup: bool = None, compression: str = None) -> int:
+    """Build an index with chunking and embedding spread over worker processes.
+    
+    The docstore is split into ``workers`` contiguous ranges of documents and
+    each worker writes its own vector, metadata and signature shard (see
+    build_index_streaming). Workers embed every chunk; the shards are merged
+    in document order, dropping near-duplicates, so chunk IDs are assigned as
+    in a single process build and the index files are identical on every run with the
+    same input and worker count. An embedding_model is sent to every worker,
+    so it must be picklable; by default each worker loads the configured
+    model. Returns the number of chunks.
+    """
+    from .scrape import count_docstore
+    
+    batch_size = batch_size or config.embed_batch_size
+    chunking = chunking or config.chunking
+    dedup = config.dedup_chunks if dedup is None else dedup
+    num_documents = count_docstore(docstore_path)
+    workers = max(1, min(workers, num_documents))
+    bounds = np.linspace(0, num_documents, workers + 1).astype(int)
+    
+    options = {
+        'embedding_model': embedding_model,
+        'model_name': config.embedding_model,
+        'backend': config.embedding_backend,
+        'cache_path': config.embedding_cache_path if use_cache else None,
+        'chunking': chunking,
+        'dedup': dedup,
+        'batch_size': batch_size,
+        'threads': max(1, (os.cpu_count() or 1) // workers),
+    }
+    
+    start = time.perf_counter()
+    with staged_index_dir(index_dir) as staging_dir:
+        shards_dir = os.path.join(staging_dir, "shards")
+        shard_dirs = [os.path.join(shards_dir, f"{shard:04d}") for shard in range(workers)]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_build_shard, docstore_path, shard_dir, int(bounds[shard]),
+                                           int(bounds[shard + 1]), options)
+                           for shard, shard_dir in enumerate(shard_dirs)]
+                shards = [future.result() for future in futures]
+            embed_wall = time.perf_counter() - start
+            
+            embeddings_header, metadata_header, dedup_filter = _merge_shards(shard_dirs, shards, staging_dir,
+                                                                             dedup, batch_size)
+            num_chunks, index_type = _finish_index(staging_dir, embeddings_header, metadata_header, index_type,
+                                                   compression, chunking, dedup_filter, batch_size, docstore_path)
+        finally:
+            shutil.rmtree(shards_dir, ignore_errors=True)
+    
+    _report_shards(shards, embed_wall)
+    print(f"Built {index_type} index with {num_chunks} chunks from {workers} shards "
+          f"in {time.perf_counter() - start:.1f}s")
+    _report_dedup(dedup_filter, num_chunks)  # Workers embedded the duplicates too
+    return num_chunks
+
+def _build_shard(docstore_path: str, shard_dir: str, start: int, stop: int, options: Dict) -> Dict:
+    """Worker process: chunk and embed documents [start, stop) into shard_dir"""
+    from .scrape import iter_docstore
+    
+    try:
+        import torch
+        torch.set_num_threads(options['threads'])  # Share the cores instead of oversubscribing them
+    except ImportError:
+        pass
+    
+    began = time.perf_counter()
+    embedding_model = options['embedding_model'] or get_embedding_model(
+        options['model_name'], cache_path=options['cache_path'], backend=options['backend'])
+    processor = TextProcessor.for_model(embedding_model, options['chunking'])
+    
+    os.makedirs(shard_dir, exist_ok=True)
+    chunks = processor.iter_chunks(iter_docstore(docstore_path, start, stop), start_doc_id=start)
+    embeddings_header, metadata_header, embed_seconds = _write_chunks(chunks, shard_dir, embedding_model,
+                                                                      options['batch_size'])
+    shard = {
+        'documents': stop - start,
+        'embeddings': embeddings_header,
+        'metadata': metadata_header,
+        'embed_seconds': embed_seconds,
+        'seconds': time.perf_counter() - began,
+        'tokens': embedding_model.throughput()['tokens'] if hasattr(embedding_model, 'throughput') else None,
+    }
+    if options['dedup']:
+        # Sign every chunk; near-duplicates are dropped only by the merge, in document order
+        signer = NearDuplicateFilter()
+        texts = (chunk['text'] for chunk in ChunkMetadata.load(shard_dir, metadata_header))
+        shard['minhash'] = save_signatures(shard_dir, signer.signature_matrix(texts), signer)
+    return shard
+
+def _merge_shards(shard_dirs: List[str], shards: List[Dict], index_dir: str, dedup: bool,
+                  batch_size: int) -> Tuple[Dict, Dict, NearDuplicateFilter]:
+    """Concatenate shard vectors and metadata into index_dir in shard order.
+    
+    With dedup, every chunk is checked against the chunks kept before it, in
+    the same order as a single process build, so the returned filter holds
+    exactly the merged rows.
+    """
+    writer = EmbeddingWriter(index_dir, shards[0]['embeddings']['model_name'])
+    metadata_writer = ChunkMetadataWriter(index_dir)
+    dedup_filter = NearDuplicateFilter() if dedup else None
+    
+    for shard_dir, shard in zip(shard_dirs, shards):
+        embeddings = open_embeddings(shard_dir, shard['embeddings'])
+        metadata = ChunkMetadata.load(shard_dir, shard['metadata'])
+        keep = np.ones(len(embeddings), dtype=bool)
+        if dedup_filter is not None:
+            signatures = load_signatures(shard_dir, shard['minhash'])
+            keep = np.array([not dedup_filter.is_duplicate_signature(signature) for signature in signatures],
+                            dtype=bool)
+        
+        rows = np.flatnonzero(keep)
+        for start in range(0, len(rows), batch_size):
+            writer.append(embeddings[rows[start:start + batch_size]])
+        metadata_writer.extend(metadata[int(row)] for row in rows)
+        del embeddings, metadata
+    return writer.close(), metadata_writer.close(), dedup_filter
+
+def _report_shards(shards: List[Dict], wall_seconds: float) -> None:
+    """Print the workers' combined throughput and how evenly the shards took.
+    
+    The balance (mean over slowest shard time) caps the scaling efficiency;
+    benchmarks/bench_sharded_build.py measures the efficiency against one worker.
+    """
+    seconds = [shard['seconds'] for shard in shards]
+    chunks = sum(shard['embeddings']['count'] for shard in shards)
+    rate = f"{chunks / wall_seconds:.0f} chunks/s"
+    if all(shard['tokens'] is not None for shard in shards):
+        rate += f", {sum(shard['tokens'] for shard in shards) / wall_seconds:,.0f} tokens/s"
+    print(f"Embedded {chunks} chunks with {len(shards)} workers in {wall_seconds:.1f}s ({rate}); "
+          f"shard balance {sum(seconds) / len(seconds) / max(seconds):.0%}")
+
+def update_index_from_docstore(docstore_path: str, index_dir: str, use_cache: bool = True,
+                               chunking: str = None, dedup: bool = None) -> VectorIndex:
+    """Upsert a docstore into an existing index, embedding only new or changed pages.
+    
+    Pages are chunked the way the index was built unless chunking is given.
+    """
+    from .scrape import load_docstore
+    
+    cache_path = config.embedding_cache_path if use_cache else None
+    index = VectorIndex(get_embedding_model(cache_path=cache_path))
+    index.load(index_dir)
+    if chunking:
+        index.chunking = chunking
+    
+    stats = index.upsert_documents(load_docstore(docstore_path), dedup=dedup)
+    print(f"Updated index: {stats['added']} added, {stats['replaced']} replaced, "
+          f"{stats['unchanged']} unchanged")
+    
+    index.save(index_dir)
+    _report_throughput(index.embedding_model)
+    _report_cache(index.embedding_model)
     return index
\ No newline at end of file
@@ -1,26 +1,212 @@
 """Text processing and chunking utilities"""
 
 import re
-from typing import List, Dict
+import sys
+import numpy as np
+from collections.abc import Mapping
+from typing import Any, List, Dict, Iterable, Iterator, Tuple
 from .config import config
+from .dedup import NearDuplicateFilter
+
+CHUNKING_MODES = ('words', 'tokens')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+def split_sentences(text: str) -> List[str]:
+    """Split cleaned text after sentence-ending punctuation"""
+    return [sentence for sentence in SENTENCE_END.split(text) if sentence]
+
+def token_counts(tokenizer: Any, texts: List[str], add_special_tokens: bool = False) -> List[int]:
+    """Token count of each text, from one batched call to a (fast) tokenizer"""
+    if not texts:
+        return []
+    encoded = tokenizer(texts, add_special_tokens=add_special_tokens, verbose=False)
+    return [len(ids) for ids in encoded['input_ids']]
+
+def truncation_report(texts: Iterable[str], tokenizer: Any, max_tokens: int,
+                      batch_size: int = 1024) -> Dict:
+    """How many tokens of each text the embedder would cut off at max_tokens"""
+    report = {'chunks': 0, 'tokens': 0, 'wasted_tokens': 0, 'truncated_chunks': 0}
+    batch = []
+    
+    def count(batch):
+        for n in token_counts(tokenizer, batch, add_special_tokens=True):
+            report['chunks'] += 1
+            report['tokens'] += n
+            report['wasted_tokens'] += max(0, n - max_tokens)
+            report['truncated_chunks'] += n > max_tokens
+    
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            count(batch)
+            batch = []
+    count(batch)
+    
+    report['wasted_fraction'] = report['wasted_tokens'] / report['tokens'] if report['tokens'] else 0.0
+    return report
+
+class DocumentRecord:
+    """One source document in a ChunkStore, holding its cleaned text once"""
+    __slots__ = ('doc_id', 'url', 'title', 'doc_length', 'text')
+    
+    def __init__(self, doc_id: int, url: str, title: str, doc_length: int, text: str):
+        self.doc_id = doc_id
+        self.url = url
+        self.title = title
+        self.doc_length = doc_length
+        self.text = text
+
+class Chunk(Mapping):
+    """Read-only view of one ChunkStore row that behaves like a chunk dict.
+    
+    Only the store and row are held; the text is sliced from the document's
+    cleaned text when accessed.
+    """
+    __slots__ = ('store', 'row')
+    FIELDS = ('text', 'chunk_id', 'start_word', 'end_word', 'doc_id', 'url', 'title', 'doc_length')
+    
+    def __init__(self, store: 'ChunkStore', row: int):
+        self.store = store
+        self.row = row
+    
+    def __getitem__(self, key: str) -> Any:
+        return self.store.field(self.row, key)
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.FIELDS)
+    
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+    
+    def __repr__(self) -> str:
+        return f"Chunk({dict(self)!r})"
+
+class ChunkStore:
+    """Chunks as a document table plus array-backed offsets into each document's cleaned text.
+    
+    Per chunk only a few integers are stored (document, chunk_id, word range
+    and character range). Chunk texts are slices of the document text and are
+    produced on access, so overlapping chunks never duplicate strings.
+    """
+    
+    COLUMNS = (('doc', np.int32), ('chunk_id', np.int32), ('start_word', np.int32),
+               ('end_word', np.int32), ('start_char', np.int64), ('end_char', np.int64))
+    
+    def __init__(self):
+        self.documents = []
+        self._blocks = []  # Per-document column arrays, concatenated on first read
+        self._columns = None
+    
+    def add_document(self, document: DocumentRecord, start_word: np.ndarray, end_word: np.ndarray,
+                     word_starts: np.ndarray, word_ends: np.ndarray, chunk_id: np.ndarray = None) -> None:
+        """Add a document's chunks, given their word ranges and the text's word offsets"""
+        count = len(start_word)
+        if not count:
+            return
+        doc = len(self.documents)
+        self.documents.append(document)
+        chunk_id = np.arange(count) if chunk_id is None else chunk_id
+        self._blocks.append((np.full(count, doc), chunk_id, start_word, end_word,
+                             word_starts[start_word], word_ends[end_word - 1]))
+        self._columns = None
+    
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        if self._columns is None:
+            self._columns = {
+                name: np.concatenate([block[i] for block in self._blocks]).astype(dtype)
+                if self._blocks else np.zeros(0, dtype=dtype)
+                for i, (name, dtype) in enumerate(self.COLUMNS)
+            }
+            self._blocks = [tuple(self._columns[name] for name, _ in self.COLUMNS)]
+        return self._columns
+    
+    def __len__(self) -> int:
+        return len(self.columns['doc'])
+    
+    def __getitem__(self, row: int) -> Chunk:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return Chunk(self, row)
+    
+    def __iter__(self) -> Iterator[Chunk]:
+        for row in range(len(self)):
+            yield Chunk(self, row)
+    
+    def text(self, row: int) -> str:
+        columns = self.columns
+        return self.documents[columns['doc'][row]].text[columns['start_char'][row]:columns['end_char'][row]]
+    
+    def texts(self) -> Iterator[str]:
+        for row in range(len(self)):
+            yield self.text(row)
+    
+    def field(self, row: int, key: str) -> Any:
+        if key == 'text':
+            return self.text(row)
+        if key in ('chunk_id', 'start_word', 'end_word'):
+            return int(self.columns[key][row])
+        if key in ('doc_id', 'url', 'title', 'doc_length'):
+            return getattr(self.documents[self.columns['doc'][row]], key)
+        raise KeyError(key)
+    
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory of the offsets, document table and cleaned texts"""
+        return (sum(array.nbytes for array in self.columns.values())
+                + sum(sys.getsizeof(doc) + sys.getsizeof(doc.text) for doc in self.documents))
+
+def word_offsets(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end character positions of the words of single-space separated text"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    spaces = np.flatnonzero(codes == 32)
+    return np.concatenate(([0], spaces + 1)), np.concatenate((spaces, [len(text)]))
 
 class TextProcessor:
-    def __init__(self, chunk_size: int = None, chunk_overlap: int = None):
+    """Cleans and chunks documents.
+    
+    By default chunks are ``chunk_size`` words. Given a tokenizer, chunks are
+    instead packed from whole sentences up to ``max_tokens`` tokens (the
+    embedder's max sequence length, including special tokens), so nothing is
+    lost to truncation; ``chunk_overlap`` is then counted in tokens.
+    """
+    
+    def __init__(self, chunk_size: int = None, chunk_overlap: int = None,
+                 tokenizer: Any = None, max_tokens: int = None):
         self.chunk_size = chunk_size or config.chunk_size
         self.chunk_overlap = chunk_overlap or config.chunk_overlap
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        if tokenizer is not None:
+            special_tokens = token_counts(tokenizer, [""], add_special_tokens=True)[0]
+            self.token_budget = max_tokens - special_tokens
+    
+    @classmethod
+    def for_model(cls, embedding_model: Any, chunking: str = None) -> 'TextProcessor':
+        """Processor for a chunking mode; 'tokens' sizes chunks to the model's max sequence length"""
+        chunking = chunking or config.chunking
+        if chunking not in CHUNKING_MODES:
+            raise ValueError(f"Unknown chunking mode {chunking!r}, expected one of {CHUNKING_MODES}")
+        if chunking == 'words':
+            return cls()
+        return cls(tokenizer=embedding_model.tokenizer, max_tokens=embedding_model.max_seq_length)
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
         # Remove special characters but keep basic punctuation
         text = re.sub(r'[^\w\s.,!?;:()\-\'"]+', ' ', text)
+        # Remove extra whitespace, including gaps left by removed characters
+        text = re.sub(r'\s+', ' ', text)
         return text.strip()
     
     def chunk_text(self, text: str, metadata: Dict = None) -> List[Dict]:
         """Split text into overlapping chunks"""
         if not text:
             return []
+        if self.tokenizer is not None:
+            return self.chunk_text_by_tokens(text, metadata)
         
         words = text.split()
         chunks = []
@@ -48,11 +234,76 @@ class TextProcessor:
         
         return chunks
     
-    def process_documents(self, documents: List[Dict]) -> List[Dict]:
-        """Process multiple documents into chunks"""
-        all_chunks = []
+    def chunk_text_by_tokens(self, text: str, metadata: Dict = None) -> List[Dict]:
+        """Pack whole sentences into chunks of at most token_budget tokens.
+        
+        Sentences longer than the budget are split between words. Consecutive
+        chunks share trailing sentences worth up to chunk_overlap tokens.
+        """
+        pieces = []  # (text, tokens, words)
+        sentences = split_sentences(text)
+        for sentence, tokens in zip(sentences, token_counts(self.tokenizer, sentences)):
+            if tokens <= self.token_budget:
+                pieces.append((sentence, tokens, len(sentence.split())))
+            else:
+                pieces.extend(self._split_long_sentence(sentence))
         
-        for doc_idx, doc in enumerate(documents):
+        word_starts = [0]
+        for _, _, words in pieces:
+            word_starts.append(word_starts[-1] + words)
+        
+        chunks = []
+        start = 0
+        while start < len(pieces):
+            end, tokens = start, 0
+            while end < len(pieces) and (end == start or tokens + pieces[end][1] <= self.token_budget):
+                tokens += pieces[end][1]
+                end += 1
+            
+            chunk_data = {
+                'text': ' '.join(piece for piece, _, _ in pieces[start:end]),
+                'chunk_id': len(chunks),
+                'start_word': word_starts[start],
+                'end_word': word_starts[end]
+            }
+            if metadata:
+                chunk_data.update(metadata)
+            chunks.append(chunk_data)
+            
+            if end == len(pieces):
+                break
+            
+            # Step back over trailing sentences for overlap, always making progress
+            next_start, overlap = end, 0
+            while next_start - 1 > start and overlap + pieces[next_start - 1][1] <= self.chunk_overlap:
+                next_start -= 1
+                overlap += pieces[next_start][1]
+            start = next_start
+        
+        return chunks
+    
+    def _split_long_sentence(self, sentence: str) -> List[Tuple[str, int, int]]:
+        words = sentence.split()
+        pieces = []
+        current, tokens = [], 0
+        for word, word_tokens in zip(words, token_counts(self.tokenizer, words)):
+            if current and tokens + word_tokens > self.token_budget:
+                pieces.append((' '.join(current), tokens, len(current)))
+                current, tokens = [], 0
+            current.append(word)
+            tokens += word_tokens
+        if current:
+            pieces.append((' '.join(current), tokens, len(current)))
+        return pieces
+    
+    def iter_chunks(self, documents: Iterable[Dict], start_doc_id: int = 0,
+                    dedup: NearDuplicateFilter = None) -> Iterator[Dict]:
+        """Lazily clean and chunk documents, one document in memory at a time.
+        
+        With a dedup filter, near-duplicates of earlier chunks are skipped
+        (remaining chunks keep their original chunk_id).
+        """
+        for doc_idx, doc in enumerate(documents, start_doc_id):
             clean_content = self.clean_text(doc['content'])
             
             metadata = {
@@ -63,6 +314,48 @@ class TextProcessor:
             }
             
             chunks = self.chunk_text(clean_content, metadata)
-            all_chunks.extend(chunks)
+            yield from (dedup.filter(chunks) if dedup is not None else chunks)
+    
+    def process_documents(self, documents: List[Dict], start_doc_id: int = 0) -> List[Dict]:
+        """Process multiple documents into chunks"""
+        return list(self.iter_chunks(documents, start_doc_id))
+    
+    def chunk_store(self, documents: Iterable[Dict], start_doc_id: int = 0,
+                    dedup: NearDuplicateFilter = None) -> ChunkStore:
+        """Chunk documents into a ChunkStore.
+        
+        Rows read like the dicts from process_documents (same texts and fields)
+        but cost a few integers each instead of a dict and a string. With a
+        dedup filter, rows match iter_chunks with the same filter.
+        """
+        store = ChunkStore()
+        step = self.chunk_size - self.chunk_overlap
+        
+        for doc_idx, doc in enumerate(documents, start_doc_id):
+            # Cleaned text is single-spaced, so every chunk text is a slice of it
+            text = self.clean_text(doc['content'])
+            if not text:
+                continue
+            
+            word_starts, word_ends = word_offsets(text)
+            num_words = len(word_starts)
+            if self.tokenizer is not None:
+                chunks = self.chunk_text_by_tokens(text)
+                start_word = np.array([chunk['start_word'] for chunk in chunks])
+                end_word = np.array([chunk['end_word'] for chunk in chunks])
+            else:
+                # Same windows as chunk_text, stopping at the first one that reaches the end
+                start_word = np.arange(0, num_words, step)
+                start_word = start_word[:np.argmax(start_word + self.chunk_size >= num_words) + 1]
+                end_word = np.minimum(start_word + self.chunk_size, num_words)
+            
+            chunk_id = np.arange(len(start_word))
+            if dedup is not None:
+                keep = np.array([not dedup.is_duplicate(text[word_starts[start]:word_ends[end - 1]])
+                                 for start, end in zip(start_word, end_word)], dtype=bool)
+                start_word, end_word, chunk_id = start_word[keep], end_word[keep], chunk_id[keep]
+            
+            store.add_document(DocumentRecord(doc_idx, doc['url'], doc['title'], doc['length'], text),
+                               start_word, end_word, word_starts, word_ends, chunk_id)
         
-        return all_chunks
\ No newline at end of file
+        return store
\ No newline at end of file
@@ -1,35 +1,91 @@
 """RAG (Retrieval-Augmented Generation) pipeline"""
 
 import os
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
 from collections import Counter
 import re
-from .index import VectorIndex
+import importlib.util
+import numpy as np
+from .index import VectorIndex, batched
+from .registry import get_index
+from .cache import LRUCache, SemanticAnswerCache, chunk_keys, normalize_query
 from .config import config
 
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+OPENAI_AVAILABLE = importlib.util.find_spec('openai') is not None  # Imported when a client is created
 
 class RAGPipeline:
-    def __init__(self, index_dir: str, model: str = None):
-        self.index = VectorIndex()
-        self.index.load(index_dir)
+    def __init__(self, index_dir: str = None, model: str = None, index: VectorIndex = None,
+                 hybrid: bool = None):
+        # Indexes (and their embedding models) are loaded once per process
+        self.index = index if index is not None else get_index(index_dir)
         self.model = model or config.default_model
+        self.hybrid = config.hybrid_search if hybrid is None else hybrid  # BM25 + dense fusion
+        
+        # Retrieval caches, cleared whenever the index contents change
+        self.query_cache = LRUCache(config.query_cache_size, config.retrieval_cache_ttl)
+        self.results_cache = LRUCache(config.results_cache_size, config.retrieval_cache_ttl)
+        self._cached_version = self.index.version
+        
+        # LLM answers reused for paraphrased questions over the same chunks, by the same model
+        self.answer_cache = SemanticAnswerCache(config.answer_cache_size, config.answer_cache_threshold,
+                                                config.answer_cache_path, config.answer_cache_ttl)
+        self.answer_cache.set_version(self._answer_version())
         
         # Initialize OpenAI client if available and configured
         self.openai_client = None
         if OPENAI_AVAILABLE and config.openai_api_key:
-            self.openai_client = OpenAI(api_key=config.openai_api_key)
+            from openai import OpenAI
+            self.openai_client = OpenAI(api_key=config.openai_api_key, base_url=config.openai_base_url)
     
     def retrieve(self, query: str, top_k: int = None, use_mmr: bool = True) -> List[Tuple[Dict, float]]:
-        """Retrieve relevant chunks"""
-        if use_mmr:
-            return self.index.mmr_search(query, top_k)
+        """Retrieve relevant chunks, reusing cached query embeddings and results"""
+        self._check_version()
+        
+        top_k = top_k or config.top_k
+        normalized = normalize_query(query)
+        results_key = (normalized, top_k, use_mmr, self.hybrid)
+        
+        results = self.results_cache.get(results_key)
+        if results is not None:
+            return list(results)
+        
+        query_embedding = self._query_embedding(normalized)
+        if self.hybrid:
+            results = self.index.hybrid_search(normalized, top_k, query_embedding=query_embedding,
+                                               use_mmr=use_mmr)
+        elif use_mmr:
+            results = self.index.mmr_search(normalized, top_k, query_embedding=query_embedding)
         else:
-            return self.index.search(query, top_k)
+            results = self.index.search(normalized, top_k, query_embedding=query_embedding)
+        
+        self.results_cache.put(results_key, tuple(results))
+        return results
+    
+    def _check_version(self) -> None:
+        """Invalidate every cache once the index contents change, and cached answers once the LLM does"""
+        if self.index.version != self._cached_version:
+            self.query_cache.clear()
+            self.results_cache.clear()
+            self._cached_version = self.index.version
+        self.answer_cache.set_version(self._answer_version())
+    
+    def _answer_version(self) -> str:
+        return f"{self.index.version}:{self.model}"
+    
+    def _query_embedding(self, normalized: str) -> np.ndarray:
+        query_embedding = self.query_cache.get(normalized)
+        if query_embedding is None:
+            query_embedding = self.index.encode_query(normalized)
+            self.query_cache.put(normalized, query_embedding)
+        return query_embedding
+    
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Hit rates and approximate memory of the retrieval and answer caches"""
+        return {
+            'query_embeddings': self.query_cache.stats(),
+            'results': self.results_cache.stats(),
+            'answers': self.answer_cache.stats(),
+        }
     
     def generate_extractive_answer(self, query: str, results: List[Tuple[Dict, float]]) -> Dict:
         """Generate extractive answer without LLM"""
@@ -41,17 +97,8 @@ class RAGPipeline:
             }
         
         # Extract passages and sources
-        passages = []
-        sources = set()
-        
-        for chunk, score in results:
-            passages.append({
-                'text': chunk['text'][:200] + "..." if len(chunk['text']) > 200 else chunk['text'],
-                'score': score,
-                'source': chunk['title'],
-                'url': chunk['url']
-            })
-            sources.add((chunk['title'], chunk['url']))
+        passages = self._passages(results)
+        sources = {(chunk['title'], chunk['url']) for chunk, _ in results}
         
         # Generate simple extractive answer
         top_passage = results[0][0]['text']
@@ -63,6 +110,34 @@ class RAGPipeline:
             'passages': passages
         }
     
+    def _passages(self, results: List[Tuple[Dict, float]]) -> List[Dict]:
+        """Truncated passages for display"""
+        return [{
+            'text': chunk['text'][:200] + "..." if len(chunk['text']) > 200 else chunk['text'],
+            'score': score,
+            'source': chunk['title'],
+            'url': chunk['url']
+        } for chunk, score in results]
+    
+    def _llm_messages(self, query: str, results: List[Tuple[Dict, float]]) -> List[Dict]:
+        """Chat messages asking the LLM to answer from the numbered context"""
+        context = "\n\n".join(f"[{i+1}] {chunk['text']}" for i, (chunk, _) in enumerate(results))
+        
+        # Create prompt
+        prompt = f"""Based on the following context, answer the question. Include citations using [1], [2], etc. format.
+
+Context:
+{context}
+
+Question: {query}
+
+Answer:"""
+        
+        return [
+            {"role": "system", "content": "You are a helpful assistant that answers questions based on provided context. Always include citations."},
+            {"role": "user", "content": prompt}
+        ]
+    
     def generate_llm_answer(self, query: str, results: List[Tuple[Dict, float]]) -> Dict:
         """Generate answer using OpenAI LLM"""
         if not self.openai_client:
@@ -75,70 +150,134 @@ class RAGPipeline:
                 'passages': []
             }
         
-        # Prepare context from retrieved chunks
-        context_parts = []
-        sources = set()
-        
-        for i, (chunk, score) in enumerate(results):
-            context_parts.append(f"[{i+1}] {chunk['text']}")
-            sources.add((chunk['title'], chunk['url']))
-        
-        context = "\n\n".join(context_parts)
-        
-        # Create prompt
-        prompt = f"""Based on the following context, answer the question. Include citations using [1], [2], etc. format.
-
-Context:
-{context}
-
-Question: {query}
-
-Answer:"""
-        
+        response = self._llm_answer(query, results)
+        return response if response is not None else self.generate_extractive_answer(query, results)
+    
+    def _llm_answer(self, query: str, results: List[Tuple[Dict, float]]) -> Optional[Dict]:
+        """The LLM's answer, or None if the request failed"""
         try:
             response = self.openai_client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that answers questions based on provided context. Always include citations."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._llm_messages(query, results),
                 temperature=0.1,
                 max_tokens=500
             )
             
-            answer = response.choices[0].message.content
-            
-            # Extract passages for display
-            passages = []
-            for chunk, score in results:
-                passages.append({
-                    'text': chunk['text'][:200] + "..." if len(chunk['text']) > 200 else chunk['text'],
-                    'score': score,
-                    'source': chunk['title'],
-                    'url': chunk['url']
-                })
-            
             return {
-                'answer': answer,
-                'sources': list(sources),
-                'passages': passages
+                'answer': response.choices[0].message.content,
+                'sources': list({(chunk['title'], chunk['url']) for chunk, _ in results}),
+                'passages': self._passages(results),
+                'model': self.model
             }
             
         except Exception as e:
             print(f"Error generating LLM answer: {e}")
-            return self.generate_extractive_answer(query, results)
+            return None
     
-    def ask(self, query: str, use_llm: bool = None, top_k: int = None) -> Dict:
-        """Main query interface"""
-        # Determine if we should use LLM
+    def stream_llm_answer(self, query: str, results: List[Tuple[Dict, float]]) -> Iterator[str]:
+        """Yield answer text from the LLM as it is generated"""
+        stream = self.openai_client.chat.completions.create(
+            model=self.model,
+            messages=self._llm_messages(query, results),
+            temperature=0.1,
+            max_tokens=500,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def ask_stream(self, query: str, use_llm: bool = None, top_k: int = None) -> Iterator[Dict]:
+        """Answer a question as a stream of events.
+        
+        Yields {'type': 'retrieval', 'sources', 'passages'} as soon as search
+        finishes, then {'type': 'token', 'text'} events as the answer is
+        generated, then {'type': 'done', 'response'} with the same response
+        dict ask() returns. Without an LLM the extractive answer is sent as a
+        single token event.
+        """
+        results = self.retrieve(query, top_k)
+        yield {
+            'type': 'retrieval',
+            'sources': list({(chunk['title'], chunk['url']) for chunk, _ in results}),
+            'passages': self._passages(results)
+        }
+        
         if use_llm is None:
             use_llm = self.openai_client is not None
         
+        response = None
+        if use_llm and self.openai_client and results:
+            query_embedding = self._query_embedding(normalize_query(query))
+            chunks = chunk_keys(results)
+            cached = self.answer_cache.get(query_embedding, chunks)
+            if cached is not None:
+                response = dict(cached, cached=True)
+                yield {'type': 'token', 'text': response['answer']}
+        
+        if response is None and use_llm and self.openai_client and results:
+            parts = []
+            complete = False
+            try:
+                for text in self.stream_llm_answer(query, results):
+                    parts.append(text)
+                    yield {'type': 'token', 'text': text}
+                complete = True
+            except Exception as e:
+                print(f"Error streaming LLM answer: {e}")
+            if parts:
+                response = {
+                    'answer': "".join(parts),
+                    'sources': list({(chunk['title'], chunk['url']) for chunk, _ in results}),
+                    'passages': self._passages(results),
+                    'model': self.model
+                }
+                if complete:  # Never reuse a truncated answer
+                    self.answer_cache.put(query_embedding, chunks, response)
+                response = dict(response)
+        
+        if response is None:
+            # No LLM, or it failed before producing anything
+            response = self.generate_extractive_answer(query, results)
+            yield {'type': 'token', 'text': response['answer']}
+        
+        response['insights'] = self.generate_insights(results)
+        yield {'type': 'done', 'response': response}
+    
+    def ask(self, query: str, use_llm: bool = None, top_k: int = None) -> Dict:
+        """Main query interface"""
         # Retrieve relevant chunks
         results = self.retrieve(query, top_k)
         
-        # Generate answer
-        if use_llm:
+        return self.answer(query, results, use_llm)
+    
+    def answer(self, query: str, results: List[Tuple[Dict, float]], use_llm: bool = None,
+               query_embedding: np.ndarray = None) -> Dict:
+        """Generate an answer with insights from retrieved chunks.
+        
+        A query_embedding already computed for the query saves encoding it again for the answer cache.
+        """
+        # Determine if we should use LLM
+        if use_llm is None:
+            use_llm = self.openai_client is not None
+        
+        # Generate answer, reusing one generated for a paraphrase of this question
+        if use_llm and self.openai_client and results:
+            self._check_version()
+            if query_embedding is None:
+                query_embedding = self._query_embedding(normalize_query(query))
+            chunks = chunk_keys(results)
+            response = self.answer_cache.get(query_embedding, chunks)
+            if response is not None:
+                response = dict(response, cached=True)
+            else:
+                response = self._llm_answer(query, results)
+                if response is not None:
+                    self.answer_cache.put(query_embedding, chunks, response)
+                    response = dict(response)
+                else:  # Only LLM answers are cached, never the extractive fallback
+                    response = self.generate_extractive_answer(query, results)
+        elif use_llm:
             response = self.generate_llm_answer(query, results)
         else:
             response = self.generate_extractive_answer(query, results)
@@ -148,6 +287,26 @@ Answer:"""
         
         return response
     
+    def ask_batch(self, queries: Iterable[str], use_llm: bool = None, top_k: int = None,
+                  use_mmr: bool = True, batch_size: int = None) -> Iterator[Dict]:
+        """Answer many questions, yielding responses in input order.
+        
+        Each batch is embedded in a single model call and searched with a
+        single multi-query FAISS search; MMR and answering then run per query,
+        reusing the batch's vectors for the answer cache.
+        """
+        batch_size = batch_size or config.ask_batch_size
+        
+        for batch in batched(queries, batch_size):
+            normalized = [normalize_query(query) for query in batch]
+            query_embeddings = self.index.encode_queries(normalized)
+            batch_results = self.index.search_batch(normalized, top_k, use_mmr, hybrid=self.hybrid,
+                                                    query_embeddings=query_embeddings)
+            for query, results, query_embedding in zip(batch, batch_results, query_embeddings):
+                response = self.answer(query, results, use_llm, query_embedding=query_embedding)
+                response['question'] = query
+                yield response
+    
     def generate_insights(self, results: List[Tuple[Dict, float]]) -> Dict:
         """Generate insights from retrieved results"""
         if not results:
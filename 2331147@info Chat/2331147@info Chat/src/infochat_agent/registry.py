@@ -0,0 +1,145 @@
+"""Process-wide registry of loaded embedding models, indexes and pipelines.
+
+Loading a SentenceTransformer or an index takes seconds; everything here is
+loaded once per process and shared, so answering a question only costs
+encode + search.
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Optional, Tuple
+from .embeddings import EmbeddingModel
+from .store import read_manifest, MANIFEST_FILE
+from .config import config
+
+_lock = threading.RLock()
+_models: Dict[Tuple[str, str], EmbeddingModel] = {}  # (model name, backend) -> model
+_cached_models: Dict[tuple, EmbeddingModel] = {}  # (model name, backend, cache path, pid) -> cached view
+_indexes: Dict[str, Tuple[tuple, object]] = {}
+_pipelines: Dict[Tuple[str, Optional[str], Optional[bool]], object] = {}
+_ready: Dict[Tuple[str, str], float] = {}  # (model name, backend) -> warmup seconds
+_warming = set()  # (model name, backend)
+
+def get_embedding_model(model_name: str = None, cache_path: str = None, backend: str = None) -> EmbeddingModel:
+    """Shared embedding model; a cache_path gets a cached view over the same loaded weights"""
+    model_name = model_name or config.embedding_model
+    backend = backend or config.embedding_backend
+    with _lock:
+        if (model_name, backend) not in _models:
+            _models[model_name, backend] = EmbeddingModel(model_name, backend=backend)
+        model = _models[model_name, backend]
+        if not cache_path:
+            return model
+        
+        # One view, and one SQLite connection, per cache file and process (connections must not be
+        # used across fork, e.g. in sharded build workers); rebuilt if the model was re-registered
+        key = (model_name, backend, os.path.abspath(cache_path), os.getpid())
+        view = _cached_models.get(key)
+        if view is None or view.model is not model.model:
+            view = EmbeddingModel(model_name, cache_path=cache_path, model=model.model, backend=backend)
+            _cached_models[key] = view
+        return view
+
+def register_embedding_model(model) -> None:
+    """Share an already-constructed model (anything with encode/encode_single) under its name"""
+    with _lock:
+        _models[model.model_name, getattr(model, 'backend', config.embedding_backend)] = model
+
+def warmup(model_name: str = None, backend: str = None) -> float:
+    """Load a model and run a dummy encode so the first real query is not slow"""
+    model_name = model_name or config.embedding_model
+    backend = backend or config.embedding_backend
+    start = time.perf_counter()
+    get_embedding_model(model_name, backend=backend).encode_single("warmup")
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _ready[model_name, backend] = elapsed
+    return elapsed
+
+def start_warmup(model_name: str = None, backend: str = None) -> Optional[threading.Thread]:
+    """Warm up in a background thread so UIs can render while the model loads"""
+    key = (model_name or config.embedding_model, backend or config.embedding_backend)
+    with _lock:
+        if key in _warming:
+            return None
+        _warming.add(key)
+    thread = threading.Thread(target=warmup, args=key, daemon=True)
+    thread.start()
+    return thread
+
+def is_ready(model_name: str = None, backend: str = None) -> bool:
+    return (model_name or config.embedding_model, backend or config.embedding_backend) in _ready
+
+def _index_signature(index_dir: str) -> tuple:
+    """Changes whenever the index directory is rewritten"""
+    signature = []
+    for name in (MANIFEST_FILE, "index.faiss"):
+        path = os.path.join(index_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def get_index(index_dir: str):
+    """Loaded VectorIndex for a directory, reloaded only when its files change"""
+    from .index import VectorIndex
+    
+    key = os.path.abspath(index_dir)
+    signature = _index_signature(key)
+    with _lock:
+        cached = _indexes.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+        
+        # Query with the model the index was built with
+        manifest = read_manifest(key) or {}
+        model_name = manifest.get('embeddings', {}).get('model_name')
+        index = VectorIndex(get_embedding_model(model_name))
+        index.load(key)
+        _indexes[key] = (signature, index)
+        return index
+
+def get_pipeline(index_dir: str, model: str = None, hybrid: bool = None):
+    """Shared RAGPipeline for an index directory, rebuilt when the index is reloaded"""
+    from .rag import RAGPipeline
+    
+    index = get_index(index_dir)
+    key = (os.path.abspath(index_dir), model, hybrid)
+    with _lock:
+        pipeline = _pipelines.get(key)
+        if pipeline is None or pipeline.index is not index:
+            pipeline = RAGPipeline(index=index, model=model, hybrid=hybrid)
+            _pipelines[key] = pipeline
+        return pipeline
+
+def forget(index_dir: str) -> None:
+    """Drop a directory's loaded index and pipelines, e.g. once a newer build replaces it"""
+    key = os.path.abspath(index_dir)
+    with _lock:
+        _indexes.pop(key, None)
+        for pipeline_key in [pipeline_key for pipeline_key in _pipelines if pipeline_key[0] == key]:
+            del _pipelines[pipeline_key]
+
+def status() -> Dict:
+    """What is loaded and whether each (model name, backend) has been warmed up"""
+    with _lock:
+        return {
+            'models': {(name, backend): {'ready': (name, backend) in _ready,
+                                         'warmup_seconds': _ready.get((name, backend))}
+                       for name, backend in _models},
+            'indexes': {path: index.live_count for path, (_, index) in _indexes.items()},
+        }
+
+def clear() -> None:
+    """Drop everything (mainly for tests)"""
+    with _lock:
+        _models.clear()
+        for (*_, pid), view in _cached_models.items():
+            if pid == os.getpid():
+                view.cache.close()
+        _cached_models.clear()
+        _indexes.clear()
+        _pipelines.clear()
+        _ready.clear()
+        _warming.clear()
@@ -1,41 +1,178 @@
 """Web scraping functionality with readability and BeautifulSoup"""
 
+import os
 import requests
 import json
-from typing import List, Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Optional, Iterator, Tuple
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 from readability import Document
+import lxml.html
+from requests.adapters import HTTPAdapter
 import time
 from tqdm import tqdm
-import requests_cache
 from .config import config
 
-# Enable caching for requests
-requests_cache.install_cache('scrape_cache', expire_after=3600)
+def enable_request_cache(path: str = None, expire_after: int = None) -> None:
+    """Cache HTTP responses in SQLite for every requests session created afterwards.
+    
+    Call before constructing a WebScraper; nothing is cached otherwise.
+    """
+    import requests_cache
+    
+    requests_cache.install_cache(path or config.request_cache_path,
+                                 expire_after=expire_after if expire_after is not None else config.request_cache_ttl)
+
+def extract_html_text(html: str) -> Tuple[str, str]:
+    """Extract (title, main text) from HTML with readability and an lxml text pass"""
+    doc = Document(html)
+    summary = doc.summary()
+    
+    # Same output as BeautifulSoup.get_text(separator=' ', strip=True), without a second slow parse
+    tree = lxml.html.fromstring(summary)
+    strings = tree.xpath('.//text()[not(ancestor::script) and not(ancestor::style)]')
+    text = ' '.join(s.strip() for s in strings if s.strip())
+    
+    return doc.title(), text
+
+def _extract_html_file(filepath: str) -> Optional[Dict]:
+    """Process-pool worker: read and extract one HTML file"""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+        
+        title, text = extract_html_text(content)
+        return {
+            'url': f'file://{filepath}',
+            'title': title or os.path.basename(filepath),
+            'content': text,
+            'length': len(text)
+        }
+    except Exception as e:
+        print(f"Error processing {filepath}: {e}")
+        return None
+
+def find_html_files(html_dir: str, recursive: bool = False) -> List[str]:
+    """HTML file paths under html_dir in a stable, sorted order"""
+    if not recursive:
+        return sorted(os.path.join(html_dir, name) for name in os.listdir(html_dir)
+                      if name.endswith('.html'))
+    
+    paths = []
+    for root, dirs, files in os.walk(html_dir):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.endswith('.html'))
+    return paths
+
+class FileState:
+    """mtime/size snapshot of files seen by a previous run, stored as JSON"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.seen = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.seen = json.load(f)
+    
+    @staticmethod
+    def signature(filepath: str) -> List[int]:
+        stat = os.stat(filepath)
+        return [stat.st_mtime_ns, stat.st_size]
+    
+    def changed(self, filepath: str) -> bool:
+        return self.seen.get(filepath) != self.signature(filepath)
+    
+    def mark(self, filepath: str) -> None:
+        self.seen[filepath] = self.signature(filepath)
+    
+    def forget_missing(self) -> List[str]:
+        """Drop entries for files that no longer exist, returning their paths"""
+        missing = [filepath for filepath in self.seen if not os.path.exists(filepath)]
+        for filepath in missing:
+            del self.seen[filepath]
+        return missing
+    
+    def save(self) -> None:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.seen, f)
+        os.replace(tmp_path, self.path)
+
+class RateLimiter:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts of up to ``capacity``"""
+    
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self) -> None:
+        """Block until a token is available, then take it"""
+        if not self.rate:
+            return
+        
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
 class WebScraper:
-    def __init__(self, timeout: int = None):
+    def __init__(self, timeout: int = None, concurrency: int = None,
+                 per_host_concurrency: int = None, requests_per_second: float = None):
         self.timeout = timeout or config.request_timeout
+        self.concurrency = concurrency or config.scrape_concurrency
+        self.per_host_concurrency = per_host_concurrency or config.per_host_concurrency
+        self.requests_per_second = (config.per_host_requests_per_second
+                                    if requests_per_second is None else requests_per_second)
+        
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
+        
+        # Size the connection pool so concurrent fetches never wait for a socket
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        self._host_lock = threading.Lock()
+        self._host_slots = {}
+        self._host_limiters = {}
+    
+    def _fetch(self, url: str) -> requests.Response:
+        """GET a URL within its host's concurrency and rate limits"""
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+                self._host_limiters[host] = RateLimiter(self.requests_per_second, self.per_host_concurrency)
+            slots, limiter = self._host_slots[host], self._host_limiters[host]
+        
+        limiter.acquire()
+        with slots:
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response
     
     def scrape_url(self, url: str) -> Optional[Dict]:
         """Scrape a single URL and extract clean content"""
         try:
-            response = self.session.get(url, timeout=self.timeout)
-            response.raise_for_status()
+            response = self._fetch(url)
             
             # Use readability to extract main content
-            doc = Document(response.text)
-            title = doc.title()
-            content = doc.summary()
-            
-            # Clean with BeautifulSoup
-            soup = BeautifulSoup(content, 'html.parser')
-            text = soup.get_text(separator=' ', strip=True)
+            title, text = extract_html_text(response.text)
             
             return {
                 'url': url,
@@ -50,8 +187,7 @@ class WebScraper:
     def get_stackoverflow_links(self, tag_url: str, limit: int = 10) -> List[str]:
         """Extract question links from StackOverflow tag page"""
         try:
-            response = self.session.get(tag_url, timeout=self.timeout)
-            response.raise_for_status()
+            response = self._fetch(tag_url)
             
             soup = BeautifulSoup(response.text, 'html.parser')
             links = []
@@ -71,68 +207,132 @@ class WebScraper:
             return []
     
     def scrape_multiple(self, urls: List[str], follow_links: bool = False, 
-                       link_limit: int = 10) -> List[Dict]:
-        """Scrape multiple URLs with optional link following"""
-        results = []
-        
-        for url in tqdm(urls, desc="Scraping URLs"):
-            # Scrape main URL
-            result = self.scrape_url(url)
-            if result:
-                results.append(result)
+                       link_limit: int = 10, concurrency: int = None) -> List[Dict]:
+        """Scrape multiple URLs with optional link following.
+        
+        Pages are fetched concurrently, limited per host, and returned in the
+        same order as a sequential crawl: each URL followed by its links.
+        """
+        concurrency = concurrency or self.concurrency
+        
+        def is_tag_page(url):
+            return follow_links and 'stackoverflow.com/questions/tagged/' in url
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor, \
+                tqdm(total=len(urls), desc="Scraping URLs") as progress:
+            def submit(fn, *args):
+                future = executor.submit(fn, *args)
+                future.add_done_callback(lambda _: progress.update())
+                return future
+            
+            pages = [submit(self.scrape_url, url) for url in urls]
+            link_lists = {i: submit(self.get_stackoverflow_links, url, link_limit)
+                          for i, url in enumerate(urls) if is_tag_page(url)}
+            progress.total += len(link_lists)
             
-            # Follow links if enabled and it's a StackOverflow tag page
-            if follow_links and 'stackoverflow.com/questions/tagged/' in url:
-                links = self.get_stackoverflow_links(url, link_limit)
-                for link in tqdm(links, desc=f"Following links from {url}", leave=False):
-                    link_result = self.scrape_url(link)
-                    if link_result:
-                        results.append(link_result)
-                    time.sleep(0.5)  # Rate limiting
+            # Follow links as soon as each tag page's list arrives
+            followed = {}
+            for i, link_list in link_lists.items():
+                links = link_list.result()
+                progress.total += len(links)
+                followed[i] = [submit(self.scrape_url, link) for link in links]
+            
+            results = []
+            for i, page in enumerate(pages):
+                for future in [page] + followed.get(i, []):
+                    result = future.result()
+                    if result:
+                        results.append(result)
         
         return results
     
-    def scrape_html_files(self, html_dir: str) -> List[Dict]:
+    def iter_html_files(self, html_dir: str, recursive: bool = False, workers: int = None,
+                        state: FileState = None) -> Iterator[Dict]:
+        """Extract local HTML files in parallel, yielding documents in path order.
+        
+        Parsing is spread over a process pool. With a ``state``, files whose
+        mtime and size match it are skipped and extracted files are marked in
+        it; saving it is up to the caller.
+        """
+        workers = workers or config.extract_workers or os.cpu_count() or 1
+        
+        paths = find_html_files(html_dir, recursive)
+        if state:
+            paths = [path for path in paths if state.changed(path)]
+        
+        if workers == 1 or len(paths) < 2:
+            results = map(_extract_html_file, paths)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(_extract_html_file, paths, chunksize=max(1, min(64, len(paths) // (workers * 4))))
+        
+        try:
+            for path, result in zip(paths, tqdm(results, total=len(paths), desc="Extracting HTML")):
+                if result:
+                    if state:
+                        state.mark(path)
+                    yield result
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+    
+    def scrape_html_files(self, html_dir: str, recursive: bool = False, workers: int = None,
+                          state: FileState = None) -> List[Dict]:
         """Scrape local HTML files"""
-        import os
-        results = []
-        
-        for filename in os.listdir(html_dir):
-            if filename.endswith('.html'):
-                filepath = os.path.join(html_dir, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    doc = Document(content)
-                    title = doc.title() or filename
-                    clean_content = doc.summary()
-                    
-                    soup = BeautifulSoup(clean_content, 'html.parser')
-                    text = soup.get_text(separator=' ', strip=True)
-                    
-                    results.append({
-                        'url': f'file://{filepath}',
-                        'title': title,
-                        'content': text,
-                        'length': len(text)
-                    })
-                except Exception as e:
-                    print(f"Error processing {filepath}: {e}")
+        return list(self.iter_html_files(html_dir, recursive, workers, state))
+    
+    def update_html_docstore(self, html_dir: str, output: str, recursive: bool = False,
+                             workers: int = None) -> Dict[str, int]:
+        """Re-extract only the HTML files changed since the last run and rewrite the docstore.
         
-        return results
+        Documents of deleted files are dropped. The mtime/size snapshot lives in
+        ``<output>.files.json``; it is ignored when the docstore is missing and
+        saved only after the docstore is written, so no file is skipped
+        without its document being stored.
+        """
+        state = FileState(output + ".files.json")
+        existing = load_docstore(output) if os.path.exists(output) else []
+        if not os.path.exists(output):
+            state.seen = {}
+        
+        changed = self.scrape_html_files(html_dir, recursive, workers, state)
+        state.forget_missing()
+        merged = {doc['url']: doc for doc in existing
+                  if not doc['url'].startswith('file://') or os.path.exists(doc['url'][len('file://'):])}
+        removed = len(existing) - len(merged)
+        merged.update((doc['url'], doc) for doc in changed)
+        
+        save_docstore(list(merged.values()), output)
+        state.save()
+        return {'changed': len(changed), 'removed': removed, 'documents': len(merged)}
 
 def save_docstore(documents: List[Dict], output_path: str):
     """Save documents to JSONL format"""
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, 'w', encoding='utf-8') as f:
         for doc in documents:
             f.write(json.dumps(doc, ensure_ascii=False) + '\n')
 
-def load_docstore(docstore_path: str) -> List[Dict]:
-    """Load documents from JSONL format"""
-    documents = []
+def iter_docstore(docstore_path: str, start: int = 0, stop: int = None) -> Iterator[Dict]:
+    """Stream documents from JSONL format one line at a time, optionally only documents [start, stop)"""
     with open(docstore_path, 'r', encoding='utf-8') as f:
+        position = 0
         for line in f:
-            documents.append(json.loads(line.strip()))
-    return documents
\ No newline at end of file
+            if not line.strip():
+                continue
+            if stop is not None and position >= stop:
+                return
+            if position >= start:
+                yield json.loads(line)
+            position += 1
+
+def count_docstore(docstore_path: str) -> int:
+    """Number of documents in a docstore, without parsing them"""
+    with open(docstore_path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+def load_docstore(docstore_path: str) -> List[Dict]:
+    """Load documents from JSONL format"""
+    return list(iter_docstore(docstore_path))
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""BM25 sparse index for exact-token retrieval alongside the dense index"""
+
+import os
+import re
+import json
+import numpy as np
+from typing import TYPE_CHECKING, Dict, Iterable, List, Sequence, Tuple
+from .config import config
+
+if TYPE_CHECKING:
+    import scipy.sparse as sp  # Imported when an index is built or loaded
+
+BM25_FILE = "bm25.npz"
+BM25_VOCAB_FILE = "bm25_vocab.json"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-/][a-z0-9]+)*")
+SEPARATORS = re.compile(r"[._\-/]")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; compound tokens such as part numbers or error
+    codes ("err-1234", "v2.1") are kept whole and also split into their parts"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    parts = [part for token in tokens if SEPARATORS.search(token) for part in SEPARATORS.split(token)]
+    return tokens + parts
+
+class BM25Index:
+    """Okapi BM25 over chunk rows, stored as a term-by-row CSR matrix of precomputed weights.
+    
+    Each term's postings are kept in descending weight (impact) order. A query
+    sums at most ``max_postings`` of the highest-impact postings per term, so
+    its cost is bounded regardless of corpus size: scores are exact for terms
+    rarer than that, and very common terms (which carry little weight anyway)
+    only contribute to their best-matching rows.
+    """
+    
+    def __init__(self, weights: 'sp.csr_matrix', vocab: Dict[str, int], k1: float, b: float):
+        self.weights = weights
+        self.vocab = vocab
+        self.k1 = k1
+        self.b = b
+    
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = None, b: float = None) -> 'BM25Index':
+        import scipy.sparse as sp
+        
+        k1 = config.bm25_k1 if k1 is None else k1
+        b = config.bm25_b if b is None else b
+        
+        vocab = {}
+        term_ids, row_ids = [], []
+        num_rows = 0
+        for row, text in enumerate(texts):
+            ids = [vocab.setdefault(token, len(vocab)) for token in tokenize(text)]
+            term_ids.extend(ids)
+            row_ids.extend([row] * len(ids))
+            num_rows = row + 1
+        
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        
+        # Term frequencies; duplicate (term, row) pairs are summed
+        tf = sp.csr_matrix((np.ones(len(term_ids), dtype=np.float32), (term_ids, row_ids)),
+                           shape=(len(vocab), num_rows))
+        tf.sum_duplicates()
+        
+        row_lengths = np.bincount(row_ids, minlength=num_rows).astype(np.float32)
+        avg_length = row_lengths.mean() if num_rows else 0.0
+        doc_freq = np.diff(tf.indptr).astype(np.float32)
+        idf = np.log1p((num_rows - doc_freq + 0.5) / (doc_freq + 0.5))
+        
+        # Fold idf and length normalisation into the stored weights
+        term_of_entry = np.repeat(np.arange(len(vocab)), np.diff(tf.indptr))
+        norm = k1 * (1 - b + b * row_lengths[tf.indices] / max(avg_length, 1e-9))
+        weights = (idf[term_of_entry] * tf.data * (k1 + 1) / (tf.data + norm)).astype(np.float32)
+        
+        # Impact order within each term, so the best postings are a prefix
+        order = np.lexsort((-weights, term_of_entry))
+        tf.data = weights[order]
+        tf.indices = tf.indices[order]
+        tf.has_sorted_indices = False
+        return cls(tf, vocab, k1, b)
+    
+    @property
+    def num_rows(self) -> int:
+        return self.weights.shape[1]
+    
+    def search(self, query: str, top_k: int, max_postings: int = None) -> List[Tuple[int, float]]:
+        """Top rows by BM25 score as (row, score) pairs"""
+        max_postings = max_postings or config.bm25_max_postings
+        term_ids = sorted({self.vocab[token] for token in tokenize(query) if token in self.vocab})
+        if not term_ids or top_k <= 0:
+            return []
+        
+        indptr = self.weights.indptr
+        spans = [(indptr[t], min(indptr[t + 1], indptr[t] + max_postings)) for t in term_ids]
+        rows = np.concatenate([self.weights.indices[start:end] for start, end in spans])
+        weights = np.concatenate([self.weights.data[start:end] for start, end in spans])
+        
+        if len(term_ids) == 1:
+            candidates, scores = rows, weights
+        else:
+            candidates, inverse = np.unique(rows, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+        
+        if len(candidates) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+    
+    def save(self, index_dir: str) -> Dict:
+        """Write the weight matrix and vocabulary, returning the manifest header"""
+        import scipy.sparse as sp
+        
+        sp.save_npz(os.path.join(index_dir, BM25_FILE), self.weights, compressed=False)
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        with open(os.path.join(index_dir, BM25_VOCAB_FILE), 'w', encoding='utf-8') as f:
+            json.dump(terms, f, ensure_ascii=False)
+        return {
+            'file': BM25_FILE,
+            'vocab': BM25_VOCAB_FILE,
+            'count': self.num_rows,
+            'k1': self.k1,
+            'b': self.b,
+        }
+    
+    @classmethod
+    def load(cls, index_dir: str, header: Dict) -> 'BM25Index':
+        import scipy.sparse as sp
+        
+        weights = sp.load_npz(os.path.join(index_dir, header['file'])).tocsr()
+        with open(os.path.join(index_dir, header['vocab']), 'r', encoding='utf-8') as f:
+            vocab = {term: term_id for term_id, term in enumerate(json.load(f))}
+        return cls(weights, vocab, header['k1'], header['b'])
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = None) -> List[Tuple[int, float]]:
+    """Fuse ranked row lists: each row scores sum(1 / (k + rank)) over the lists it appears in"""
+    k = config.rrf_k if k is None else k
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
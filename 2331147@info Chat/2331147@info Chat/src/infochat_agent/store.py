@@ -0,0 +1,368 @@
+"""On-disk formats for index directories"""
+
+import os
+import json
+import mmap
+import shutil
+import tempfile
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Iterable, Iterator
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.f32"
+IDS_FILE = "ids.i64"
+
+def read_manifest(index_dir: str) -> Optional[Dict]:
+    """Read the index manifest, or None for directories written before it existed"""
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    
+    if manifest.get('format_version', 0) > FORMAT_VERSION:
+        raise ValueError(f"Index format version {manifest['format_version']} is newer than "
+                         f"supported version {FORMAT_VERSION}")
+    return manifest
+
+def write_manifest(index_dir: str, manifest: Dict) -> None:
+    """Atomically write the index manifest"""
+    manifest = {'format_version': FORMAT_VERSION, **manifest}
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+@contextmanager
+def staged_index_dir(index_dir: str) -> Iterator[str]:
+    """A fresh sibling directory to build a whole index in.
+    
+    It replaces index_dir only when the block completes, so a failed build
+    leaves the existing index untouched; otherwise it is deleted.
+    """
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=os.path.basename(os.path.abspath(index_dir)) + '.', suffix='.tmp',
+                                   dir=parent)
+    os.chmod(staging_dir, 0o755)
+    try:
+        yield staging_dir
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    
+    if os.path.exists(index_dir):
+        old_dir = staging_dir + '.old'
+        os.replace(index_dir, old_dir)
+        os.replace(staging_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(staging_dir, index_dir)
+
+def replace_staged(index_dir: str, names: Iterable[str]) -> None:
+    """Move each name's ".tmp" file over it"""
+    for name in names:
+        os.replace(os.path.join(index_dir, name + ".tmp"), os.path.join(index_dir, name))
+
+def write_embeddings(index_dir: str, embeddings: np.ndarray, model_name: str, replace: bool = True) -> Dict:
+    """Write normalized embeddings as a raw row-major float32 matrix.
+    
+    Returns the header describing the file, to be stored in the manifest.
+    With replace=False the matrix is left in its ".tmp" file for
+    replace_staged, e.g. while the old file is still memory-mapped.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    embeddings.tofile(os.path.join(index_dir, EMBEDDINGS_FILE + ".tmp"))
+    if replace:
+        replace_staged(index_dir, [EMBEDDINGS_FILE])
+    
+    return {
+        'file': EMBEDDINGS_FILE,
+        'model_name': model_name,
+        'dimension': int(embeddings.shape[1]),
+        'count': int(embeddings.shape[0]),
+        'dtype': 'float32',
+    }
+
+class EmbeddingWriter:
+    """Append normalized embedding batches to the on-disk matrix without holding it in memory"""
+    
+    def __init__(self, index_dir: str, model_name: str):
+        self.model_name = model_name
+        self.path = os.path.join(index_dir, EMBEDDINGS_FILE)
+        self.tmp_path = self.path + ".tmp"
+        self.file = open(self.tmp_path, 'wb')
+        self.count = 0
+        self.dimension = 0
+    
+    def append(self, embeddings: np.ndarray) -> None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.dimension and embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Expected dimension {self.dimension}, got {embeddings.shape[1]}")
+        self.dimension = embeddings.shape[1]
+        self.file.write(embeddings.tobytes())
+        self.count += len(embeddings)
+    
+    def close(self) -> Dict:
+        """Finish the file and return its manifest header"""
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return {
+            'file': EMBEDDINGS_FILE,
+            'model_name': self.model_name,
+            'dimension': self.dimension,
+            'count': self.count,
+            'dtype': 'float32',
+        }
+
+def open_embeddings(index_dir: str, header: Dict) -> np.ndarray:
+    """Memory-map the embedding matrix read-only.
+    
+    Pages are loaded on first access and, being a read-only file mapping,
+    are shared through the page cache by every process that opens the index.
+    """
+    embeddings_path = os.path.join(index_dir, header['file'])
+    shape = (header['count'], header['dimension'])
+    
+    expected_size = shape[0] * shape[1] * np.dtype(header['dtype']).itemsize
+    if os.path.getsize(embeddings_path) != expected_size:
+        raise ValueError(f"{embeddings_path} does not match its header {shape}")
+    
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=header['dtype'])
+    return np.memmap(embeddings_path, dtype=header['dtype'], mode='r', shape=shape)
+
+def write_ids(index_dir: str, ids: np.ndarray) -> Dict:
+    """Write stable chunk IDs as a raw int64 array, row-aligned with the embeddings"""
+    ids_path = os.path.join(index_dir, IDS_FILE)
+    tmp_path = ids_path + ".tmp"
+    np.ascontiguousarray(ids, dtype=np.int64).tofile(tmp_path)
+    os.replace(tmp_path, ids_path)
+    return {'file': IDS_FILE, 'count': int(len(ids))}
+
+def read_ids(index_dir: str, header: Dict) -> np.ndarray:
+    """Read stable chunk IDs"""
+    ids = np.fromfile(os.path.join(index_dir, header['file']), dtype=np.int64)
+    if len(ids) != header['count']:
+        raise ValueError(f"{header['file']} does not match its header count {header['count']}")
+    return ids
+
+# Compact chunk metadata: a document table plus fixed-width per-chunk records
+# pointing into a UTF-8 text blob. Chunk texts are only decoded for rows that
+# are actually read, e.g. the top-k hits of a search.
+DOCUMENTS_FILE = "documents.jsonl"
+CHUNKS_FILE = "chunks.bin"
+TEXT_FILE = "chunks.txt"
+LEGACY_METADATA_FILE = "metadata.jsonl"
+METADATA_FILES = (DOCUMENTS_FILE, CHUNKS_FILE, TEXT_FILE)
+
+CHUNK_FIELDS = ('chunk_id', 'start_word', 'end_word')  # Per-chunk integers; everything else is per-document
+CHUNK_DTYPE = np.dtype([
+    ('doc', '<i4'),
+    ('chunk_id', '<i4'),
+    ('start_word', '<i4'),
+    ('end_word', '<i4'),
+    ('text_offset', '<i8'),
+    ('text_length', '<i4'),
+])
+MISSING = -1  # Marks an absent per-chunk field
+
+def _split_chunk(chunk: Dict):
+    """Separate a chunk dict into (text, per-chunk ints, document fields)"""
+    fields = tuple(chunk.get(name, MISSING) for name in CHUNK_FIELDS)
+    document = {key: value for key, value in chunk.items() if key != 'text' and key not in CHUNK_FIELDS}
+    return chunk['text'], fields, document
+
+class ChunkMetadataWriter:
+    """Append chunks to the compact metadata files without holding them in memory"""
+    
+    FLUSH_EVERY = 4096
+    
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.documents_file = open(os.path.join(index_dir, DOCUMENTS_FILE + ".tmp"), 'w', encoding='utf-8')
+        self.chunks_file = open(os.path.join(index_dir, CHUNKS_FILE + ".tmp"), 'wb')
+        self.text_file = open(os.path.join(index_dir, TEXT_FILE + ".tmp"), 'wb')
+        self.count = 0
+        self.num_documents = 0
+        self.text_offset = 0
+        self.last_document = None
+        self.pending = []
+    
+    def append(self, chunk: Dict) -> None:
+        text, fields, document = _split_chunk(chunk)
+        
+        # Consecutive chunks of the same document share one document row
+        if document != self.last_document:
+            self.documents_file.write(json.dumps(document, ensure_ascii=False) + '\n')
+            self.last_document = document
+            self.num_documents += 1
+        
+        encoded = text.encode('utf-8')
+        self.text_file.write(encoded)
+        self.pending.append((self.num_documents - 1, *fields, self.text_offset, len(encoded)))
+        self.text_offset += len(encoded)
+        self.count += 1
+        
+        if len(self.pending) >= self.FLUSH_EVERY:
+            self._flush()
+    
+    def extend(self, chunks: Iterable[Dict]) -> None:
+        for chunk in chunks:
+            self.append(chunk)
+    
+    def _flush(self) -> None:
+        if self.pending:
+            self.chunks_file.write(np.array(self.pending, dtype=CHUNK_DTYPE).tobytes())
+            self.pending = []
+    
+    def close(self, replace: bool = True) -> Dict:
+        """Finish the files and return their manifest header.
+        
+        With replace=False the files are left as ".tmp" files for replace_staged.
+        """
+        self._flush()
+        for f in (self.documents_file, self.chunks_file, self.text_file):
+            f.close()
+        if replace:
+            replace_staged(self.index_dir, METADATA_FILES)
+        
+        return {
+            'format': 'compact',
+            'count': self.count,
+            'documents': self.num_documents,
+        }
+
+class ChunkMetadata:
+    """List-like chunk metadata backed by the compact on-disk format.
+    
+    Loaded rows live in memory-mapped files and are materialized into dicts
+    only when indexed. Chunks added afterwards are kept as plain dicts until
+    the next save.
+    """
+    
+    def __init__(self, chunks: List[Dict] = None):
+        self.documents = []
+        self.records = np.zeros(0, dtype=CHUNK_DTYPE)
+        self.text = b''
+        self.tail = list(chunks or [])
+    
+    @classmethod
+    def load(cls, index_dir: str, header: Dict) -> 'ChunkMetadata':
+        metadata = cls()
+        with open(os.path.join(index_dir, DOCUMENTS_FILE), 'r', encoding='utf-8') as f:
+            metadata.documents = [json.loads(line) for line in f]
+        
+        if header['count']:
+            metadata.records = np.memmap(os.path.join(index_dir, CHUNKS_FILE), dtype=CHUNK_DTYPE,
+                                         mode='r', shape=(header['count'],))
+        
+        text_path = os.path.join(index_dir, TEXT_FILE)
+        if os.path.getsize(text_path):
+            with open(text_path, 'rb') as f:
+                metadata.text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if len(metadata.documents) != header['documents']:
+            raise ValueError(f"{DOCUMENTS_FILE} does not match its header count {header['documents']}")
+        return metadata
+    
+    @classmethod
+    def load_jsonl(cls, path: str) -> 'ChunkMetadata':
+        """Load the legacy one-dict-per-line metadata format"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+    
+    def __len__(self) -> int:
+        return len(self.records) + len(self.tail)
+    
+    def __getitem__(self, row: int) -> Dict:
+        if row < 0:
+            row += len(self)
+        if row >= len(self.records):
+            return self.tail[row - len(self.records)]
+        
+        record = self.records[row]
+        offset = int(record['text_offset'])
+        chunk = {'text': bytes(self.text[offset:offset + int(record['text_length'])]).decode('utf-8')}
+        for name in CHUNK_FIELDS:
+            if record[name] != MISSING:
+                chunk[name] = int(record[name])
+        chunk.update(self.documents[record['doc']])
+        return chunk
+    
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(len(self)):
+            yield self[row]
+    
+    def append(self, chunk: Dict) -> None:
+        self.tail.append(chunk)
+    
+    def extend(self, chunks: Iterable[Dict]) -> None:
+        self.tail.extend(chunks)
+    
+    def url_rows(self) -> Dict[str, List[int]]:
+        """Rows grouped by URL, computed from the document table without decoding texts"""
+        url_rows = {}
+        doc_column = np.asarray(self.records['doc'])
+        order = np.argsort(doc_column, kind='stable')
+        for group in np.split(order, np.flatnonzero(np.diff(doc_column[order])) + 1):
+            if len(group):
+                url = self.documents[doc_column[group[0]]].get('url')
+                url_rows.setdefault(url, []).extend(group.tolist())
+        
+        for row, chunk in enumerate(self.tail, len(self.records)):
+            url_rows.setdefault(chunk.get('url'), []).append(row)
+        
+        return {url: sorted(rows) for url, rows in url_rows.items()}
+    
+    def max_doc_id(self) -> int:
+        """Largest doc_id present, or -1"""
+        doc_ids = [document['doc_id'] for document in self.documents if 'doc_id' in document]
+        doc_ids += [chunk['doc_id'] for chunk in self.tail if 'doc_id' in chunk]
+        return max(doc_ids, default=-1)
+    
+    def take(self, rows: np.ndarray) -> 'ChunkMetadata':
+        """Subset of rows (in ascending order), sharing the mapped document table and text"""
+        rows = np.asarray(rows)
+        subset = ChunkMetadata([self.tail[row - len(self.records)] for row in rows[rows >= len(self.records)]])
+        subset.documents = self.documents
+        subset.records = np.asarray(self.records[rows[rows < len(self.records)]])
+        subset.text = self.text
+        return subset
+    
+    def save(self, index_dir: str, replace: bool = True) -> Dict:
+        """Write all rows in the compact format, returning the manifest header"""
+        writer = ChunkMetadataWriter(index_dir)
+        writer.extend(self)
+        return writer.close(replace)
+    
+    def close(self) -> None:
+        """Unmap the loaded files, so they can be replaced or deleted, and drop all rows"""
+        if isinstance(self.text, mmap.mmap):
+            self.text.close()
+        self.documents = []
+        self.records = np.zeros(0, dtype=CHUNK_DTYPE)
+        self.text = b''
+        self.tail = []
+
+def migrate_metadata(index_dir: str) -> Dict:
+    """Convert an index directory's metadata.jsonl to the compact format in place"""
+    legacy_path = os.path.join(index_dir, LEGACY_METADATA_FILE)
+    if not os.path.exists(legacy_path):
+        raise ValueError(f"{index_dir} has no {LEGACY_METADATA_FILE} to migrate")
+    
+    writer = ChunkMetadataWriter(index_dir)
+    with open(legacy_path, 'r', encoding='utf-8') as f:
+        writer.extend(json.loads(line) for line in f if line.strip())
+    header = writer.close()
+    
+    manifest = read_manifest(index_dir) or {}
+    manifest.pop('format_version', None)
+    manifest['metadata'] = header
+    write_manifest(index_dir, manifest)
+    os.remove(legacy_path)
+    return header
@@ -4,13 +4,61 @@
 import os
 import sys
 import tempfile
+from types import SimpleNamespace
+
+import pytest
 
 # Add src to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from infochat_agent.scrape import WebScraper, save_docstore
+from infochat_agent.scrape import WebScraper, RateLimiter, save_docstore
 from infochat_agent.index import build_index_from_docstore
 from infochat_agent.rag import RAGPipeline
+from infochat_agent.processing import TextProcessor, truncation_report
+from infochat_agent.index import (VectorIndex, build_index_streaming, build_index_sharded, benchmark_index_types,
+                                  resolve_compression)
+from infochat_agent.embeddings import EmbeddingCache, EmbeddingModel
+from infochat_agent.cache import SemanticAnswerCache
+from infochat_agent.dedup import NearDuplicateFilter
+from infochat_agent.store import ChunkMetadata, migrate_metadata, read_manifest
+from infochat_agent import registry
+from infochat_agent.config import config
+
+import numpy as np
+
+class HashingEmbeddingModel:
+    """Deterministic bag-of-words embedder so index tests run without model downloads"""
+    model_name = "hashing-test"
+    dimension = 64
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def encode(self, texts):
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, sum(map(ord, word)) % self.dimension] += 1.0
+        return vectors
+    
+    def encode_single(self, text):
+        return self.encode([text])[0]
+
+class FailingEmbeddingModel(HashingEmbeddingModel):
+    """Embedder that crashes, for checking failed builds clean up after themselves"""
+    def encode(self, texts):
+        raise RuntimeError("model crashed")
+
+class WordPieceTokenizer:
+    """Counts one token per four characters of each word, plus [CLS]/[SEP]"""
+    def __call__(self, texts, add_special_tokens=True, **kwargs):
+        special = 2 if add_special_tokens else 0
+        return {'input_ids': [[0] * (sum(-(-len(word) // 4) for word in text.split()) + special)
+                              for text in texts]}
+
+def make_chunks(texts):
+    return [{'text': text, 'url': f'test://{i}', 'title': f'Doc {i}'} for i, text in enumerate(texts)]
 
 def test_basic_functionality():
     """Test basic scraping, indexing, and querying"""
@@ -75,5 +123,699 @@ def test_basic_functionality():
         except:
             pass
 
+def test_mmr_search_encodes_query_once():
+    """MMR reuses stored vectors instead of re-encoding candidates"""
+    model = HashingEmbeddingModel()
+    index = VectorIndex(model)
+    index.build_index(make_chunks([
+        "battery charging error", "battery charging error code",
+        "engine warning light", "brake sensor reset", "battery range nexon",
+    ]))
+    
+    model.calls = 0
+    results = index.mmr_search("battery charging", top_k=3, diversity=0.5)
+    
+    assert model.calls == 1
+    assert len(results) == 3
+    assert results[0][0]['text'].startswith("battery charging error")
+    assert len({chunk['url'] for chunk, _ in results}) == 3
+
+def test_save_load_maps_embeddings():
+    """Saved vectors are memory-mapped back instead of rebuilt"""
+    index = VectorIndex(HashingEmbeddingModel())
+    index.build_index(make_chunks(["battery charging error", "engine warning light", "brake sensor reset"]))
+    
+    with tempfile.TemporaryDirectory() as index_dir:
+        index.save(index_dir)
+        loaded = VectorIndex(HashingEmbeddingModel())
+        loaded.load(index_dir)
+        
+        assert isinstance(loaded.embeddings, np.memmap)
+        assert np.allclose(loaded.embeddings, index.embeddings)
+        assert loaded.search("engine light", top_k=1)[0][0]['text'] == "engine warning light"
+        del loaded
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc/self/maps")
+def test_save_unmaps_files_before_replacing_them(monkeypatch):
+    """Saving a loaded index over itself never replaces a file that is still mapped, as Windows requires"""
+    replace = os.replace
+    
+    def replace_unless_mapped(src, dst):
+        with open("/proc/self/maps") as f:
+            mapped = {line.split(None, 5)[-1].strip() for line in f if len(line.split()) == 6}
+        if os.path.abspath(dst) in mapped:
+            raise PermissionError(f"{dst} is mapped")
+        replace(src, dst)
+    
+    index = VectorIndex(HashingEmbeddingModel())
+    index.build_index(make_chunks(["battery charging error", "engine warning light", "brake sensor reset"]))
+    with tempfile.TemporaryDirectory() as index_dir:
+        index.save(index_dir)
+        assert isinstance(index.embeddings, np.memmap)  # Saving maps the new files back in
+        del index
+        loaded = VectorIndex(HashingEmbeddingModel())
+        loaded.load(index_dir)
+        loaded.add_chunks([{'text': "coolant leak repair", 'url': 'test://3', 'title': 'Doc 3'}])
+        
+        monkeypatch.setattr(os, "replace", replace_unless_mapped)
+        loaded.save(index_dir)
+        monkeypatch.undo()
+        
+        assert isinstance(loaded.embeddings, np.memmap) and len(loaded.metadata) == 4
+        assert loaded.search("coolant leak", top_k=1)[0][0]['url'] == 'test://3'
+        reloaded = VectorIndex(HashingEmbeddingModel())
+        reloaded.load(index_dir)
+        assert reloaded.search("engine light", top_k=1)[0][0]['text'] == "engine warning light"
+        del loaded, reloaded
+
+def test_quantized_index_rescores_and_persists_compression():
+    """sq8/fp16 indexes are smaller, rank like float32 after rescoring, and reload compressed"""
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(200)]
+    chunks = make_chunks([" ".join(rng.choice(words, 12)) for _ in range(400)])
+    exact = VectorIndex(HashingEmbeddingModel(), index_type='flat')
+    exact.build_index(chunks)
+    quantized = VectorIndex(HashingEmbeddingModel(), index_type='flat', compression='sq8')
+    quantized.build_index(chunks)
+    
+    # Rescored scores are the exact float32 ones (ties may come back in another order)
+    for query in ("w1 w2 w3", "w10 w20 w30 w40"):
+        expected = [round(score, 4) for _, score in exact.search(query, top_k=5)]
+        assert [round(score, 4) for _, score in quantized.search(query, top_k=5)] == expected
+    
+    with tempfile.TemporaryDirectory() as index_dir:
+        quantized.save(index_dir)
+        assert read_manifest(index_dir)['index'] == {'type': 'flat', 'compression': 'sq8'}
+        loaded = VectorIndex(HashingEmbeddingModel())
+        loaded.load(index_dir)
+        assert loaded.compression == 'sq8'
+        assert round(loaded.search("w10 w20 w30 w40", top_k=1)[0][1], 4) == expected[0]
+        del loaded
+    
+    report = benchmark_index_types(exact.embeddings, ['flat'], compressions=('none', 'fp16', 'sq8'))
+    memory = {row['compression']: row['memory_bytes'] for row in report}
+    assert memory['sq8'] < memory['fp16'] < memory['none']
+    assert all(row['rescored_recall'] >= row['recall'] for row in report if row['compression'] != 'none')
+    assert resolve_compression('ivfpq', 'sq8') == 'none'  # PQ codes are already compressed
+
+def test_onnx_backend_agrees_with_torch():
+    """The int8 ONNX Runtime backend embeds close to the torch default and ranks the same"""
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("optimum.onnxruntime")
+    try:
+        torch_model = EmbeddingModel(backend='torch')
+        onnx_model = EmbeddingModel(backend='onnx')
+    except OSError as e:
+        pytest.skip(f"Embedding model not available: {e}")
+    
+    texts = ["How do I reset the battery warning light?", "Engine error code P0420 means catalyst efficiency is low",
+             "Python raises KeyError when a dictionary key is missing", "Charging the Nexon EV takes about an hour"]
+    torch_vectors, onnx_vectors = torch_model.encode(texts), onnx_model.encode(texts)
+    cosine = np.sum(torch_vectors * onnx_vectors, axis=1) / (
+        np.linalg.norm(torch_vectors, axis=1) * np.linalg.norm(onnx_vectors, axis=1))
+    assert cosine.min() > 0.97
+    
+    query = "what does a missing dict key error mean"
+    assert np.argmax(torch_vectors @ torch_model.encode_single(query)) == \
+        np.argmax(onnx_vectors @ onnx_model.encode_single(query))
+
+def test_incremental_upsert_delete_compact():
+    """Re-indexing a page embeds only that page and chunk IDs survive compaction"""
+    model = HashingEmbeddingModel()
+    index = VectorIndex(model)
+    docs = [
+        {'url': 'test://a', 'title': 'A', 'content': 'battery charging error', 'length': 22},
+        {'url': 'test://b', 'title': 'B', 'content': 'engine warning light', 'length': 20},
+    ]
+    assert index.upsert_documents(docs) == {'added': 2, 'replaced': 0, 'unchanged': 0}
+    
+    model.calls = 0
+    changed = dict(docs[1], content='brake sensor reset')
+    assert index.upsert_documents([docs[0], changed]) == {'added': 0, 'replaced': 1, 'unchanged': 1}
+    assert model.calls == 1
+    assert index.live_count == 2
+    assert index.search("engine warning light", top_k=1)[0][0]['url'] == 'test://a'
+    
+    surviving_id = int(index.ids[0])
+    assert index.compact() == 1
+    assert int(index.ids[0]) == surviving_id
+    assert index.search("brake sensor", top_k=1)[0][0]['text'] == 'brake sensor reset'
+    
+    index.delete_url('test://a')
+    assert [chunk['url'] for chunk, _ in index.search("battery", top_k=5)] == ['test://b']
+
+def test_embedding_cache_roundtrip_and_eviction():
+    """Cache keys ignore whitespace differences and eviction drops the oldest entries"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = EmbeddingCache(os.path.join(cache_dir, "cache.sqlite"), "hashing-test")
+        assert cache.key("battery  charging\n") == cache.key("battery charging")
+        assert cache.key("battery charging") != cache.key("battery charge")
+        
+        vectors = {cache.key(f"text {i}"): np.full(4, i, dtype=np.float32) for i in range(5)}
+        cache.put_many(vectors)
+        found = cache.get_many([cache.key("text 3"), cache.key("missing")])
+        assert list(found) == [cache.key("text 3")] and found[cache.key("text 3")][0] == 3
+        
+        assert cache.evict(2) == 3
+        assert cache.key("text 3") in cache.get_many(list(vectors))
+        
+        # A second connection, as from another build worker, shares the WAL-mode file
+        other = EmbeddingCache(os.path.join(cache_dir, "cache.sqlite"), "hashing-test")
+        assert other.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        other.put_many({other.key("text 9"): np.full(4, 9, dtype=np.float32)})
+        assert cache.key("text 9") in cache.get_many([cache.key("text 9")])
+        other.close()
+        cache.close()
+
+class RecordingSentenceTransformer:
+    """SentenceTransformer stand-in that records the batches it is given"""
+    tokenizer = WordPieceTokenizer()
+    max_seq_length = 128
+    
+    def __init__(self):
+        self.batches = []
+    
+    def encode(self, texts, batch_size=32, show_progress_bar=None):
+        self.batches.append([len(text.split()) for text in texts])
+        return HashingEmbeddingModel().encode(texts)
+    
+    def get_sentence_embedding_dimension(self):
+        return HashingEmbeddingModel.dimension
+
+def test_bulk_encode_buckets_by_length_and_keeps_order():
+    """Bulk encoding batches similar lengths under the memory budget and returns input order"""
+    texts = [' '.join(['word'] * (3 if i % 2 else 120)) + f' doc{i:02d}' for i in range(40)]
+    model = EmbeddingModel(model=RecordingSentenceTransformer())
+    
+    vectors = model.encode_bulk(texts, memory_budget_mb=4)
+    assert np.array_equal(vectors, HashingEmbeddingModel().encode(texts))
+    
+    batches = model.model.batches
+    assert all(len(set(batch)) == 1 for batch in batches)  # Short and long texts never share padding
+    short = [len(batch) for batch in batches if batch[0] == 4]
+    long = [len(batch) for batch in batches if batch[0] == 121]
+    assert sum(short) == sum(long) == 20 and max(long) < max(short)
+    
+    stats = model.throughput()
+    assert stats['texts'] == 40 and stats['batches'] == len(batches) and stats['padding'] == 0.0
+
+def test_incremental_html_scrape_tracks_changes_and_deletions():
+    """Incremental HTML scrapes re-extract changed files, drop deleted ones and recover a lost docstore"""
+    from infochat_agent.scrape import load_docstore
+    
+    def page(body):
+        return f"<html><head><title>Page</title></head><body><article><p>{body}</p></article></body></html>"
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        html_dir = os.path.join(temp_dir, "html")
+        os.makedirs(html_dir)
+        for name in ("a", "b", "c"):
+            with open(os.path.join(html_dir, f"{name}.html"), 'w', encoding='utf-8') as f:
+                f.write(page(f"Battery charging guide {name} " * 20))
+        output = os.path.join(temp_dir, "docstore.jsonl")
+        scraper = WebScraper()
+        
+        assert scraper.update_html_docstore(html_dir, output, workers=1) == {'changed': 3, 'removed': 0, 'documents': 3}
+        assert scraper.update_html_docstore(html_dir, output, workers=1)['changed'] == 0
+        
+        os.remove(os.path.join(html_dir, "b.html"))
+        with open(os.path.join(html_dir, "c.html"), 'w', encoding='utf-8') as f:
+            f.write(page("Updated motor warning reset steps " * 20))
+        assert scraper.update_html_docstore(html_dir, output, workers=1) == {'changed': 1, 'removed': 1, 'documents': 2}
+        assert sorted(os.path.basename(doc['url']) for doc in load_docstore(output)) == ["a.html", "c.html"]
+        
+        os.remove(output)  # The state file alone must not make unchanged files vanish
+        assert scraper.update_html_docstore(html_dir, output, workers=1)['documents'] == 2
+
+def test_rate_limiter_paces_after_burst():
+    """The token bucket allows a burst, then spaces requests at the configured rate"""
+    import time
+    limiter = RateLimiter(rate=50, capacity=2)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - start >= 4 / 50 * 0.9
+
+def test_streaming_build_matches_in_memory_build():
+    """Batched streaming ingestion produces the same chunks and vectors"""
+    documents = [{'url': f'test://{i}', 'title': f'Doc {i}', 'content': f'battery {i} charging error code',
+                  'length': 30} for i in range(7)]
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docstore_path = os.path.join(temp_dir, "docstore.jsonl")
+        save_docstore(documents, docstore_path)
+        
+        index_dir = os.path.join(temp_dir, "index")
+        assert build_index_streaming(docstore_path, index_dir, batch_size=3,
+                                     embedding_model=HashingEmbeddingModel()) == 7
+        
+        streamed = VectorIndex(HashingEmbeddingModel())
+        streamed.load(index_dir)
+        expected = VectorIndex(HashingEmbeddingModel())
+        expected.upsert_documents(documents)
+        
+        assert list(streamed.metadata) == list(expected.metadata)
+        assert np.allclose(streamed.embeddings, expected.embeddings)
+        assert streamed.sparse is not None
+        assert streamed.sparse_search("battery 3", top_k=1) == expected.sparse_search("battery 3", top_k=1)
+        del streamed
+
+def test_sharded_build_matches_streaming_build_and_is_stable():
+    """Worker shards merge into the single-process index, byte for byte on every run"""
+    import hashlib
+    documents = [{'url': f'test://{i}', 'title': f'Doc {i}', 'length': 30,
+                  'content': ' '.join(f'w{(i * 37 + j) % 101}' for j in range(40))} for i in range(9)]
+    documents.append(dict(documents[1], url='test://mirror'))  # Duplicate of a page in another shard
+    
+    def digests(index_dir):
+        manifest = read_manifest(index_dir)
+        manifest.pop('version')
+        files = sorted(name for name in os.listdir(index_dir) if name != 'manifest.json')
+        return manifest, {name: hashlib.sha256(open(os.path.join(index_dir, name), 'rb').read()).hexdigest()
+                          for name in files}
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docstore_path = os.path.join(temp_dir, "docstore.jsonl")
+        save_docstore(documents, docstore_path)
+        
+        build_index_streaming(docstore_path, os.path.join(temp_dir, "single"), batch_size=4,
+                              embedding_model=HashingEmbeddingModel(), dedup=True)
+        for run in ("first", "second"):
+            assert build_index_sharded(docstore_path, os.path.join(temp_dir, run), workers=3, batch_size=4,
+                                       embedding_model=HashingEmbeddingModel(), dedup=True) == 9
+        
+        assert digests(os.path.join(temp_dir, "first")) == digests(os.path.join(temp_dir, "second"))
+        assert digests(os.path.join(temp_dir, "first")) == digests(os.path.join(temp_dir, "single"))
+        assert not os.path.exists(os.path.join(temp_dir, "first", "shards"))
+
+def test_failed_rebuild_keeps_the_existing_index():
+    """Streaming and sharded rebuilds that fail leave the previous index loadable and no staging files behind"""
+    documents = [{'url': f'test://{i}', 'title': f'Doc {i}', 'content': f'battery {i} charging error code',
+                  'length': 30} for i in range(5)]
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docstore_path = os.path.join(temp_dir, "docstore.jsonl")
+        index_dir = os.path.join(temp_dir, "index")
+        save_docstore(documents, docstore_path)
+        build_index_streaming(docstore_path, index_dir, embedding_model=HashingEmbeddingModel())
+        
+        save_docstore([], docstore_path)
+        with pytest.raises(ValueError, match="No chunks"):
+            build_index_streaming(docstore_path, index_dir, embedding_model=HashingEmbeddingModel())
+        
+        save_docstore(documents, docstore_path)
+        with pytest.raises(RuntimeError, match="model crashed"):
+            build_index_sharded(docstore_path, index_dir, workers=2, embedding_model=FailingEmbeddingModel())
+        
+        index = VectorIndex(HashingEmbeddingModel())
+        index.load(index_dir)
+        assert index.live_count == 5
+        assert sorted(os.listdir(temp_dir)) == ["docstore.jsonl", "index"]
+        del index
+
+def test_compact_metadata_roundtrip_and_migration():
+    """Compact metadata reads back the same chunk dicts and migrates legacy JSONL"""
+    import json
+    chunks = TextProcessor(chunk_size=4, chunk_overlap=1).process_documents([
+        {'url': 'test://a', 'title': 'Ünïcode', 'content': 'one two three four five six seven', 'length': 33},
+        {'url': 'test://b', 'title': 'B', 'content': 'eight nine', 'length': 10},
+    ])
+    
+    with tempfile.TemporaryDirectory() as index_dir:
+        with open(os.path.join(index_dir, "metadata.jsonl"), 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+        
+        header = migrate_metadata(index_dir)
+        assert header['count'] == len(chunks) and header['documents'] == 2
+        assert not os.path.exists(os.path.join(index_dir, "metadata.jsonl"))
+        
+        metadata = ChunkMetadata.load(index_dir, header)
+        assert list(metadata) == chunks
+        assert metadata.url_rows() == {'test://a': [0, 1], 'test://b': [2]}
+        assert list(metadata.take(np.array([1, 2]))) == chunks[1:]
+
+def test_retrieval_cache_hits_and_invalidates_on_index_change():
+    """Repeated questions skip encoding and search until the index changes"""
+    model = HashingEmbeddingModel()
+    index = VectorIndex(model)
+    index.build_index(make_chunks(["battery charging error", "engine warning light", "brake sensor reset"]))
+    rag = RAGPipeline(index=index)
+    
+    first = rag.retrieve("Battery charging?", top_k=2)
+    model.calls = 0
+    assert rag.retrieve("  battery   CHARGING ", top_k=2) == first
+    assert model.calls == 0
+    assert rag.cache_stats()['results']['hits'] == 1
+    
+    index.add_chunks(make_chunks(["battery charging station"]))
+    rag.retrieve("battery charging", top_k=2)
+    assert model.calls == 2  # One add, one re-encoded query after invalidation
+    assert rag.cache_stats()['results']['entries'] == 1
+
+def test_ask_batch_matches_single_queries():
+    """Batched answering uses one encode call and agrees with per-question retrieval"""
+    model = HashingEmbeddingModel()
+    index = VectorIndex(model)
+    index.build_index(make_chunks(["battery charging error", "engine warning light",
+                                   "brake sensor reset", "battery range nexon"]))
+    rag = RAGPipeline(index=index)
+    questions = ["battery charging", "engine light", "brake reset"]
+    
+    model.calls = 0
+    responses = list(rag.ask_batch(questions, use_llm=False, top_k=2))
+    assert model.calls == 1
+    assert [r['question'] for r in responses] == questions
+    
+    for response, question in zip(responses, questions):
+        assert response['answer'] == rag.ask(question, use_llm=False, top_k=2)['answer']
+    
+    # With an LLM, the answer cache is checked with the batch's vectors, not per-question encodes
+    def complete(**kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="LLM answer"))])
+    rag.openai_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=complete)))
+    questions = ["coolant leak", "sensor fault"]
+    model.calls = 0
+    assert [r['answer'] for r in rag.ask_batch(questions, use_llm=True, top_k=2)] == ["LLM answer"] * 2
+    assert model.calls == 1
+    assert all(r['cached'] for r in rag.ask_batch(questions, use_llm=True, top_k=2))
+    assert model.calls == 2
+
+def test_registry_shares_pipeline_until_index_changes():
+    """Models and pipelines load once per process and reload only when the index is rewritten"""
+    model = HashingEmbeddingModel()
+    registry.clear()
+    registry.register_embedding_model(model)
+    index = VectorIndex(model)
+    index.build_index(make_chunks(["battery charging error", "engine warning light"]))
+    
+    with tempfile.TemporaryDirectory() as index_dir:
+        index.save(index_dir)
+        rag = registry.get_pipeline(index_dir)
+        assert registry.get_pipeline(index_dir) is rag
+        assert rag.index.embedding_model is model
+        
+        registry.warmup(model.model_name)
+        assert registry.is_ready(model.model_name)
+        assert not registry.is_ready(model.model_name, backend='onnx')
+        assert registry.status()['models'][model.model_name, config.embedding_backend]['ready']
+        
+        index.add_chunks(make_chunks(["brake sensor reset"]))
+        index.save(index_dir)
+        reloaded = registry.get_pipeline(index_dir)
+        assert reloaded is not rag
+        assert reloaded.index.live_count == 3
+        del rag, reloaded
+    registry.clear()
+
+def test_registry_forgets_replaced_index_builds():
+    """Rebuilding into a new directory and forgetting the old one leaves one index registered"""
+    model = HashingEmbeddingModel()
+    registry.clear()
+    registry.register_embedding_model(model)
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        previous = None
+        for build in ("first", "second"):
+            index = VectorIndex(model)
+            index.build_index(make_chunks(["battery charging error", f"{build} build"]))
+            index_dir = os.path.join(temp_dir, build)
+            index.save(index_dir)
+            del index
+            if previous:
+                registry.forget(previous)
+            registry.get_pipeline(index_dir, hybrid=True)
+            registry.get_pipeline(index_dir, hybrid=False)
+            previous = index_dir
+        
+        assert list(registry.status()['indexes']) == [os.path.abspath(previous)]
+        assert {key[0] for key in registry._pipelines} == {os.path.abspath(previous)}
+    registry.clear()
+
+def test_registry_shares_one_cached_model_per_cache_file():
+    """Repeated cache_path lookups reuse one view and SQLite connection, usable from any thread"""
+    from concurrent.futures import ThreadPoolExecutor
+    registry.clear()
+    model = EmbeddingModel(model=RecordingSentenceTransformer())
+    registry.register_embedding_model(model)
+    
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = os.path.join(cache_dir, "cache.sqlite")
+        view = registry.get_embedding_model(cache_path=path)
+        assert view is not model and view.model is model.model and view.cache is not None
+        assert registry.get_embedding_model(cache_path=path) is view
+        assert registry.get_embedding_model(cache_path=os.path.join(cache_dir, "other.sqlite")) is not view
+        assert registry.get_embedding_model() is model
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            vectors = list(executor.map(lambda text: view.encode([text])[0], ["battery", "engine", "battery"]))
+        assert np.allclose(vectors[0], vectors[2])
+        assert len(view.cache) == 2
+        registry.clear()
+
+class FakeStreamingClient:
+    """Mimics the OpenAI client's streamed chat completions"""
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    def create(self, stream=False, **kwargs):
+        assert stream
+        return (SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+                for token in self.tokens)
+
+def test_ask_stream_yields_retrieval_then_tokens():
+    """Passages arrive before any answer text, and the tokens add up to the final answer"""
+    index = VectorIndex(HashingEmbeddingModel())
+    index.build_index(make_chunks(["battery charging error", "engine warning light"]))
+    rag = RAGPipeline(index=index)
+    
+    events = list(rag.ask_stream("battery charging", use_llm=False, top_k=1))
+    assert [event['type'] for event in events] == ['retrieval', 'token', 'done']
+    assert events[-1]['response'] == rag.ask("battery charging", use_llm=False, top_k=1)
+    
+    rag.openai_client = FakeStreamingClient(["Charging ", "errors ", "[1]"])
+    events = list(rag.ask_stream("battery charging", top_k=1))
+    assert events[0]['type'] == 'retrieval'
+    assert events[0]['passages'][0]['text'] == "battery charging error"
+    assert [event['text'] for event in events if event['type'] == 'token'] == ["Charging ", "errors ", "[1]"]
+    assert events[-1]['response']['answer'] == "Charging errors [1]"
+
+def test_semantic_answer_cache_matches_paraphrases_and_chunks():
+    """Near-identical questions over the same chunks reuse an answer, across restarts, until the index changes"""
+    query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    paraphrase = np.array([0.99, 0.1, 0.0], dtype=np.float32)
+    unrelated = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+    chunks = frozenset({('test://0', 0), ('test://1', 0)})
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'answers.sqlite')
+        cache = SemanticAnswerCache(max_entries=2, threshold=0.95, path=path)
+        cache.set_version("v1")
+        cache.put(query, chunks, {'answer': "cached answer"})
+        
+        assert cache.get(paraphrase, chunks)['answer'] == "cached answer"
+        assert cache.get(unrelated, chunks) is None
+        assert cache.get(query, frozenset({('test://0', 0)})) is None
+        cache.close()
+        
+        reopened = SemanticAnswerCache(max_entries=2, threshold=0.95, path=path)
+        reopened.set_version("v1")
+        assert reopened.get(paraphrase, chunks)['answer'] == "cached answer"
+        reopened.set_version("v2")
+        assert reopened.get(query, chunks) is None
+        
+        for i in range(3):
+            reopened.put(np.eye(3, dtype=np.float32)[i], chunks, {'answer': str(i)})
+        assert len(reopened) == 2 and reopened.get(query, chunks) is None
+        reopened.close()
+        
+        # A smaller max_entries keeps only the newest stored answers
+        trimmed = SemanticAnswerCache(max_entries=1, threshold=0.95, path=path)
+        trimmed.set_version("v2")
+        assert len(trimmed) == 1 and trimmed.get(np.eye(3, dtype=np.float32)[2], chunks)['answer'] == "2"
+        assert trimmed.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] == 1
+        trimmed.close()
+
+def test_llm_answers_are_reused_for_repeated_questions():
+    """A repeated question returns the cached LLM answer without another completion"""
+    index = VectorIndex(HashingEmbeddingModel())
+    index.build_index(make_chunks(["battery charging error", "engine warning light"]))
+    rag = RAGPipeline(index=index)
+    client = FakeStreamingClient(["Charging ", "errors"])
+    rag.openai_client = client
+    
+    first = "".join(event.get('text', '') for event in rag.ask_stream("battery charging", top_k=1))
+    client.tokens = ["something else"]
+    events = list(rag.ask_stream("Battery charging?", top_k=1))
+    assert first == "Charging errors"
+    assert events[-1]['response']['answer'] == "Charging errors"
+    assert events[-1]['response']['cached']
+    assert rag.cache_stats()['answers']['hits'] == 1
+    
+    # Answers written by another model are not reused
+    rag.model = "other-model"
+    events = list(rag.ask_stream("battery charging", top_k=1))
+    assert events[-1]['response']['answer'] == "something else"
+    assert not events[-1]['response'].get('cached')
+    
+    # The extractive fallback after a failed completion is not cached
+    def fail(**kwargs):
+        raise RuntimeError("rate limited")
+    rag.openai_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fail)))
+    response = rag.ask("engine warning", top_k=1)
+    assert 'model' not in response and len(rag.answer_cache) == 1
+
+def test_hybrid_search_finds_exact_codes_and_persists_bm25():
+    """BM25 is built with the index, saved with it, rebuilt after changes and fused with dense hits"""
+    index = VectorIndex(HashingEmbeddingModel())
+    index.build_index(make_chunks(["battery charging error", "fault P0A80-01 replace hybrid battery pack",
+                                   "engine warning light", "brake sensor reset"]))
+    
+    assert index.sparse_search("p0a80", top_k=2)[0][0] == 1
+    results = index.hybrid_search("what does P0A80 mean", top_k=2)
+    assert results[0][0]['url'] == 'test://1'
+    
+    with tempfile.TemporaryDirectory() as index_dir:
+        index.save(index_dir)
+        loaded = VectorIndex(HashingEmbeddingModel())
+        loaded.load(index_dir)
+        assert loaded.sparse is not None
+        assert loaded.sparse_search("p0a80-01", top_k=1) == index.sparse_search("p0a80-01", top_k=1)
+        
+        loaded.delete_url('test://1')
+        loaded.add_chunks([{'text': "code P0A80 cleared after update", 'url': 'test://4', 'title': 'Doc 4'}])
+        assert loaded.sparse is None
+        assert [loaded.metadata[row]['url'] for row, _ in loaded.sparse_search("p0a80", top_k=5)] == ['test://4']
+        
+        loaded.sparse = None  # Stale until the next search; saving rebuilds it
+        loaded.save(index_dir)
+        assert read_manifest(index_dir)['sparse']['count'] == len(loaded.metadata)
+        reloaded = VectorIndex(HashingEmbeddingModel())
+        reloaded.load(index_dir)
+        assert reloaded.sparse is not None
+        assert [reloaded.metadata[row]['url'] for row, _ in reloaded.sparse_search("p0a80", top_k=5)] == ['test://4']
+        del loaded, reloaded
+    
+    rag = RAGPipeline(index=index, hybrid=True)
+    assert rag.retrieve("P0A80", top_k=1)[0][0]['url'] == 'test://1'
+    assert next(rag.ask_batch(["P0A80"], use_llm=False, top_k=1))['passages'][0]['url'] == 'test://1'
+
+def test_token_chunking_fits_max_sequence_length():
+    """Token-aware chunks keep sentences whole, fit the embedder and cover the whole text"""
+    tokenizer = WordPieceTokenizer()
+    sentences = [f"Sentence {i} talks about battery charging and regenerative braking." for i in range(40)]
+    sentences.append("averyveryverylongword " * 30)  # A single sentence over the budget
+    text = TextProcessor().clean_text(" ".join(sentences))
+    
+    processor = TextProcessor(chunk_overlap=20, tokenizer=tokenizer, max_tokens=64)
+    chunks = processor.chunk_text(text, {'url': 'test://0'})
+    
+    assert truncation_report([chunk['text'] for chunk in chunks], tokenizer, 64)['wasted_tokens'] == 0
+    assert truncation_report([chunk['text'] for chunk in TextProcessor().chunk_text(text)],
+                             tokenizer, 64)['wasted_tokens'] > 0
+    # Only the over-long sentence is split mid-sentence
+    assert all(chunk['text'].endswith('.') or set(chunk['text'].split()) == {'averyveryverylongword'}
+               for chunk in chunks)
+    assert chunks[0]['start_word'] == 0 and chunks[-1]['end_word'] == len(text.split())
+    assert all(b['start_word'] <= a['end_word'] for a, b in zip(chunks, chunks[1:]))
+    assert chunks[1]['start_word'] < chunks[0]['end_word']  # Overlap of whole sentences
+
+def test_chunk_store_matches_chunk_dicts():
+    """The compact store yields the same chunks as process_documents, in either chunking mode"""
+    documents = [
+        {'url': f'test://{i}', 'title': f'Doc {i}', 'length': 0,
+         'content': " ".join(f"Word{j} © battery   charging.\n" for j in range(i * 37))}
+        for i in range(5)
+    ]
+    for processor in (TextProcessor(chunk_size=20, chunk_overlap=5),
+                      TextProcessor(chunk_overlap=8, tokenizer=WordPieceTokenizer(), max_tokens=32)):
+        store = processor.chunk_store(documents, start_doc_id=3)
+        assert list(store) == processor.process_documents(documents, start_doc_id=3)
+        assert store[-1]['doc_id'] == 7 and store[0].get('url') == 'test://1'
+    
+    index = VectorIndex(HashingEmbeddingModel())
+    index.build_index(store)
+    assert index.search("battery charging", top_k=1)[0][0]['title'].startswith('Doc')
+    with tempfile.TemporaryDirectory() as index_dir:
+        index.save(index_dir)
+        loaded = ChunkMetadata.load(index_dir, read_manifest(index_dir)['metadata'])
+        assert list(loaded) == list(store)
+        del loaded
+
+def test_upsert_reindexes_a_page_that_grows():
+    """Text appended to a page is embedded even though its old chunks are unchanged"""
+    processor = TextProcessor(chunk_size=10, chunk_overlap=2)
+    page = {'url': 'test://grows', 'title': 'Grows', 'length': 60,
+            'content': ' '.join(f'word{i}' for i in range(10))}
+    index = VectorIndex(HashingEmbeddingModel())
+    index.upsert_documents([page], processor=processor)
+    
+    assert index.upsert_documents([page], processor=processor) == {'added': 0, 'replaced': 0, 'unchanged': 1}
+    grown = dict(page, content=page['content'] + ' appended battery sentence here')
+    assert index.upsert_documents([grown], processor=processor) == {'added': 0, 'replaced': 1, 'unchanged': 0}
+    assert any('battery' in chunk['text'] for chunk in index.url_chunks('test://grows'))
+
+def test_near_duplicate_chunks_are_never_embedded():
+    """Mirrored pages are dropped before embedding, and re-upserting them embeds nothing"""
+    words = [f"word{j}" for j in range(300)]
+    original = " ".join(words)
+    mirror = " ".join(words[:150] + ["edited"] + words[151:])
+    documents = [{'url': f'test://{i}', 'title': f'Doc {i}', 'content': content, 'length': 0}
+                 for i, content in enumerate([original, mirror, "battery charging error code"])]
+    
+    processor = TextProcessor(chunk_size=100, chunk_overlap=50)
+    store = processor.chunk_store(documents, dedup=NearDuplicateFilter(threshold=0.8))
+    dedup = NearDuplicateFilter(threshold=0.8)
+    assert list(store) == list(processor.iter_chunks(documents, dedup=dedup))
+    # Three of the mirror's windows match the original exactly, the two edited ones closely
+    assert dedup.stats() == {'seen': 11, 'dropped': 5, 'ratio': 5 / 11}
+    assert [chunk['url'] for chunk in store] == ['test://0'] * 5 + ['test://2']
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docstore_path = os.path.join(temp_dir, "docstore.jsonl")
+        save_docstore(documents, docstore_path)
+        index_dir = os.path.join(temp_dir, "index")
+        model = HashingEmbeddingModel()
+        # One chunk per page at the default chunk size; the mirror's is dropped
+        assert build_index_streaming(docstore_path, index_dir, embedding_model=model) == 2
+        
+        # Stored signatures catch the mirror again, so re-upserting embeds nothing
+        index = VectorIndex(model)
+        index.load(index_dir)
+        assert index.signatures.shape == (2, 64)
+        model.calls = 0
+        stats = index.upsert_documents(documents + [dict(documents[2], url='test://3')])
+        # The mirror left no chunks in the build and counts as unchanged; the new copy is added without chunks
+        assert stats == {'added': 1, 'replaced': 0, 'unchanged': 3}
+        assert index.live_count == 2 and model.calls == 0
+        
+        index.save(index_dir)
+        reloaded = VectorIndex(model)
+        reloaded.load(index_dir)
+        assert reloaded.upsert_documents(documents + [dict(documents[2], url='test://3')]) == \
+            {'added': 0, 'replaced': 0, 'unchanged': 4}
+        
+        # Once the original changes, the mirror is no longer a duplicate and gets indexed
+        edited = [dict(documents[0], content="completely different text"), documents[1]]
+        assert reloaded.upsert_documents(edited) == {'added': 1, 'replaced': 1, 'unchanged': 0}
+        assert reloaded.url_chunks('test://1') and 'test://1' not in reloaded.empty_pages
+        del index, reloaded
+
+def test_cli_import_skips_heavy_dependencies():
+    """Importing the CLI stays cheap: models, FAISS, scipy and the scraping stack load on first use"""
+    import subprocess
+    heavy = ('torch', 'sentence_transformers', 'faiss', 'scipy', 'openai', 'requests_cache', 'bs4')
+    code = f"import sys, cli; print(' '.join(m for m in {heavy!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == []
+    
+    # Cumulative microseconds of the top-level imports; torch alone used to cost several seconds
+    top_level = [line.split('|') for line in result.stderr.splitlines() if line.startswith('import time:')]
+    total = sum(int(parts[1]) for parts in top_level if parts[1].strip().isdigit() and not parts[2].startswith('  '))
+    assert total < 1.5e6
+
 if __name__ == "__main__":
-    test_basic_functionality()
\ No newline at end of file
+    test_basic_functionality()
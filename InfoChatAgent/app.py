@@ -1,19 +1,34 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+import os
+import json
 import requests
 from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
-import faiss
+from embedder import load_embedder
 import numpy as np
+from vector_index import compression_from_env, make_index, add_to_index, search_index
+from microbatch import MicroBatcher
+
+try:
+    from openai import OpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
 
 app = Flask(__name__)
 
 class WebRAGAgent:
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = load_embedder('all-MiniLM-L6-v2')
+        self.query_encoder = MicroBatcher(self.model.encode)  # Concurrent questions share forward passes
         self.documents = []
         self.embeddings = None
         self.index = None
+        self.compression = compression_from_env()  # How the FAISS index stores vectors
         self.scraped_urls = []
+        self.llm = None
+        if OPENAI_AVAILABLE and os.getenv('OPENAI_API_KEY'):
+            self.llm = OpenAI(base_url=os.getenv('OPENAI_BASE_URL'))
+        self.llm_model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
         
     def scrape_url(self, url):
         """Scrape content from URL"""
@@ -33,6 +48,10 @@ class WebRAGAgent:
             # Split into chunks
             chunks = [p.strip() for p in text.split('\n') if len(p.strip()) > 50]
             
+            # Re-scraping a URL replaces its previous chunks
+            if url in self.scraped_urls:
+                self.remove_url(url)
+            
             for chunk in chunks:
                 self.documents.append({
                     'text': chunk,
@@ -45,17 +64,31 @@ class WebRAGAgent:
         except Exception as e:
             return False, f"Error scraping {url}: {str(e)}"
     
+    def remove_url(self, url):
+        """Drop a URL's chunks and their vectors without re-encoding the rest"""
+        keep = [i for i, doc in enumerate(self.documents) if doc['source'] != url]
+        if self.embeddings is not None:
+            self.embeddings = self.embeddings[[i for i in keep if i < len(self.embeddings)]]
+        self.documents = [self.documents[i] for i in keep]
+        self.scraped_urls = [u for u in self.scraped_urls if u != url]
+        self.index = None  # Rebuilt from the stored vectors on the next build_index
+    
     def build_index(self):
-        """Build FAISS index from documents"""
+        """Build FAISS index from documents, embedding only chunks added since the last build"""
         if not self.documents:
             return False, "No documents to index!"
         
-        texts = [doc['text'] for doc in self.documents]
-        self.embeddings = self.model.encode(texts)
+        embedded = 0 if self.embeddings is None else len(self.embeddings)
+        new_texts = [doc['text'] for doc in self.documents[embedded:]]
+        new_embeddings = self.model.encode(new_texts).astype('float32') if new_texts else None
         
-        dimension = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(self.embeddings.astype('float32'))
+        if self.index is None:
+            if new_embeddings is not None:
+                self.embeddings = new_embeddings if self.embeddings is None else np.vstack([self.embeddings, new_embeddings])
+            self.index = make_index(self.embeddings, self.compression)
+        elif new_embeddings is not None:
+            self.embeddings = np.vstack([self.embeddings, new_embeddings])
+            self.index = add_to_index(self.index, self.embeddings, new_embeddings, self.compression)
         
         return True, f"Built index with {len(self.documents)} documents"
     
@@ -64,8 +97,9 @@ class WebRAGAgent:
         if self.index is None:
             return []
         
-        question_embedding = self.model.encode([question])
-        distances, indices = self.index.search(question_embedding.astype('float32'), top_k)
+        question_embedding = self.query_encoder.encode(question).reshape(1, -1)
+        distances, indices = search_index(self.index, self.embeddings, question_embedding.astype('float32'),
+                                          top_k, self.compression)
         
         results = []
         for idx in indices[0]:
@@ -76,6 +110,30 @@ class WebRAGAgent:
             })
         
         return results
+    
+    def answer_stream(self, question, results):
+        """Yield an LLM answer over the retrieved results as it is generated"""
+        if self.llm is None or not results:
+            return
+        
+        context = "\n\n".join(f"[{i+1}] {result['text']}" for i, result in enumerate(results))
+        stream = self.llm.chat.completions.create(
+            model=self.llm_model,
+            messages=[
+                {"role": "system", "content": "Answer the question from the provided context. Cite sources as [1], [2], etc."},
+                {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}\n\nAnswer:"}
+            ],
+            temperature=0.1,
+            max_tokens=500,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+def sse(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 # Initialize agent
 agent = WebRAGAgent()
@@ -115,13 +173,45 @@ def ask():
     if not agent.documents:
         return jsonify({'success': False, 'message': 'Please scrape a URL first'})
     
-    results = agent.ask(question)
+    try:
+        results = agent.ask(question)
+    except TimeoutError:
+        return jsonify({'success': False, 'message': 'The server is busy, please try again'})
     
     return jsonify({
         'success': True,
         'results': results
     })
 
+@app.route('/ask/stream')
+def ask_stream():
+    """Server-Sent Events: results as soon as search finishes, then answer tokens"""
+    question = request.args.get('question', '').strip()
+    
+    def events():
+        if not question:
+            yield sse('failure', {'message': 'Question is required'})
+            return
+        if not agent.documents:
+            yield sse('failure', {'message': 'Please scrape a URL first'})
+            return
+        
+        try:
+            results = agent.ask(question)
+        except TimeoutError:
+            yield sse('failure', {'message': 'The server is busy, please try again'})
+            return
+        yield sse('results', {'results': results})
+        try:
+            for text in agent.answer_stream(question, results):
+                yield sse('token', {'text': text})
+        except Exception as e:
+            yield sse('failure', {'message': f'Error generating answer: {str(e)}'})
+        yield sse('done', {})
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/reset', methods=['POST'])
 def reset():
     agent.documents = []
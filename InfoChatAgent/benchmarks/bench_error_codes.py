@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Compare the error-code postings map against scanning every document per question"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from error_codes import ErrorCodeIndex, find_error_codes
+
+WORDS = ("battery charging nexon range service engine warning reset sensor motor "
+         "brake light manual update cable connector inverter coolant").split()
+
+def linear_scan(documents, codes):
+    """The previous lookup: upper-case every document for every question"""
+    matches = []
+    for i, doc in enumerate(documents):
+        for code in codes:
+            if code in doc['text'].upper():
+                matches.append(i)
+                break
+    return matches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--documents', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    codes = [f"{prefix}{rng.randrange(10 ** digits):0{digits}d}"
+             for prefix, digits in (('EV', 3), ('P', 4), ('U', 4)) for _ in range(200)]
+    
+    for num_documents in args.documents:
+        documents = []
+        for _ in range(num_documents):
+            words = rng.choices(WORDS, k=40)
+            if rng.random() < 0.1:
+                words.insert(rng.randrange(len(words)), f"Error Code {rng.choice(codes)}:")
+            documents.append({'text': ' '.join(words)})
+        questions = [f"How do I fix {rng.choice(codes).lower()} on my car?" for _ in range(args.queries)]
+        
+        start = time.perf_counter()
+        code_index = ErrorCodeIndex()
+        code_index.update(documents)
+        build_seconds = time.perf_counter() - start
+        
+        timings = {}
+        for name, lookup in (('linear scan', lambda codes: linear_scan(documents, codes)),
+                             ('postings', code_index.lookup)):
+            start = time.perf_counter()
+            for question in questions:
+                results = lookup(find_error_codes(question))
+            timings[name] = (time.perf_counter() - start) / len(questions)
+        
+        assert all(linear_scan(documents, find_error_codes(q)) == code_index.lookup(find_error_codes(q))
+                   for q in questions[:20])
+        print(f"{num_documents:7d} docs: linear scan {timings['linear scan'] * 1000:9.3f} ms/query, "
+              f"postings {timings['postings'] * 1000:7.4f} ms/query "
+              f"({timings['linear scan'] / timings['postings']:,.0f}x), build {build_seconds * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
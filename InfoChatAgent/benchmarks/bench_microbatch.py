@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Compare per-request encodes with the MicroBatcher under concurrent load: p50/p99 latency and QPS"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from microbatch import MicroBatcher
+
+WORDS = ("battery charging nexon range service engine warning reset sensor motor "
+         "brake light manual update cable connector inverter coolant").split()
+
+class SyntheticEncoder:
+    """CPU-bound stand-in with a transformer-like cost profile (per-call overhead plus
+    a stack of matmuls per token), for machines without the model weights"""
+    
+    def __init__(self, dimension=384, layers=6, tokens=32):
+        rng = np.random.default_rng(0)
+        self.weights = [rng.standard_normal((dimension, dimension), dtype=np.float32) / np.sqrt(dimension)
+                        for _ in range(layers)]
+        self.tokens = tokens
+    
+    def encode(self, texts, **kwargs):
+        hidden = np.random.default_rng(len(texts)).standard_normal(
+            (len(texts) * self.tokens, self.weights[0].shape[0]), dtype=np.float32)
+        for weight in self.weights:
+            hidden = np.tanh(hidden @ weight)
+        return hidden.reshape(len(texts), self.tokens, -1).mean(axis=1)
+
+def run(encode_one, questions, concurrency):
+    """Issue every question from `concurrency` threads, returning per-request latencies and wall time"""
+    latencies = []
+    lock = threading.Lock()
+    pending = iter(questions)
+    
+    def worker():
+        while True:
+            with lock:
+                question = next(pending, None)
+            if question is None:
+                return
+            start = time.perf_counter()
+            encode_one(question)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+    
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=512)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=0.0)
+    parser.add_argument('--synthetic', action='store_true', help='Use a synthetic encoder instead of the model')
+    args = parser.parse_args()
+    
+    if args.synthetic:
+        model = SyntheticEncoder()
+    else:
+        from embedder import load_embedder
+        model = load_embedder('all-MiniLM-L6-v2')
+    
+    rng = random.Random(0)
+    questions = [' '.join(rng.choices(WORDS, k=10)) + '?' for _ in range(args.requests)]
+    model.encode(questions[:8])  # Warm up
+    
+    print(f"{'mode':>8} {'clients':>7} {'p50 ms':>8} {'p99 ms':>8} {'QPS':>8} {'batch':>6}")
+    for concurrency in args.concurrency:
+        latencies, wall = run(lambda question: model.encode([question]), questions, concurrency)
+        print(f"{'direct':>8} {concurrency:7d} {latencies[len(latencies) // 2] * 1e3:8.2f} "
+              f"{latencies[int(len(latencies) * 0.99)] * 1e3:8.2f} {len(questions) / wall:8.1f} {1:6.1f}")
+        
+        batcher = MicroBatcher(model.encode, args.max_batch_size, args.max_wait_ms)
+        latencies, wall = run(batcher.encode, questions, concurrency)
+        print(f"{'batched':>8} {concurrency:7d} {latencies[len(latencies) // 2] * 1e3:8.2f} "
+              f"{latencies[int(len(latencies) * 0.99)] * 1e3:8.2f} {len(questions) / wall:8.1f} "
+              f"{batcher.stats()['mean_batch_size']:6.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""Sentence-transformers model loading on a torch or ONNX Runtime backend"""
+
+import os
+from sentence_transformers import SentenceTransformer
+
+def load_embedder(model_name='all-MiniLM-L6-v2'):
+    """Model on the backend named by EMBEDDING_BACKEND.
+    
+    'torch' (the default) runs the PyTorch weights; 'onnx' runs the dynamically
+    int8-quantized ONNX export named by ONNX_FILE_NAME on ONNX Runtime, which is
+    faster and uses less memory on CPU (needs sentence-transformers[onnx]).
+    """
+    backend = os.getenv('EMBEDDING_BACKEND', 'torch')
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+    if backend == 'onnx':
+        file_name = os.getenv('ONNX_FILE_NAME', 'onnx/model_quint8_avx2.onnx')
+        return SentenceTransformer(model_name, backend='onnx', model_kwargs={'file_name': file_name})
+    raise ValueError(f"EMBEDDING_BACKEND must be 'torch' or 'onnx', got {backend!r}")
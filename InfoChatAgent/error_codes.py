@@ -0,0 +1,37 @@
+"""Exact error-code lookup for scraped documents"""
+
+import re
+
+# Codes as they appear in page text (any case) and as typed in questions
+ERROR_CODE_PATTERN = re.compile(r'(EV\d{3}|P\d{4}|U\d{4})', re.IGNORECASE)
+QUESTION_CODE_PATTERN = re.compile(r'\b(EV\d{3}|P\d{4}|U\d{4})\b')
+
+def find_error_codes(question):
+    """Error codes mentioned in a question, upper-cased"""
+    return QUESTION_CODE_PATTERN.findall(question.upper())
+
+class ErrorCodeIndex:
+    """Postings map from error code to the positions of documents that mention it"""
+    
+    def __init__(self):
+        self.postings = {}
+        self.indexed = 0  # Documents[:indexed] are in the map
+    
+    def update(self, documents):
+        """Index documents appended since the last update"""
+        for doc_id in range(self.indexed, len(documents)):
+            for code in set(code.upper() for code in ERROR_CODE_PATTERN.findall(documents[doc_id]['text'])):
+                self.postings.setdefault(code, []).append(doc_id)
+        self.indexed = len(documents)
+    
+    def clear(self):
+        """Forget everything, e.g. after documents were removed and positions shifted"""
+        self.postings = {}
+        self.indexed = 0
+    
+    def lookup(self, codes):
+        """Positions of documents mentioning any of the codes, in document order"""
+        doc_ids = set()
+        for code in codes:
+            doc_ids.update(self.postings.get(code.upper(), ()))
+        return sorted(doc_ids)
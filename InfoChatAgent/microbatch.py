@@ -0,0 +1,98 @@
+"""Micro-batching of concurrent embedding requests"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+class MicroBatcher:
+    """Runs concurrent single-text encodes as shared batched forward passes.
+    
+    Requests are queued; a worker thread takes the first waiting request,
+    collects more for up to ``max_wait_ms`` or until ``max_batch_size`` texts,
+    encodes them in one call and hands each caller its own vector. With the
+    default wait of 0 it batches whatever queued up during the previous
+    forward pass, so a lone request is never delayed. If encode fails or
+    returns the wrong number of vectors, every caller in the batch gets the
+    error; callers give up after ``timeout`` seconds.
+    """
+    
+    def __init__(self, encode, max_batch_size=None, max_wait_ms=None, timeout=None):
+        self.encode_batch = encode
+        self.max_batch_size = max_batch_size or int(os.getenv('EMBED_BATCH_SIZE', '32'))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv('EMBED_BATCH_WAIT_MS', '0'))
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout if timeout is not None else float(os.getenv('EMBED_TIMEOUT_S', '30'))
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._worker = None
+        self._lock = threading.Lock()
+    
+    def submit(self, text):
+        """Queue a text, returning a Future for its vector"""
+        self._ensure_worker()
+        future = Future()
+        self.requests.put((text, future))
+        return future
+    
+    def encode(self, text, timeout=None):
+        """Vector for one text, encoded together with whatever else is waiting.
+        
+        Raises TimeoutError if it takes longer than timeout seconds (default: the batcher's timeout).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(text)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()  # Dropped from its batch unless already being encoded
+            raise TimeoutError(f"No embedding within {timeout}s") from None
+    
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+    
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            # Skip requests whose callers timed out and cancelled them
+            batch = [(text, future) for text, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                vectors = self.encode_batch([text for text, _ in batch])
+                if len(vectors) != len(batch):
+                    raise ValueError(f"encode returned {len(vectors)} vectors for {len(batch)} texts")
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise  # e.g. SystemExit: stop; the next submit starts a new worker
+                continue
+            
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+    
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+        }
@@ -1,13 +1,13 @@
 import os
 import json
 from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
+from embedder import load_embedder
 import faiss
 import numpy as np
 
 class SimpleRAGAgent:
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = load_embedder('all-MiniLM-L6-v2')
         self.documents = []
         self.embeddings = None
         self.index = None
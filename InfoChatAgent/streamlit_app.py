@@ -1,10 +1,11 @@
 import streamlit as st
 import requests
 from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
-import faiss
+from embedder import load_embedder
 import numpy as np
 import re
+from error_codes import ErrorCodeIndex, find_error_codes
+from vector_index import compression_from_env, make_index, add_to_index, search_index
 
 # Page config
 st.set_page_config(
@@ -60,11 +61,13 @@ if 'show_history' not in st.session_state:
 
 class RAGAgent:
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = load_embedder('all-MiniLM-L6-v2')
         self.documents = []
         self.embeddings = None
         self.index = None
+        self.compression = compression_from_env()  # How the FAISS index stores vectors
         self.media_items = []  # Store images, videos, etc.
+        self.code_index = ErrorCodeIndex()  # Error code -> document positions
         
     def scrape_url(self, url):
         try:
@@ -72,6 +75,9 @@ class RAGAgent:
             response.raise_for_status()
             soup = BeautifulSoup(response.content, 'html.parser')
             
+            # Re-scraping a URL replaces its previous chunks and media
+            self.remove_url(url)
+            
             # Extract images
             images = soup.find_all('img')
             for img in images:
@@ -198,16 +204,35 @@ class RAGAgent:
         except Exception as e:
             return False, f"❌ Error: {str(e)}"
     
+    def remove_url(self, url):
+        """Drop a URL's documents and their vectors without re-encoding the rest"""
+        keep = [i for i, doc in enumerate(self.documents) if doc['source'] != url]
+        if len(keep) == len(self.documents):
+            return
+        
+        if self.embeddings is not None:
+            self.embeddings = self.embeddings[[i for i in keep if i < len(self.embeddings)]]
+        self.documents = [self.documents[i] for i in keep]
+        self.media_items = [item for item in self.media_items if item['source'] != url]
+        self.index = None  # Rebuilt from the stored vectors on the next build_index
+        self.code_index.clear()  # Positions shifted; re-indexed on the next ask
+    
     def build_index(self):
+        """Build the index, embedding only documents added since the last build"""
         if not self.documents:
             return False
         
-        texts = [doc['text'] for doc in self.documents]
-        self.embeddings = self.model.encode(texts)
+        embedded = 0 if self.embeddings is None else len(self.embeddings)
+        new_texts = [doc['text'] for doc in self.documents[embedded:]]
+        new_embeddings = self.model.encode(new_texts).astype('float32') if new_texts else None
         
-        dimension = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(self.embeddings.astype('float32'))
+        if self.index is None:
+            if new_embeddings is not None:
+                self.embeddings = new_embeddings if self.embeddings is None else np.vstack([self.embeddings, new_embeddings])
+            self.index = make_index(self.embeddings, self.compression)
+        elif new_embeddings is not None:
+            self.embeddings = np.vstack([self.embeddings, new_embeddings])
+            self.index = add_to_index(self.index, self.embeddings, new_embeddings, self.compression)
         
         return True
     
@@ -216,23 +241,21 @@ class RAGAgent:
             return []
         
         # Extract error code from question if present
-        error_code_pattern = r'\b(EV\d{3}|P\d{4}|U\d{4})\b'
-        error_codes = re.findall(error_code_pattern, question.upper())
+        error_codes = find_error_codes(question)
+        self.code_index.update(self.documents)  # Index documents scraped or re-added since the last question
         
-        # First, try exact keyword matching for error codes
+        # First, look error codes up in the postings map; no embedding needed
         if error_codes:
             exact_matches = []
-            for i, doc in enumerate(self.documents):
-                for code in error_codes:
-                    if code in doc['text'].upper():
-                        exact_matches.append({
-                            'text': doc['text'],
-                            'source': doc['source'],
-                            'relevance': 0.0,
-                            'media_url': doc.get('media_url'),
-                            'media_type': doc.get('media_type')
-                        })
-                        break
+            for i in self.code_index.lookup(error_codes):
+                doc = self.documents[i]
+                exact_matches.append({
+                    'text': doc['text'],
+                    'source': doc['source'],
+                    'relevance': 0.0,
+                    'media_url': doc.get('media_url'),
+                    'media_type': doc.get('media_type')
+                })
             
             if exact_matches:
                 # Remove duplicates and return exact matches first
@@ -246,7 +269,8 @@ class RAGAgent:
         
         # Fallback to semantic search
         question_embedding = self.model.encode([question])
-        distances, indices = self.index.search(question_embedding.astype('float32'), top_k)
+        distances, indices = search_index(self.index, self.embeddings, question_embedding.astype('float32'),
+                                          top_k, self.compression)
         
         results = []
         seen_texts = set()
@@ -326,7 +350,8 @@ with st.sidebar:
                 
                 if success:
                     st.session_state.agent.build_index()
-                    st.session_state.scraped_urls.append(url_input)
+                    if url_input not in st.session_state.scraped_urls:
+                        st.session_state.scraped_urls.append(url_input)
                     st.success(message)
                 else:
                     st.error(message)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Tests for the error-code postings map"""
+
+import random
+
+from error_codes import ErrorCodeIndex, find_error_codes
+
+def scan(documents, codes):
+    """Reference lookup: documents whose upper-cased text contains any of the codes"""
+    return [i for i, doc in enumerate(documents) if any(code in doc['text'].upper() for code in codes)]
+
+def test_find_error_codes_in_questions():
+    """Codes in questions are found in any case, but only as whole words"""
+    assert find_error_codes("How do I fix p0420 and EV001?") == ['P0420', 'EV001']
+    assert find_error_codes("What does XP04201 mean?") == []
+
+def test_update_indexes_only_new_documents():
+    """Codes are matched in any case, next to each other and inside longer tokens"""
+    documents = [{'text': "Error p0420 means the catalyst is below threshold"},
+                 {'text': "Codes P0420U0100 were logged together"},
+                 {'text': "ev0012 is shown while charging"}]
+    index = ErrorCodeIndex()
+    index.update(documents)
+    
+    assert index.lookup(['P0420']) == [0, 1]
+    assert index.lookup(['u0100']) == [1]
+    assert index.lookup(['EV001']) == [2]
+    assert index.lookup(['P0171']) == []
+    
+    documents.append({'text': "P0171 system too lean"})
+    index.update(documents)
+    assert index.indexed == 4
+    assert index.lookup(['P0171', 'U0100']) == [1, 3]
+    index.update(documents)  # Nothing new: no duplicate postings
+    assert index.lookup(['P0420']) == [0, 1]
+
+def test_clear_reindexes_shifted_documents():
+    """After removing documents, clear and update map codes to the new positions"""
+    documents = [{'text': "P0420 catalyst"}, {'text': "U0100 lost communication"}, {'text': "P0420 again"}]
+    index = ErrorCodeIndex()
+    index.update(documents)
+    
+    del documents[0]
+    index.clear()
+    assert index.lookup(['P0420']) == []
+    index.update(documents)
+    assert index.lookup(['P0420']) == [1]
+    assert index.lookup(['U0100']) == [0]
+
+def test_lookup_matches_a_linear_scan():
+    """The postings map returns the same documents as scanning every text"""
+    rng = random.Random(0)
+    codes = ['P0420', 'P0171', 'U0100', 'EV001', 'EV123']
+    words = ["battery", "charging", "warning", "reset"] + codes + [code.lower() for code in codes] + ["P04201"]
+    documents = [{'text': ' '.join(rng.choices(words, k=8))} for _ in range(200)]
+    index = ErrorCodeIndex()
+    index.update(documents)
+    
+    for code in codes:
+        assert index.lookup([code]) == scan(documents, [code])
+    assert index.lookup(['P0420', 'EV123']) == scan(documents, ['P0420', 'EV123'])
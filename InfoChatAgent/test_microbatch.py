@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Tests for the query micro-batcher"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from microbatch import MicroBatcher
+
+class FakeEncoder:
+    """Encodes "n" as [n], recording batches; blocks while the gate is closed"""
+    
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+    
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        self.started.set()
+        self.gate.wait()
+        return np.array([[float(text)] for text in texts], dtype=np.float32)
+
+class Interrupt(BaseException):
+    """Stands in for KeyboardInterrupt/SystemExit raised inside encode"""
+
+def test_concurrent_submits_share_a_batch_in_order():
+    """Requests queued during a forward pass are encoded together and each caller gets its own vector"""
+    encoder = FakeEncoder()
+    batcher = MicroBatcher(encoder, max_batch_size=8, max_wait_ms=0)
+    encoder.gate.clear()
+    first = batcher.submit("0")
+    assert encoder.started.wait(5)
+    
+    futures = [batcher.submit(str(i)) for i in range(1, 6)]
+    encoder.gate.set()
+    assert first.result(5)[0] == 0
+    assert [future.result(5)[0] for future in futures] == [1, 2, 3, 4, 5]
+    assert encoder.batches == [["0"], ["1", "2", "3", "4", "5"]]
+    assert batcher.stats() == {'batches': 2, 'items': 6, 'mean_batch_size': 3.0}
+
+def test_batches_are_capped_at_max_batch_size():
+    encoder = FakeEncoder()
+    batcher = MicroBatcher(encoder, max_batch_size=2, max_wait_ms=0)
+    encoder.gate.clear()
+    first = batcher.submit("0")
+    assert encoder.started.wait(5)
+    
+    futures = [batcher.submit(str(i)) for i in range(1, 6)]
+    encoder.gate.set()
+    assert [future.result(5)[0] for future in [first] + futures] == [0, 1, 2, 3, 4, 5]
+    assert [len(batch) for batch in encoder.batches] == [1, 2, 2, 1]
+
+def test_encode_errors_reach_every_caller_in_the_batch():
+    """An exception fails the whole batch and the worker keeps serving"""
+    def encode(texts):
+        if "c" not in texts:
+            raise ValueError("model failed")
+        return np.ones((len(texts), 2), dtype=np.float32)
+    
+    batcher = MicroBatcher(encode, max_wait_ms=50)
+    futures = [batcher.submit(text) for text in ("a", "b")]
+    for future in futures:
+        with pytest.raises(ValueError, match="model failed"):
+            future.result(5)
+    assert batcher.encode("c", timeout=5).tolist() == [1.0, 1.0]
+
+def test_missing_vectors_fail_the_batch():
+    """Callers are not left waiting when encode returns fewer rows than texts"""
+    batcher = MicroBatcher(lambda texts: np.ones((len(texts) - 1, 2), dtype=np.float32), max_wait_ms=50)
+    futures = [batcher.submit(text) for text in ("a", "b", "c")]
+    for future in futures:
+        with pytest.raises(ValueError, match=r"returned \d+ vectors for \d+ texts"):
+            future.result(5)
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_base_exceptions_fail_the_batch_and_the_worker_restarts():
+    calls = []
+    
+    def encode(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            raise Interrupt()
+        return np.zeros((len(texts), 2), dtype=np.float32)
+    
+    batcher = MicroBatcher(encode)
+    with pytest.raises(Interrupt):
+        batcher.submit("a").result(5)
+    batcher._worker.join(5)
+    assert batcher.encode("b", timeout=5).tolist() == [0.0, 0.0]
+
+def test_encode_times_out_and_skips_the_abandoned_request():
+    encoder = FakeEncoder()
+    batcher = MicroBatcher(encoder, max_wait_ms=0, timeout=0.05)
+    encoder.gate.clear()
+    blocking = batcher.submit("0")
+    assert encoder.started.wait(5)
+    
+    with pytest.raises(TimeoutError):
+        batcher.encode("1")  # Queued behind the blocked pass, then cancelled
+    encoder.gate.set()
+    assert blocking.result(5)[0] == 0
+    assert batcher.encode("2", timeout=5)[0] == 2
+    assert encoder.batches == [["0"], ["2"]]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Tests for compressed FAISS indexes and their incremental updates"""
+
+import numpy as np
+
+from vector_index import make_index, add_to_index, search_index
+
+def grow(embeddings, index, new_embeddings, compression):
+    embeddings = np.vstack([embeddings, new_embeddings]).astype(np.float32)
+    return embeddings, add_to_index(index, embeddings, new_embeddings, compression)
+
+def test_vectors_outside_the_trained_range_are_still_found():
+    """A later vector beyond the first batch's range retrains the quantizer instead of being clipped"""
+    # Ten copies of the range's corner: a clipped (3, 0) would tie with them and miss the shortlist
+    embeddings = np.array([[1.0, 0.0]] * 10 + [[0.0, 1.0], [0.5, 0.5]], dtype=np.float32)
+    index = make_index(embeddings, 'sq8')
+    
+    outlier = np.array([[3.0, 0.0]], dtype=np.float32)
+    embeddings, index = grow(embeddings, index, outlier, 'sq8')
+    _, indices = search_index(index, embeddings, outlier, 1, 'sq8')
+    assert indices[0].tolist() == [12]
+    assert index.ntotal == 13
+
+def test_small_in_range_adds_keep_the_trained_index():
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((100, 8), dtype=np.float32)
+    index = make_index(embeddings, 'sq8')
+    
+    new = embeddings[:5] * 0.5 + 0.25
+    embeddings, grown = grow(embeddings, index, new, 'sq8')
+    assert grown is index and grown.ntotal == 105
+    _, indices = search_index(grown, embeddings, new[:1], 1, 'sq8')
+    assert indices[0].tolist() == [100]
+    
+    # A large add retrains even within range
+    embeddings, retrained = grow(embeddings, grown, embeddings[:30], 'sq8')
+    assert retrained is not grown and retrained.ntotal == 135
+
+def test_uncompressed_and_fp16_indexes_are_never_rebuilt():
+    rng = np.random.default_rng(1)
+    for compression in ('none', 'fp16'):
+        embeddings = rng.random((10, 4), dtype=np.float32)
+        index = make_index(embeddings, compression)
+        new = rng.random((20, 4), dtype=np.float32) * 10
+        embeddings, grown = grow(embeddings, index, new, compression)
+        assert grown is index and grown.ntotal == 30
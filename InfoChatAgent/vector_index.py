@@ -0,0 +1,70 @@
+"""FAISS indexes with optional compressed (scalar-quantized) vector storage"""
+
+import os
+import faiss
+import numpy as np
+
+# float16 halves the index's memory, 8-bit scalar quantization quarters it
+QUANTIZER_TYPES = {
+    'fp16': faiss.ScalarQuantizer.QT_fp16,
+    'sq8': faiss.ScalarQuantizer.QT_8bit,
+}
+COMPRESSION_MODES = ('none',) + tuple(QUANTIZER_TYPES)
+RESCORE_FACTOR = 4  # Shortlist size as a multiple of top_k
+RETRAIN_FRACTION = 0.25  # Retrain a quantizer once a single add grows the index by this much
+
+def compression_from_env():
+    """Compression mode from VECTOR_COMPRESSION (none, fp16 or sq8)"""
+    compression = os.getenv('VECTOR_COMPRESSION', 'none')
+    if compression not in COMPRESSION_MODES:
+        raise ValueError(f"VECTOR_COMPRESSION must be one of {COMPRESSION_MODES}, got {compression!r}")
+    return compression
+
+def make_index(embeddings, compression='none'):
+    """L2 index over embeddings, storing them compressed unless compression is 'none'"""
+    dimension = embeddings.shape[1]
+    if compression == 'none':
+        index = faiss.IndexFlatL2(dimension)
+    else:
+        index = faiss.IndexScalarQuantizer(dimension, QUANTIZER_TYPES[compression], faiss.METRIC_L2)
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+def add_to_index(index, embeddings, new_embeddings, compression='none'):
+    """Add new_embeddings, already appended to embeddings, returning the index to use from now on.
+    
+    An 8-bit scalar quantizer clips values outside the per-dimension ranges
+    it was trained on, and rescoring cannot recover vectors clipped out of the
+    shortlist. So when new vectors leave those ranges, or are a large share of
+    the index, a fresh index is trained over all embeddings instead.
+    """
+    if compression != 'none' and needs_retraining(index, new_embeddings):
+        return make_index(embeddings, compression)
+    index.add(new_embeddings)
+    return index
+
+def needs_retraining(index, new_embeddings):
+    """Whether adding new_embeddings to a scalar-quantized index would lose precision"""
+    trained = faiss.vector_to_array(index.sq.trained)
+    if not len(trained):
+        return False  # float16 is not trained
+    if len(new_embeddings) >= RETRAIN_FRACTION * index.ntotal:
+        return True
+    vmin, vdiff = trained[:index.d], trained[index.d:]
+    return bool(((new_embeddings < vmin) | (new_embeddings > vmin + vdiff)).any())
+
+def search_index(index, embeddings, query_embedding, top_k, compression='none'):
+    """(distances, indices) for one query, like index.search.
+    
+    Compressed indexes only pick a shortlist, which is re-ranked by exact L2
+    distance to the float32 embeddings.
+    """
+    if compression == 'none':
+        return index.search(query_embedding, top_k)
+    
+    _, shortlist = index.search(query_embedding, min(top_k * RESCORE_FACTOR, index.ntotal))
+    candidates = shortlist[0][shortlist[0] >= 0]
+    distances = ((embeddings[candidates] - query_embedding[0]) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind='stable')[:top_k]
+    return distances[order][None, :], candidates[order][None, :]